@@ -0,0 +1,157 @@
+# encoding: utf-8
+#
+# Copyright (C) 2012 Chris Jerdonek. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * The names of the copyright holders may not be used to endorse or promote
+#   products derived from this software without specific prior written
+#   permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Exposes functions to inspect parsed Mustache templates without rendering them.
+
+"""
+
+from __future__ import absolute_import
+
+# The parse tree is made of Pystache-internal node classes.
+from pystache.parser import (_EscapeNode, _InvertedNode, _LiteralNode,
+                             _PartialNode, _SectionNode)
+
+
+TAG_INVERTED = 'inverted'
+TAG_PARTIAL = 'partial'
+TAG_SECTION = 'section'
+TAG_VARIABLE = 'variable'
+
+_NODE_KINDS = {
+    _EscapeNode: TAG_VARIABLE,
+    _InvertedNode: TAG_INVERTED,
+    _LiteralNode: TAG_VARIABLE,
+    _PartialNode: TAG_PARTIAL,
+    _SectionNode: TAG_SECTION,
+}
+
+
+def iter_tags(parsed):
+    """
+    Yield a (kind, key) pair for each tag in a parsed template, depth first.
+
+    Comment and set-delimiter tags are skipped.  Tags inside sections are
+    yielded once, regardless of how many times the section would render.
+
+    Arguments:
+
+      parsed: a pystache ParsedTemplate instance.
+
+    """
+    for node in parsed._parse_tree:
+        kind = _NODE_KINDS.get(type(node))
+        if kind is None:
+            # Then the node is a string, comment, or delimiter change.
+            continue
+        yield kind, node.key
+        if kind == TAG_SECTION:
+            section = node.parsed
+        elif kind == TAG_INVERTED:
+            section = node.parsed_section
+        else:
+            continue
+        for tag in iter_tags(section):
+            yield tag
+
+
+def count_calls(parsed, names, get_partial=None, _partials=()):
+    """
+    Return the number of tags in a parsed template that call one of the given names.
+
+    Tags in sections are counted once, so the count is an estimate of the
+    number of calls when rendering.
+
+    Arguments:
+
+      names: the keys to count, for example the names of the lambdas.
+
+      get_partial: a function that accepts a partial name and returns the
+        parsed partial, or None if not found.  If given, tags in partials
+        are counted at each place the partial is included.  Recursive
+        partials are counted to one level.
+
+    """
+    count = 0
+    for kind, key in iter_tags(parsed):
+        if kind == TAG_PARTIAL:
+            if get_partial is None or key in _partials:
+                continue
+            partial = get_partial(key)
+            if partial is not None:
+                count += count_calls(partial, names, get_partial,
+                                     _partials + (key, ))
+            continue
+        if key in names:
+            count += 1
+    return count
+
+
+def _get_root_key(key):
+    """
+    Return the name of the context value that a tag key starts from.
+
+    """
+    return key.split('.', 1)[0]
+
+
+def find_dependencies(parsed, get_partial=None, _partials=None):
+    """
+    Return the context keys and partials that a parsed template uses.
+
+    Returns a (keys, partials) pair of sets.  The keys are the first part
+    of each dotted tag name, and do not include the implicit iterator
+    ".".  A key inside a section may be looked up in the section's
+    context rather than the top-level context, so the keys are a superset
+    of the top-level keys used.
+
+    Arguments:
+
+      get_partial: a function that accepts a partial name and returns the
+        parsed partial, or None if not found.  If given, the keys and
+        partials used by the included partials are included.
+
+    """
+    keys = set()
+    if _partials is None:
+        _partials = set()
+    for kind, key in iter_tags(parsed):
+        if kind != TAG_PARTIAL:
+            if key != '.':
+                keys.add(_get_root_key(key))
+            continue
+        if key in _partials:
+            continue
+        _partials.add(key)
+        if get_partial is None:
+            continue
+        partial = get_partial(key)
+        if partial is not None:
+            keys.update(find_dependencies(partial, get_partial, _partials)[0])
+    return keys, _partials
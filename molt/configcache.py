@@ -0,0 +1,156 @@
+# encoding: utf-8
+#
+# Copyright (C) 2012 Chris Jerdonek. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * The names of the copyright holders may not be used to endorse or promote
+#   products derived from this software without specific prior written
+#   permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Exposes a ConfigCache class to avoid re-parsing config files.
+
+"""
+
+from __future__ import absolute_import
+
+import hashlib
+import logging
+import marshal
+import os
+from threading import Lock
+
+from molt import defaults
+from molt.general import io
+from molt.general.cache import DiskCache
+
+
+_log = logging.getLogger(__name__)
+
+# The name of the subdirectory of a cache directory holding configs.
+CACHE_SUBDIR_NAME = 'configs'
+
+
+def _make_key(path, encoding, errors):
+    """
+    Return the cache key for a config file, from its path and stat() info.
+
+    A file that changes gets a new key without being read.
+
+    """
+    info = os.stat(path)
+    digest = hashlib.sha1()
+    key = ("%s\0%r\0%d\0%d\0%s\0%s" %
+           (os.path.abspath(path), info.st_mtime, info.st_size, info.st_ino,
+            encoding, errors))
+    if isinstance(key, unicode):
+        # Hashing needs bytes (e.g. under Python 3).
+        key = key.encode('utf-8')
+    digest.update(key)
+    return digest.hexdigest()
+
+
+class ConfigCache(object):
+
+    """
+    Caches deserialized config files in memory and optionally on disk.
+
+    Configs are stored in marshal format, which loads much faster than
+    JSON or YAML can be parsed.  Each load returns a new copy, so callers
+    can modify the data they get.  Configs with values that marshal does
+    not support (e.g. YAML dates) are not cached.
+
+    """
+
+    def __init__(self, cache_dir=None, max_entries=None):
+        """
+        Arguments:
+
+          cache_dir: the directory in which to persist configs, in a
+            subdirectory.  If None, configs are cached only in memory.
+
+          max_entries: the maximum number of configs to keep in the cache
+            directory.  Defaults to the package default.
+
+        """
+        if max_entries is None:
+            max_entries = defaults.CONFIG_CACHE_SIZE
+
+        disk_cache = (None if cache_dir is None else
+                      DiskCache(os.path.join(cache_dir, CACHE_SUBDIR_NAME),
+                                max_entries=max_entries))
+
+        self._disk_cache = disk_cache
+        self._lock = Lock()
+        # A dictionary mapping each path to a (key, marshal bytes) pair.
+        self._configs = {}
+
+        self.disk_hits = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _get_bytes(self, path, key):
+        entry = self._configs.get(path)
+        if entry is not None and entry[0] == key:
+            self._count('hits')
+            return entry[1]
+        disk_cache = self._disk_cache
+        if disk_cache is None:
+            return None
+        b = disk_cache.get(key)
+        if b is None:
+            return None
+        self._count('hits')
+        self._count('disk_hits')
+        self._configs[path] = (key, b)
+        return b
+
+    def load(self, path, encoding, errors):
+        """
+        Deserialize the JSON or YAML file at the given path.
+
+        """
+        key = _make_key(path, encoding, errors)
+        b = self._get_bytes(path, key)
+        if b is not None:
+            return marshal.loads(b)
+
+        self._count('misses')
+        data = io.deserialize(path, encoding, errors)
+        try:
+            b = marshal.dumps(data)
+        except ValueError, err:
+            _log.debug("not caching config: %s: %s" % (path, err))
+            return data
+        self._configs[path] = (key, b)
+        if self._disk_cache is not None:
+            self._disk_cache.set(key, b)
+        return data
+
+    def log_stats(self):
+        _log.debug("config cache: %d hits (%d from disk), %d misses" %
+                   (self.hits, self.disk_hits, self.misses))
@@ -42,3 +42,17 @@ import molt.test
 EXIT_STATUS_SUCCESS = 0
 EXIT_STATUS_FAIL = 1
 EXIT_STATUS_USAGE_ERROR = 2
+
+# The constants below are defined here rather than in the modules using
+# them so that parsing arguments does not import those modules.
+
+# The file name extensions of the archive formats (see general.archive).
+ARCHIVE_EXTENSIONS = ['.tar', '.tar.bz2', '.tar.gz', '.tgz', '.zip']
+
+# The ways of copying files (see general.io.copy_file()), the first
+# being the default.
+COPY_MODES = ('copy', 'reflink', 'hardlink', 'symlink')
+
+# The name of the file in an output directory recording what was rendered
+# there, for incremental rendering.
+MANIFEST_FILE_NAME = '.molt-manifest.json'
@@ -44,6 +44,25 @@ LAMBDA_ENCODING = _DEFAULT_ENCODING
 OUTPUT_FILE_ENCODING = _DEFAULT_ENCODING
 ENCODING_ERRORS = 'strict'
 
+# The number of files to render concurrently.
+RENDER_JOBS = 1
+
+# The rendered size in characters at or above which rendered output is
+# written to the output file as it renders.
+STREAM_THRESHOLD = 1024 * 1024
+
+# The maximum number of parsed templates to keep in memory and in a cache
+# directory.
+TEMPLATE_CACHE_SIZE = 1000
+
+# The maximum number of lambda results to keep in memory and in a cache
+# directory.
+LAMBDA_CACHE_SIZE = 10000
+
+# The maximum number of deserialized config files to keep in a cache
+# directory.
+CONFIG_CACHE_SIZE = 100
+
 _OUTPUT_PARENT_DIR = 'temp'
 _OUTPUT_DIR_NAME = 'output'
 _OUTPUT_DIR_NAME_DEMO = 'demo-template'
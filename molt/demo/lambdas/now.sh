@@ -1,3 +1,5 @@
 #!/bin/bash
+# The output changes over time, so results must not be cached.
+# molt-lambda: impure
 # The -n suppresses the trailing newline.
 echo -n $(date)
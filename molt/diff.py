@@ -151,6 +151,68 @@ class _DiffDescriber(object):
         return report
 
 
+def _common_prefix_length(u1, u2):
+    """
+    Return the length of the longest common prefix of two strings.
+
+    >>> _common_prefix_length("abc", "abx")
+    2
+
+    """
+    for index, (char1, char2) in enumerate(itertools.izip(u1, u2)):
+        if char1 != char2:
+            return index
+    return min(len(u1), len(u2))
+
+
+def _longest_prefix_found(text, part, start, limit):
+    """
+    Return the length of the longest prefix of part found in text.
+
+    Only occurrences beginning at an index from start to limit
+    (inclusive) count.  The text is scanned once from left to right
+    using the Knuth-Morris-Pratt algorithm, so the running time is
+    linear in the lengths of the text and part.
+
+    >>> _longest_prefix_found("xxabcxab", "abd", 0, 8)
+    2
+    >>> _longest_prefix_found("xxabcxab", "abd", 0, 1)
+    0
+
+    """
+    if not part:
+        return 0
+    # failure[i] is the length of the longest proper prefix of part[:i + 1]
+    # that is also a suffix of it.
+    failure = [0] * len(part)
+    length = 0
+    for i in xrange(1, len(part)):
+        char = part[i]
+        while length and char != part[length]:
+            length = failure[length - 1]
+        if char == part[length]:
+            length += 1
+        failure[i] = length
+    best = 0
+    length = 0
+    # Occurrences beginning at or before limit can end at most this far.
+    stop = min(len(text), limit + len(part))
+    for i in xrange(start, stop):
+        char = text[i]
+        while length and char != part[length]:
+            length = failure[length - 1]
+        if char == part[length]:
+            length += 1
+        # Shorten the match until it begins at or before the limit.
+        while length and i - length + 1 > limit:
+            length = failure[length - 1]
+        if length > best:
+            best = length
+            if best == len(part):
+                break
+    return best
+
+
 # TODO: switch from using this to the _LineDiffer class below.
 def match_fuzzy(u1, u2, marker=None):
     if marker is None:
@@ -216,18 +278,92 @@ class _LineComparer(object):
         # TODO: switch from $ to \Z and add a test case for this difference.
         return "%s$" % self._re_pattern(parts)
 
-    def _lines_equal(self, lines):
+    def compile_line(self, expected):
+        """
+        Return a compiled pattern for an expected line, or None.
+
+        Returns None if the line has no fuzz, in which case the line
+        should be compared exactly.
+
+        """
+        if not self.has_fuzz(expected):
+            return None
+        return re.compile(self.re_pattern(expected))
+
+    def compile_seq(self, expected_lines):
+        """
+        Group a sequence of expected lines into runs for comparing.
+
+        Returns a list of (start, stop, pattern) triples covering the
+        sequence in order.  Each run is either a maximal run of lines
+        without fuzz, in which case the pattern is None, or a single
+        line with fuzz and its compiled pattern.  A fuzzy line repeated
+        in the sequence is compiled only once.
+
+        """
+        runs = []
+        patterns = {}
+        start = 0
+        for index, line in enumerate(expected_lines):
+            if not self.has_fuzz(line):
+                continue
+            if start < index:
+                runs.append((start, index, None))
+            try:
+                pattern = patterns[line]
+            except KeyError:
+                pattern = self.compile_line(line)
+                patterns[line] = pattern
+            runs.append((index, index + 1, pattern))
+            start = index + 1
+        if start < len(expected_lines):
+            runs.append((start, len(expected_lines), None))
+        return runs
+
+    def _lines_equal(self, lines, pattern=None):
         """
         Return whether the given lines are equal.
 
         Neither line should contain a newline before the last character.
 
+        Parameters:
+
+          pattern: the compiled pattern of the expected line, if the
+            line has fuzz.  Defaults to compiling the line.
+
         """
         line1, line2 = lines
-        if not self.has_fuzz(line2):
-            return line1 == line2
+        if pattern is None:
+            pattern = self.compile_line(line2)
+            if pattern is None:
+                return line1 == line2
         # Otherwise, use fuzzy matching.
-        return re.match(self.re_pattern(line2), line1) is not None
+        return pattern.match(line1) is not None
+
+    def _find_unequal(self, seqs):
+        """
+        Return the index of the first unequal pair of lines, or None.
+
+        Only the lines up to the length of the shorter sequence are
+        compared.  Runs of lines without fuzz are compared with a single
+        list comparison before falling back to comparing line by line.
+
+        """
+        actual, expected = seqs
+        count = min(len(actual), len(expected))
+        for start, stop, pattern in self.compile_seq(expected[:count]):
+            if pattern is not None:
+                if not self._lines_equal((actual[start], expected[start]),
+                                         pattern=pattern):
+                    return start
+                continue
+            if actual[start:stop] == expected[start:stop]:
+                continue
+            # Otherwise, find the first differing line in the run.
+            for index in xrange(start, stop):
+                if actual[index] != expected[index]:
+                    return index
+        return None
 
     def _compare_lines_exact(self, lines):
         """
@@ -260,6 +396,11 @@ class _LineComparer(object):
         """
         Return the pair of indices at which the two lines differ.
 
+        The expected index is the end of the longest initial segment of
+        the expected line that matches an initial segment of the actual
+        line, and the actual index is the end of that match.  The lines
+        are scanned once from left to right.
+
         Parameters:
 
           lines: a pair of unicode strings that compare differently.
@@ -280,17 +421,33 @@ class _LineComparer(object):
 
         """
         line1, line2 = lines
-        line2_parts = self._expected_parts(line2)
-        while True:
-            m = re.match(self._re_pattern(line2_parts), line1)
-            if m is not None:
-                # Then the initial segment matches.
+        parts = self._expected_parts(line2)
+        # The first part must match at the beginning of the line.
+        first = parts[0]
+        index = _common_prefix_length(line1, first)
+        if index < len(first) or len(parts) == 1:
+            return (index, index)
+        limit = -1
+        for part_index in xrange(1, len(parts)):
+            part = parts[part_index]
+            start = index
+            # The fuzz matches any characters but a newline, so the part
+            # must begin at or before the next newline.
+            if limit < start:
+                limit = line1.find("\n", start)
+                if limit < 0:
+                    limit = len(line1)
+            found = line1.find(part, start, limit + len(part))
+            if found < 0:
+                # Then the line stops matching in this part.
+                part = part[:_longest_prefix_found(line1, part, start, limit)]
                 break
-            if not line2_parts[-1]:
-                line2_parts.pop()
-            # Remove the last character from the last string.
-            line2_parts[-1] = line2_parts[-1][:-1]
-        return tuple(len(s) for s in (m.group(0), self.fuzz.join(line2_parts)))
+            index = found + len(part)
+        # Like the greedy regular expression ".*", the actual index is the
+        # end of the last occurrence of the final (partial) part.
+        index = line1.rfind(part, start, limit + len(part)) + len(part)
+        expected = self.fuzz.join(parts[:part_index] + [part])
+        return (index, len(expected))
 
     def _compare_lines(self, lines):
         """
@@ -313,19 +470,18 @@ class _LineComparer(object):
         returns None.
 
         """
-        for line_index, lines in enumerate(zip(*seqs)):
-            if self._lines_equal(lines):
-                continue
-            # Otherwise, the lines are different.
+        line_index = self._find_unequal(seqs)
+        if line_index is not None:
+            lines = tuple(seq[line_index] for seq in seqs)
             char_indices = self._compare_lines(lines)
-            break
         else:
             # Then all of the initial lines were equal.
-            if len(seqs[0]) == len(seqs[1]):
+            lengths = [len(seq) for seq in seqs]
+            if lengths[0] == lengths[1]:
                 return None
             # Otherwise, one sequence has more lines, in which case
             # character indices do not apply.
-            line_index += 1
+            line_index = min(lengths)
             char_indices = None
         return _DiffInfo(line_index=line_index, char_indices=char_indices)
 
@@ -385,10 +541,15 @@ class _FileComparer(object):
         return self.scomparer.compare_strings(strs)
 
 
-class Customizer(object):
+class Customizer(dirdiff.Customizer):
 
     """Customizes DirComparer behavior."""
 
+    # Identical files always match, even if the expected file has fuzz,
+    # so DirComparer need only decode and compare the lines of files
+    # whose bytes differ.
+    same_if_identical = True
+
     def __init__(self, fcomparer):
         """
         Parameters:
@@ -451,19 +612,27 @@ class Comparer(object):
 
     """
 
-    def __init__(self, fuzz=None, context=None):
+    def __init__(self, fuzz=None, context=None, jobs=None):
+        """
+        Parameters:
+
+          jobs: the number of files to compare concurrently when
+            comparing directories.  Defaults to 1.
+
+        """
         if context is None:
             context = defaults.DIFF_CONTEXT
         if fuzz is None:
             fuzz = defaults.DIFF_FUZZ
         self.context = context
         self.fuzz = fuzz
+        self.jobs = jobs
 
     def _dir_comparer(self):
         scomparer = _StringComparer(fuzz=self.fuzz, context=self.context)
         fcomparer = _FileComparer(scomparer=scomparer)
         customizer = Customizer(fcomparer=fcomparer)
-        return dirdiff.DirComparer(custom=customizer)
+        return dirdiff.DirComparer(custom=customizer, jobs=self.jobs)
 
     def compare_strings(self, strs):
         """
@@ -0,0 +1,220 @@
+# encoding: utf-8
+#
+# Copyright (C) 2012 Chris Jerdonek. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * The names of the copyright holders may not be used to endorse or promote
+#   products derived from this software without specific prior written
+#   permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Exposes an ArchiveWriter class for writing reproducible tar and zip files.
+
+"""
+
+from __future__ import absolute_import
+
+import gzip
+from io import BytesIO
+import logging
+import os
+import stat
+import tarfile
+import zipfile
+
+from molt.constants import ARCHIVE_EXTENSIONS
+from molt.general.error import Error
+
+
+_log = logging.getLogger(__name__)
+
+# The earliest timestamp a zip file can hold, 1980-01-01 00:00:00 UTC.
+# We use it for tar files, too, so the two formats agree.
+ARCHIVE_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+ARCHIVE_MTIME = 315532800
+
+# A mapping from file name extension to tarfile mode.  These extensions
+# and ZIP_EXTENSION make up constants.ARCHIVE_EXTENSIONS.
+_TAR_MODES = {
+    '.tar': 'w',
+    '.tar.bz2': 'w:bz2',
+    '.tar.gz': None,  # We compress ourselves to control the gzip header.
+    '.tgz': None,
+}
+ZIP_EXTENSION = '.zip'
+
+
+def get_archive_extension(path):
+    """
+    Return the archive file name extension of a path, or None if not an archive.
+
+    """
+    for ext in ARCHIVE_EXTENSIONS:
+        if path.endswith(ext):
+            return ext
+    return None
+
+
+def get_file_mode(path):
+    """
+    Return the normalized permission bits to record for a file.
+
+    """
+    mode = os.stat(path).st_mode
+    return 0755 if mode & stat.S_IXUSR else 0644
+
+
+class ArchiveWriter(object):
+
+    """
+    Writes files to a tar or zip archive reproducibly.
+
+    Entries get a fixed timestamp, owner, and permissions (keeping only
+    whether a file is executable), so that adding the same entries in the
+    same order gives byte-identical archives.  Callers are responsible for
+    adding entries in a deterministic order.
+
+    """
+
+    def __init__(self, path):
+        """
+        Arguments:
+
+          path: the path of the archive to create.  The format is chosen
+            by the file name extension: .zip, .tar, .tar.gz, .tgz, or
+            .tar.bz2.
+
+        """
+        ext = get_archive_extension(path)
+        if ext is None:
+            raise Error("Unsupported archive extension: %s" % path)
+
+        self._file = open(path, 'wb')
+        self._gzip_file = None
+        self._tar_file = None
+        self._zip_file = None
+
+        if ext == ZIP_EXTENSION:
+            self._zip_file = zipfile.ZipFile(self._file, 'w', zipfile.ZIP_DEFLATED)
+            return
+        mode = _TAR_MODES[ext]
+        fileobj = self._file
+        if mode is None:
+            # The gzip header would otherwise hold the current time.
+            self._gzip_file = gzip.GzipFile(filename='', mode='wb', fileobj=fileobj,
+                                            mtime=0)
+            fileobj = self._gzip_file
+            mode = 'w'
+        self._tar_file = tarfile.open(mode=mode, fileobj=fileobj,
+                                      format=tarfile.GNU_FORMAT)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def _make_tar_info(self, name, entry_type, mode, size=0):
+        info = tarfile.TarInfo(name)
+        info.type = entry_type
+        info.mode = mode
+        info.mtime = ARCHIVE_MTIME
+        info.size = size
+        # The defaults of the remaining fields do not depend on the system.
+        return info
+
+    def _make_zip_info(self, name, mode):
+        info = zipfile.ZipInfo(name, date_time=ARCHIVE_DATE_TIME)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        # Record Unix permissions regardless of the current platform.
+        info.create_system = 3
+        info.external_attr = mode << 16
+        return info
+
+    def add_dir(self, name):
+        """
+        Add a directory entry.
+
+        Arguments:
+
+          name: the path of the directory in the archive, using "/" as
+            the separator.
+
+        """
+        if self._zip_file is not None:
+            info = self._make_zip_info(name + '/', stat.S_IFDIR | 0755)
+            info.compress_type = zipfile.ZIP_STORED
+            # The MS-DOS directory flag.
+            info.external_attr |= 0x10
+            self._zip_file.writestr(info, b'')
+            return
+        info = self._make_tar_info(name, tarfile.DIRTYPE, 0755)
+        self._tar_file.addfile(info)
+
+    def add_bytes(self, name, b, mode=0644):
+        """
+        Add a file entry with the given contents.
+
+        """
+        if self._zip_file is not None:
+            info = self._make_zip_info(name, stat.S_IFREG | mode)
+            self._zip_file.writestr(info, b)
+            return
+        info = self._make_tar_info(name, tarfile.REGTYPE, mode, size=len(b))
+        self._tar_file.addfile(info, BytesIO(b))
+
+    def add_file(self, name, path, mode=None):
+        """
+        Add a file entry with the contents of the file at a path.
+
+        Tar entries are copied from the file in chunks.  Zip entries are
+        read into memory first, since Python 2's zipfile module cannot
+        write an entry from a file with a given timestamp.
+
+        Arguments:
+
+          mode: the permission bits to record.  Defaults to 0755 if the
+            file is executable and otherwise 0644.
+
+        """
+        if mode is None:
+            mode = get_file_mode(path)
+        if self._zip_file is not None:
+            with open(path, 'rb') as f:
+                b = f.read()
+            self.add_bytes(name, b, mode)
+            return
+        info = self._make_tar_info(name, tarfile.REGTYPE, mode,
+                                   size=os.path.getsize(path))
+        with open(path, 'rb') as f:
+            self._tar_file.addfile(info, f)
+
+    def close(self):
+        if self._zip_file is not None:
+            self._zip_file.close()
+        if self._tar_file is not None:
+            self._tar_file.close()
+        if self._gzip_file is not None:
+            self._gzip_file.close()
+        self._file.close()
+
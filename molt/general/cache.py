@@ -0,0 +1,208 @@
+# encoding: utf-8
+#
+# Copyright (C) 2012 Chris Jerdonek. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * The names of the copyright holders may not be used to endorse or promote
+#   products derived from this software without specific prior written
+#   permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Exposes a DiskCache class for persisting values across processes.
+
+"""
+
+from __future__ import absolute_import
+
+from collections import OrderedDict
+import cPickle as pickle
+import logging
+import os
+from tempfile import mkstemp
+from threading import Lock
+
+
+_log = logging.getLogger(__name__)
+
+CACHE_FILE_EXT = '.pickle'
+
+
+class DiskCache(object):
+
+    """
+    A key-value store that pickles each value to a file in a directory.
+
+    Entries are evicted least-recently-used first once the directory
+    holds more than max_entries entries.  The modification time of an
+    entry's file records when the entry was last used.
+
+    To avoid listing the directory on every write, each instance lists it
+    once on first use and then tracks the entries and their order in
+    memory.  Once over capacity, it evicts a batch of entries down to 90%
+    of max_entries.  Entries written by other processes in the meantime
+    are counted the next time an instance lists the directory.
+
+    """
+
+    def __init__(self, dir_path, max_entries=None):
+        """
+        Arguments:
+
+          dir_path: the cache directory, which is created if necessary.
+
+          max_entries: the maximum number of entries to keep.  If None,
+            entries are never evicted.
+
+        """
+        self.dir_path = dir_path
+        self.max_entries = max_entries
+        # An OrderedDict whose keys are the entry keys, least recently used
+        # first, or None if not yet loaded.  See _get_index().
+        self._index = None
+        self._lock = Lock()
+
+    def _make_path(self, key):
+        return os.path.join(self.dir_path, key + CACHE_FILE_EXT)
+
+    def _make_dir(self):
+        try:
+            os.makedirs(self.dir_path)
+        except OSError:
+            # Then most likely the directory already exists.
+            if not os.path.isdir(self.dir_path):
+                raise
+
+    def _get_index(self):
+        """
+        Return the index of entries, listing the directory if not yet loaded.
+
+        This method should be called with the lock held.
+
+        """
+        if self._index is not None:
+            return self._index
+        entries = []
+        try:
+            names = os.listdir(self.dir_path)
+        except OSError:
+            # Then the directory does not exist yet.
+            names = []
+        for name in names:
+            if not name.endswith(CACHE_FILE_EXT):
+                continue
+            try:
+                mtime = os.path.getmtime(os.path.join(self.dir_path, name))
+            except OSError:
+                # Then another process removed the entry.
+                continue
+            entries.append((mtime, name[:-len(CACHE_FILE_EXT)]))
+        entries.sort()
+        self._index = OrderedDict((key, None) for mtime, key in entries)
+        return self._index
+
+    def _touch(self, key):
+        """
+        Mark an entry as the most recently used in the index.
+
+        """
+        if self.max_entries is None:
+            return
+        with self._lock:
+            index = self._get_index()
+            index.pop(key, None)
+            index[key] = None
+
+    def get(self, key):
+        """
+        Return the value for the given key, or None if not present.
+
+        Arguments:
+
+          key: a string usable as a file name (e.g. a hex digest).
+
+        """
+        path = self._make_path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except IOError:
+            # Then the entry does not exist.
+            return None
+        except Exception, err:
+            # Then the entry is unreadable (e.g. a truncated file), which we
+            # treat as a miss so the entry gets rewritten.
+            _log.debug("ignoring bad cache entry: %s: %r" % (path, err))
+            return None
+        try:
+            # Mark the entry as recently used.
+            os.utime(path, None)
+        except OSError:
+            # Then the entry was evicted in the meantime.
+            pass
+        self._touch(key)
+        return value
+
+    def set(self, key, value):
+        """
+        Store the value for the given key, evicting entries if necessary.
+
+        """
+        self._make_dir()
+        # Write to a temp file and rename so that concurrent readers never
+        # see a partially written entry.
+        fd, temp_path = mkstemp(dir=self.dir_path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(temp_path, self._make_path(key))
+        except:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self._touch(key)
+        self._evict()
+
+    def _evict(self):
+        """
+        Remove least recently used entries if there are over max_entries.
+
+        Entries are removed down to 90% of max_entries, so that eviction
+        happens once per batch of writes rather than on every write.
+
+        """
+        if self.max_entries is None:
+            return
+        with self._lock:
+            index = self._get_index()
+            if len(index) <= self.max_entries:
+                return
+            keep_count = self.max_entries - self.max_entries // 10
+            keys = [index.popitem(last=False)[0] for i in
+                    range(len(index) - keep_count)]
+        _log.debug("evicting %d cache entries from: %s" % (len(keys), self.dir_path))
+        for key in keys:
+            try:
+                os.remove(self._make_path(key))
+            except OSError:
+                # Then another process removed the entry.
+                pass
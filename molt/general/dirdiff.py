@@ -36,7 +36,10 @@ Provides support for recursive directory comparisons.
 
 from __future__ import absolute_import
 
+from collections import deque
 import filecmp
+from fnmatch import fnmatch
+from multiprocessing.pool import ThreadPool
 import os
 import sys
 
@@ -47,15 +50,73 @@ import molt.general.io as molt_io
 
 _ENCODING = molt_defaults.FILE_ENCODING
 
+# The kinds of differences yielded by DirComparer.iter_diff().  Their
+# values are the indices of the corresponding DirDiffInfo sequences.
+LEFT_ONLY, RIGHT_ONLY, DIFF_FILE = range(3)
+
+# The kind of the walk entries for files in both directories.
+_COMMON_FILE = -1
+
+# The names ignored if no ignore patterns are given, as with filecmp.dircmp.
+_DEFAULT_IGNORE = ['RCS', 'CVS', 'tags']
+
+# The number of bytes to read at a time when comparing file contents.
+_CHUNK_SIZE = 64 * 1024
+
+# The number of file comparisons per job to queue ahead of the one whose
+# result is next.
+_QUEUE_PER_JOB = 4
+
 
 def compare_files(path1, path2):
     """
     Return whether the file contents at the given paths are the same.
 
+    The sizes are compared first, and then the contents in chunks,
+    stopping at the first difference.
+
     """
     return filecmp.cmp(path1, path2, shallow=False)
 
 
+def _contents_same(path1, path2):
+    """
+    Return whether two files of the same size have the same contents.
+
+    The contents are compared in chunks, stopping at the first difference.
+
+    """
+    with open(path1, 'rb') as f1:
+        with open(path2, 'rb') as f2:
+            while True:
+                b1 = f1.read(_CHUNK_SIZE)
+                if b1 != f2.read(_CHUNK_SIZE):
+                    return False
+                if not b1:
+                    return True
+
+
+def _scan_dir(dir_path, ignore):
+    """
+    Return a dict mapping each name in a directory to an (is_dir, size) pair.
+
+    Symbolic links are followed.  The size is None if the entry could not
+    be stat'ed (e.g. a broken symbolic link), and 0 for directories.
+    See molt.general.io.list_dir().
+
+    Parameters:
+
+      ignore: a list of glob patterns of the names to leave out.
+
+    """
+    infos = {}
+    for name, path, is_dir, size in molt_io.list_dir(dir_path, ignore_errors=True):
+        if any(fnmatch(name, pattern) for pattern in ignore):
+            continue
+        infos[name] = (is_dir, size)
+    return infos
+
+
 # TODO: replace uses of this class with FileComparer2.
 class FileComparer(object):
 
@@ -105,6 +166,13 @@ class Customizer(object):
 
     """Customizes DirComparer behavior."""
 
+    # Whether files with the same bytes are always the same according to
+    # files_same().  If true, DirComparer first compares sizes and then
+    # contents in chunks, and calls files_same() only for files whose
+    # bytes differ.  This is much faster when files_same() is expensive
+    # (e.g. when it decodes the files) and most files are identical.
+    same_if_identical = False
+
     def files_same(self, path1, path2):
         return compare_files(path1, path2)
 
@@ -128,7 +196,7 @@ class DirComparer(object):
     #   to terminate when that many differences are encountered.
     # TODO: add support for ignoring files matching a certain pattern, etc.
     # TODO: remove the compare parameter.
-    def __init__(self, compare=None, ignore=None, custom=None):
+    def __init__(self, compare=None, ignore=None, custom=None, jobs=None):
         """
         Parameters:
 
@@ -137,9 +205,16 @@ class DirComparer(object):
             the same.  Defaults to compare_files.  If provided, the
             custom argument is ignored.
 
-          custom: an instance of a subclass of Customizer.
+          custom: an instance of a subclass of Customizer.  Its
+            files_same() method may be called from several threads
+            at once if jobs is greater than 1.
+
+          jobs: the number of files to compare concurrently.  Defaults
+            to 1.
 
         """
+        if jobs is None:
+            jobs = 1
         if compare is not None:
             custom = Customizer()
             custom.files_same = compare
@@ -149,66 +224,134 @@ class DirComparer(object):
         compare_func = compare_files if compare is None else compare
 
         self.ignore = ignore
+        self.jobs = jobs
         self.compare_func = compare_func
         self.custom = custom
 
-    def _diff(self, dcmp, results, leading_path=''):
+    def _walk(self, dir1, dir2, leading_path=''):
         """
-        Recursively compare a filecmp.dircmp instance.
+        Recursively walk two directories, and yield their entries.
 
-        This method modifies the results container in place.
+        Each directory pair is listed once, and the names are yielded in
+        sorted order, with the names in a directory coming before those
+        in its subdirectories.  This method does not compare any files.
 
-        Parameters:
+        Yields (kind, rel_path, paths, sizes) tuples, where kind is
+        LEFT_ONLY, RIGHT_ONLY, or _COMMON_FILE.  The paths and sizes
+        are pairs for _COMMON_FILE entries, and otherwise None.
 
-          dcmp: a filecmp.dircmp instance.
-
-          results: a three-tuple of (left_only, right_only, diff_files).
+        Parameters:
 
           leading_path: the path at which the directory comparison
             is taking place.  The path is relative to the top-level
-            directories passed to the initial call to diff().
+            directories passed to the initial call to iter_diff().
+
+        """
+        ignore = _DEFAULT_IGNORE if self.ignore is None else self.ignore
+        infos1, infos2 = (_scan_dir(path, ignore) for path in (dir1, dir2))
+        sub_dirs = []
+        for name in sorted(set(infos1) | set(infos2)):
+            rel_path = os.path.join(leading_path, name)
+            if name not in infos2:
+                yield LEFT_ONLY, rel_path, None, None
+                continue
+            if name not in infos1:
+                yield RIGHT_ONLY, rel_path, None, None
+                continue
+            (is_dir1, size1), (is_dir2, size2) = infos1[name], infos2[name]
+            if is_dir1 and is_dir2:
+                sub_dirs.append(name)
+                continue
+            # TODO: incorporate "funny" names into the result, which are
+            # names that may, for example, be a file name in one directory
+            # and a directory name in the other, or that could not be
+            # stat'ed.
+            if is_dir1 or is_dir2 or size1 is None or size2 is None:
+                continue
+            paths = [os.path.join(path, name) for path in (dir1, dir2)]
+            yield _COMMON_FILE, rel_path, paths, (size1, size2)
+
+        for name in sub_dirs:
+            dir_paths = (os.path.join(path, name) for path in (dir1, dir2))
+            for entry in self._walk(*dir_paths,
+                                    leading_path=os.path.join(leading_path, name)):
+                yield entry
+
+    def _files_same(self, paths, sizes):
+        """Return the result of comparing the files at the given paths."""
+        # Since the file comparer being used may be more forgiving than an
+        # exact match, we cannot conclude that files of different sizes
+        # differ unless the customizer allows it.
+        if (self.custom.same_if_identical and sizes[0] == sizes[1] and
+            _contents_same(*paths)):
+            return True
+        return self.custom.files_same(*paths)
+
+    def _compare_entries(self, entries):
+        """
+        Compare the common files among the given walk entries.
+
+        Yields a (kind, rel_path, result) tuple per entry, in the same
+        order as the entries.  The result is the return value of
+        _files_same() for _COMMON_FILE entries, and otherwise None.  The
+        files are compared using up to jobs threads, with a bounded
+        number of comparisons queued ahead.
 
         """
-        # TODO: simplify the implementation of this method if possible.
-        # For example, eliminate the use of on-the-fly lambdas.
-        make_rel_path = lambda name: os.path.join(leading_path, name)
-
-        # Since the file comparer being used may be more forgiving than the
-        # exact-match default, we need to check the names in dcmp.diff_files
-        # again to see if any are the same under the looser condition.
-        #
-        # Since dircmp only does "shallow" file comparisons (i.e. doesn't
-        # look at file contents), we need to check the files in
-        # dcmp.same_files again to see if they might in fact be different.
-        # See also: http://bugs.python.org/issue15250
-        diff_files = []
-        # The common_files list includes: same_files, diff_files, funny_files.
-        for name in dcmp.common_files:
-            paths = (os.path.join(path, name) for path in (dcmp.left, dcmp.right))
-            result = self.custom.files_same(*paths)
-            if not result is True:
-                rel_path = make_rel_path(name)
+        if self.jobs <= 1:
+            for kind, rel_path, paths, sizes in entries:
+                result = None if paths is None else self._files_same(paths, sizes)
+                yield kind, rel_path, result
+            return
+        # We use threads rather than processes because customizers need
+        # not pickle, and because the time goes mostly to file I/O, which
+        # releases the GIL.  We walk on this thread and submit files one
+        # at a time (rather than calling imap() with the walk) so errors
+        # while walking are raised here.
+        pool = ThreadPool(self.jobs)
+        try:
+            queued = deque()
+            max_queued = self.jobs * _QUEUE_PER_JOB
+            for kind, rel_path, paths, sizes in entries:
+                result = (None if paths is None else
+                          pool.apply_async(self._files_same, (paths, sizes)))
+                queued.append((kind, rel_path, result))
+                if len(queued) > max_queued:
+                    yield self._get_result(queued.popleft())
+            while queued:
+                yield self._get_result(queued.popleft())
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _get_result(self, queued):
+        kind, rel_path, result = queued
+        if result is not None:
+            result = result.get()
+        return kind, rel_path, result
+
+    def iter_diff(self, dir1, dir2):
+        """
+        Compare the directories at the given paths, and yield the differences.
+
+        The differences are yielded as they are found, as (kind, rel_path)
+        pairs, where kind is one of LEFT_ONLY, RIGHT_ONLY, or DIFF_FILE.
+        The order depends only on the directory contents and not on the
+        number of jobs.  The customizer's on_diff_file() method is called
+        from the calling thread before each DIFF_FILE pair is yielded.
+
+        This method raises an OSError if either directory does not exist.
+
+        """
+        entries = self._walk(dir1, dir2)
+        for kind, rel_path, result in self._compare_entries(entries):
+            if kind == _COMMON_FILE:
+                if result is True:
+                    continue
                 self.custom.on_diff_file(rel_path, result)
-                diff_files.append(name)
-
-        # Process the higher-level paths before recursing so notifications
-        # about these paths will occur earlier.
-        # TODO: incorporate common_funny into the result, which are names
-        # that may, for example, be a file name in one directory and a
-        # directory name in the other.
-        name_lists = [dcmp.left_only, dcmp.right_only, diff_files]
-        for result_paths, names in zip(results, name_lists):
-            new_paths = [make_rel_path(name) for name in names]
-            result_paths.extend(new_paths)
-
-        for dir_name, sub_dcmp in dcmp.subdirs.iteritems():
-            path = make_rel_path(dir_name)
-            self._diff(sub_dcmp, results, leading_path=path)
-
-
-    # TODO: reimplement this method without using filecmp.dircmp because
-    # this might be more straightforward and easier to understand given
-    # filecmp.dircmp's use of shallow comparisons, etc.
+                kind = DIFF_FILE
+            yield kind, rel_path
+
     def diff(self, dir1, dir2):
         """
         Compare the directories at the given paths.
@@ -219,8 +362,8 @@ class DirComparer(object):
 
         """
         info = DirDiffInfo([] for i in range(3))
-        dcmp = filecmp.dircmp(dir1, dir2, ignore=self.ignore)
-        self._diff(dcmp, info)
+        for kind, rel_path in self.iter_diff(dir1, dir2):
+            info[kind].append(rel_path)
         # Normalize the result sequences for testing and display purposes.
         map(lambda seq: seq.sort(), info)
         return info
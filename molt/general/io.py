@@ -36,22 +36,54 @@ from __future__ import absolute_import
 
 import codecs
 from contextlib import contextmanager
+import errno
 import json
 import logging
 import os
-from shutil import rmtree
+from shutil import copyfileobj, rmtree
+import stat
+import sys
 from tempfile import mkdtemp
 
-from molt.general.error import reraise
+from molt.constants import COPY_MODES
+from molt.general.error import reraise, Error
 
 
 _log = logging.getLogger(__name__)
 
 try:
-    # We make it so that not having YAML is not fatal.
-    import yaml
-except ImportError, err:
-    _log.debug("yaml not found: %s" % repr(err))
+    # Python 3.5 and later.
+    from os import scandir as _scandir
+except ImportError:
+    try:
+        # The backport from PyPI.
+        from scandir import scandir as _scandir
+    except ImportError:
+        _scandir = None
+
+
+def _import_yaml():
+    """
+    Import and return the yaml module, or raise an Error if not installed.
+
+    We import yaml only when needed because importing it is slow compared
+    to the startup time of the molt command.  Not having it is not fatal.
+
+    """
+    try:
+        import yaml
+    except ImportError, err:
+        _log.debug("yaml not found: %s" % repr(err))
+        raise Error("Reading YAML files requires PyYAML: %s" % err)
+    return yaml
+
+
+def _load_yaml(u):
+    yaml = _import_yaml()
+    # The libyaml-based loader is many times faster than the pure-Python
+    # one, but is only available if PyYAML was built with libyaml.
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    return yaml.load(u, Loader=loader)
 
 
 def read(path, encoding, errors):
@@ -75,12 +107,285 @@ def write(u, path, encoding, errors):
 
     """
     b = u.encode(encoding=encoding, errors=errors)
+    write_bytes(b, path)
+
 
+def write_bytes(b, path):
+    """
+    Write a byte string to a file.
+
+    """
     _log.debug("Writing: %s" % repr(str(path)))
     with open(path, 'wb') as f:
         f.write(b)
 
 
+def _stat_entry(dir_path, name, entry):
+    """
+    Return the (path, is_dir, size) of a directory entry.
+
+    Arguments:
+
+      entry: the scandir() entry, or None if scandir() is not available.
+
+    """
+    if entry is not None:
+        is_dir = entry.is_dir()
+        return entry.path, is_dir, 0 if is_dir else entry.stat().st_size
+    path = os.path.join(dir_path, name)
+    info = os.stat(path)
+    is_dir = stat.S_ISDIR(info.st_mode)
+    return path, is_dir, 0 if is_dir else info.st_size
+
+
+def list_dir(dir_path, ignore_errors=False):
+    """
+    List a directory, returning a (name, path, is_dir, size) tuple per entry.
+
+    The size is 0 for directories.  Symbolic links are followed.  This
+    uses scandir() when available, which needs no stat() call for
+    directories, and otherwise makes one stat() call per entry.
+
+    Arguments:
+
+      ignore_errors: whether to list an entry that cannot be stat'ed
+        (e.g. a broken symbolic link) as a file of size None rather
+        than raise an OSError.
+
+    """
+    if _scandir is not None:
+        names = ((entry.name, entry) for entry in _scandir(dir_path))
+    else:
+        names = ((name, None) for name in os.listdir(dir_path))
+    entries = []
+    for name, entry in names:
+        try:
+            path, is_dir, size = _stat_entry(dir_path, name, entry)
+        except OSError:
+            if not ignore_errors:
+                raise
+            path, is_dir, size = os.path.join(dir_path, name), False, None
+        entries.append((name, path, is_dir, size))
+    return entries
+
+
+# The Linux ioctl request code for cloning a file (FICLONE in linux/fs.h).
+_FICLONE = 0x40049409
+
+# Errors meaning that a copy or link technique is not supported for the
+# given files, as opposed to an error with the files themselves.
+_UNSUPPORTED_ERRNOS = set(getattr(errno, name) for name in
+                          ('EXDEV', 'ENOSYS', 'EINVAL', 'EOPNOTSUPP', 'ENOTSUP',
+                           'ENOTTY', 'EPERM', 'EMLINK', 'EBADF') if
+                          hasattr(errno, name))
+
+
+def _is_unsupported(err):
+    return getattr(err, 'errno', None) in _UNSUPPORTED_ERRNOS
+
+
+# The Linux C library's kernel copy functions, loaded on first use.  See
+# _get_libc_copies().
+_libc_copies = None
+
+
+def _get_libc_copies():
+    """
+    Return a dictionary of the Linux C library's kernel copy functions.
+
+    The dictionary maps each of "copy_file_range" and "sendfile" to a
+    ctypes function, if available.  We call these through ctypes because
+    Python 2 has no os.copy_file_range() or os.sendfile().
+
+    """
+    global _libc_copies
+    if _libc_copies is not None:
+        return _libc_copies
+    _libc_copies = {}
+    if not sys.platform.startswith('linux'):
+        return _libc_copies
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+    except (ImportError, OSError), err:
+        _log.debug("C library not available: %r" % err)
+        return _libc_copies
+    off_p = ctypes.POINTER(ctypes.c_int64)
+    signatures = {
+        # copy_file_range(fd_in, off_in, fd_out, off_out, len, flags).
+        'copy_file_range': ('copy_file_range',
+                            [ctypes.c_int, off_p, ctypes.c_int, off_p,
+                             ctypes.c_size_t, ctypes.c_uint]),
+        # sendfile(out_fd, in_fd, offset, count), with a 64-bit offset.
+        'sendfile': ('sendfile64',
+                     [ctypes.c_int, ctypes.c_int, off_p, ctypes.c_size_t]),
+    }
+    for name, (symbol, argtypes) in signatures.items():
+        func = getattr(libc, symbol, None)
+        if func is None:
+            # Then the C library is too old (e.g. glibc before 2.27 for
+            # copy_file_range).
+            continue
+        func.argtypes = argtypes
+        func.restype = ctypes.c_ssize_t
+        _libc_copies[name] = func
+    return _libc_copies
+
+
+def _check_libc_result(count):
+    """
+    Return the count returned by a C library function, or raise OSError.
+
+    """
+    if count < 0:
+        from ctypes import get_errno
+        err = get_errno()
+        raise OSError(err, os.strerror(err))
+    return count
+
+
+def _make_kernel_copies(in_fd, out_fd):
+    """
+    Return the available functions that copy bytes without leaving the kernel.
+
+    Each function accepts an (offset, count) pair and returns the number of
+    bytes copied.
+
+    """
+    funcs = []
+    # These functions are available in Python 3.  In Python 2 on Linux,
+    # we call the C library functions through ctypes instead.
+    libc_copies = _get_libc_copies()
+    if libc_copies:
+        from ctypes import byref, c_int64
+    if hasattr(os, 'copy_file_range'):
+        funcs.append(lambda offset, count: os.copy_file_range(in_fd, out_fd, count,
+                                                              offset, offset))
+    elif 'copy_file_range' in libc_copies:
+        copy_file_range = libc_copies['copy_file_range']
+        def copy(offset, count):
+            in_offset, out_offset = c_int64(offset), c_int64(offset)
+            return _check_libc_result(copy_file_range(
+                in_fd, byref(in_offset), out_fd, byref(out_offset), count, 0))
+        funcs.append(copy)
+    if hasattr(os, 'sendfile'):
+        funcs.append(lambda offset, count: os.sendfile(out_fd, in_fd, offset, count))
+    elif 'sendfile' in libc_copies:
+        sendfile = libc_copies['sendfile']
+        def send(offset, count):
+            in_offset = c_int64(offset)
+            return _check_libc_result(sendfile(out_fd, in_fd, byref(in_offset),
+                                               count))
+        funcs.append(send)
+    return funcs
+
+
+def _copy_fast(source, target):
+    """
+    Copy file contents, using kernel fast paths when available.
+
+    """
+    with open(source, 'rb') as fsrc:
+        with open(target, 'wb') as fdst:
+            size = os.fstat(fsrc.fileno()).st_size
+            for copy in _make_kernel_copies(fsrc.fileno(), fdst.fileno()):
+                offset = 0
+                try:
+                    while offset < size:
+                        count = copy(offset, size - offset)
+                        if not count:
+                            # Then the source file shrank.
+                            break
+                        offset += count
+                except OSError, err:
+                    if not _is_unsupported(err):
+                        raise
+                    # Otherwise, undo any partial copy and try the next way.
+                    fdst.seek(0)
+                    fdst.truncate()
+                    continue
+                return
+            copyfileobj(fsrc, fdst)
+
+
+def _copy_reflink(source, target):
+    """
+    Copy a file as a copy-on-write clone, falling back to copying.
+
+    """
+    try:
+        import fcntl
+    except ImportError:
+        # Then the platform is not Unix.
+        _copy_fast(source, target)
+        return
+    with open(source, 'rb') as fsrc:
+        with open(target, 'wb') as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+                return
+            except (IOError, OSError), err:
+                if not _is_unsupported(err):
+                    raise
+    _log.debug("reflink not supported, copying: %s" % source)
+    _copy_fast(source, target)
+
+
+def _link(link_name, source, target):
+    """
+    Create a link to a file, falling back to copying.
+
+    Arguments:
+
+      link_name: the name of the os function creating the link.
+
+    """
+    link = getattr(os, link_name, None)
+    try:
+        if link is None:
+            # Then the platform does not support this kind of link.
+            raise OSError(errno.ENOSYS, "os.%s() not available" % link_name)
+        link(source, target)
+    except OSError, err:
+        if not _is_unsupported(err):
+            raise
+        _log.debug("%s not supported, copying: %s" % (link_name, source))
+        _copy_fast(source, target)
+
+
+def copy_file(source, target, mode=None):
+    """
+    Copy the contents of a file to a new path.
+
+    Any existing file at the target path is removed first.  This prevents
+    writing through a link left by an earlier copy into the linked file.
+
+    Arguments:
+
+      mode: one of COPY_MODES.  The "copy" mode uses kernel fast paths
+        when available.  The "reflink" mode makes a copy-on-write clone
+        on filesystems that support it.  The "hardlink" and "symlink"
+        modes link to the source file instead of copying it.  All modes
+        fall back to copying when not supported for the given paths.
+        Defaults to "copy".
+
+    """
+    if mode is None:
+        mode = COPY_MODES[0]
+    if os.path.lexists(target):
+        os.remove(target)
+    if mode == 'copy':
+        _copy_fast(source, target)
+    elif mode == 'reflink':
+        _copy_reflink(source, target)
+    elif mode == 'hardlink':
+        _link('link', source, target)
+    elif mode == 'symlink':
+        _link('symlink', os.path.abspath(source), target)
+    else:
+        raise ValueError("Unknown copy mode: %r" % mode)
+
+
 def create_directory(path):
     """
     Create a directory if not there, and return whether one was created.
@@ -128,7 +433,7 @@ def deserialize(path, encoding, errors):
     ext = os.path.splitext(path)[1]
 
     if ext.startswith(".y"):  # e.g. ".yaml" or ".yml".
-        return yaml.safe_load(u)
+        return _load_yaml(u)
     return json.loads(u)
 
 
@@ -138,6 +443,7 @@ def unserialize_yaml_file(path, encoding):
     Deserialize a yaml file.
 
     """
+    yaml = _import_yaml()
     with codecs.open(path, "r", encoding=encoding) as f:
         data = yaml.load(f)
 
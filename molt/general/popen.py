@@ -34,9 +34,13 @@ Exposes a utility function to call a shell script as a Python function.
 
 from __future__ import absolute_import
 
+import os
+import signal
+import sys
 from subprocess import Popen, PIPE, STDOUT
+from threading import Timer
 
-from molt.general.error import reraise
+from molt.general.error import reraise, Error
 
 
 def chain_script(args, handle_line):
@@ -52,25 +56,155 @@ def chain_script(args, handle_line):
         handle_line(line)
 
 
+# The command that runs a command in a new session.  It is part of
+# util-linux, so it is not available everywhere (e.g. on Mac OS X).
+SETSID_COMMAND = 'setsid'
+
+# The Python code to run a command in a new session if SETSID_COMMAND is
+# not available.  It takes longer to start.
+_SETSID_CODE = 'import os, sys; os.setsid(); os.execvp(sys.argv[1], sys.argv[1:])'
+
+# The paths found by _find_command(), by command name.
+_command_paths = {}
+
+
+def _find_command(name):
+    """
+    Return the path to the named command on the PATH, or None if not found.
+
+    """
+    try:
+        return _command_paths[name]
+    except KeyError:
+        pass
+    found = None
+    for dir_path in os.environ.get('PATH', os.defpath).split(os.pathsep):
+        path = os.path.join(dir_path, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            found = path
+            break
+    _command_paths[name] = found
+    return found
+
+
+def make_command(args, limits=None, new_session=False):
+    """
+    Return the command to run args with resource limits in a new session.
+
+    Python 2 documents Popen's preexec_fn as unsafe when other threads
+    are running, because the child can deadlock on a lock held at the
+    time of the fork, and molt runs scripts from several threads when
+    rendering concurrently.  So instead of a preexec_fn, this prefixes
+    args with commands that apply the settings and then exec args: the
+    setsid command (or a Python equivalent where it is not available) to
+    start a new session, and a shell's ulimit for the limits.  A failure
+    to run args is then reported by these commands on stderr with a
+    non-zero return code, rather than raised by Popen.
+
+    Arguments:
+
+      args: the command as a list of arguments.
+
+      limits: a list of (option, value) pairs of ulimit options, for
+        example [('-v', 1024)] to limit the address space to 1 MB.
+
+      new_session: whether to start a new session.  A process started in
+        a new session leads its own process group, so ProcessTimer can
+        kill it along with any processes it starts (e.g. the commands run
+        by a shell script).
+
+    """
+    if limits:
+        # The shell sets $0 to the argument after the command string.
+        commands = ['ulimit %s %d' % limit for limit in limits]
+        commands.append('exec "$0" "$@"')
+        args = ['/bin/sh', '-c', ' && '.join(commands)] + list(args)
+    if new_session:
+        # The setsid command runs args in its own process instead of a
+        # new one because the Popen child never leads a process group.
+        setsid_path = _find_command(SETSID_COMMAND)
+        setsid_args = ([sys.executable, '-S', '-c', _SETSID_CODE]
+                       if setsid_path is None else [setsid_path])
+        args = setsid_args + list(args)
+    return args
+
+
+class ProcessTimer(object):
+
+    """
+    Kills the process group of a process if not cancelled in time.
+
+    The process should have been started in a new session (see
+    make_command()).
+
+    """
+
+    def __init__(self, proc, seconds):
+        self._proc = proc
+        self._timer = Timer(seconds, self._kill)
+        self._timer.daemon = True
+        self.expired = False
+        self.seconds = seconds
+
+    def _kill(self):
+        self.expired = True
+        try:
+            os.killpg(self._proc.pid, signal.SIGKILL)
+        except OSError:
+            # Then the process already exited.
+            pass
+
+    def start(self):
+        self._timer.start()
+
+    def cancel(self):
+        self._timer.cancel()
+
+
 # Default to shell=False because shell=True is strongly discouraged for
 # security reasons.
-def call_script(args, b=None, shell=False):
+def call_script(args, b=None, shell=False, timeout=None, limits=None):
     """
     Call the script with the given bytes sent to stdin.
 
     Returns a triple (stdout, stderr, returncode).
 
+    Arguments:
+
+      timeout: the number of seconds after which to kill the script and
+        any processes it started, and raise an Error.  Defaults to no
+        limit.
+
+      limits: a list of (option, value) pairs of ulimit options to apply
+        to the script.  See make_command().
+
     """
     # See this page:
     #   http://stackoverflow.com/questions/163542/python-how-do-i-pass-a-string-into-subprocess-popen-using-the-stdin-argument
 
+    if timeout is not None or limits:
+        if shell:
+            args, shell = ['/bin/sh', '-c', args], False
+        elif isinstance(args, basestring):
+            args = [args]
+        args = make_command(args, limits=limits, new_session=timeout is not None)
     try:
         proc = Popen(args, stdout=PIPE, stdin=PIPE, stderr=PIPE, shell=shell,
                      universal_newlines=False)
     except Exception as err:
         reraise("Error opening process: %s" % repr(args))
 
-    stdout_data, stderr_data = proc.communicate(input=b)
+    timer = None
+    if timeout is not None:
+        timer = ProcessTimer(proc, timeout)
+        timer.start()
+    try:
+        stdout_data, stderr_data = proc.communicate(input=b)
+    finally:
+        if timer is not None:
+            timer.cancel()
+    if timer is not None and timer.expired:
+        raise Error("Script timed out after %s seconds: %s" % (timeout, repr(args)))
     return_code = proc.returncode
 
     return stdout_data, stderr_data, return_code
@@ -0,0 +1,1012 @@
+# encoding: utf-8
+#
+# Copyright (C) 2012 Chris Jerdonek. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * The names of the copyright holders may not be used to endorse or promote
+#   products derived from this software without specific prior written
+#   permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Exposes functions to load the scripts in a lambdas directory as Mustache lambdas.
+
+By default, each call to a lambda runs its script once, passing the
+lambda's input text to stdin and using stdout as the result.
+
+A script can opt into other behavior with a directive comment in its
+first lines, for example:
+
+    # molt-lambda: persistent
+
+The "persistent" directive means the script keeps running and answers
+many requests.  Molt sends each request to the script's stdin as a
+decimal byte count, a newline, and then that many bytes.  The script
+answers on stdout with a response in the same format.  The script should
+exit when stdin is closed.  Molt starts up to one worker process per
+concurrent render job.
+
+A Python file without a "#!" line is instead imported once and run in
+process.  It must define a function named "render" that accepts the
+lambda's input as a unicode string and returns a string.  For example:
+
+    def render(text):
+        return text.upper()
+
+The function may be called from several threads at once when rendering
+with more than one job.
+
+The "batch" directive means the script accepts many inputs per run.
+Molt collects a render's calls to the script and sends them all to one
+run of the script as a framed list: a decimal count of inputs and a
+newline, followed by each input in the format above.  The script answers
+with a framed list of the same number of outputs, in the same order.
+A batch script can also be persistent, in which case each request and
+response is a framed list.
+
+Scripts can also limit their resource use with directives:
+
+    # molt-lambda: timeout=10 max-memory=512 max-cpu=5
+
+The "timeout" directive is the number of seconds of wall time after which
+a call fails and the script and any processes it started are killed.
+For a persistent script, it applies to each request.  The "max-memory"
+directive limits the script's address space in megabytes, and the
+"max-cpu" directive limits its CPU time in seconds.  Molt applies these
+with commands that run before the script (setsid and the shell's
+ulimit), because Python 2 does not support doing it in the child process
+when rendering with more than one thread.
+
+Lambda results of scripts are cached by script contents and input, so a script is
+not run again for an input it has already seen.  Scripts whose output
+can change for the same input (for example, because they print the
+time) should opt out with the "impure" directive.
+
+"""
+
+from __future__ import absolute_import
+
+from collections import OrderedDict
+import hashlib
+from io import BytesIO
+from itertools import imap
+import logging
+from multiprocessing.pool import ThreadPool
+import os
+import re
+from subprocess import Popen, PIPE
+from threading import Lock
+import time
+from types import ModuleType
+
+from molt import defaults
+from molt.general.cache import DiskCache
+from molt.general.error import Error
+from molt.general.popen import call_script, make_command, ProcessTimer
+
+
+_log = logging.getLogger(__name__)
+
+DIRECTIVE_PREFIX = b'molt-lambda:'
+DIRECTIVE_BATCH = 'batch'
+DIRECTIVE_IMPURE = 'impure'
+DIRECTIVE_MAX_CPU = 'max-cpu'
+DIRECTIVE_MAX_MEMORY = 'max-memory'
+DIRECTIVE_PERSISTENT = 'persistent'
+DIRECTIVE_TIMEOUT = 'timeout'
+
+# The name of the subdirectory of a cache directory holding lambda results.
+CACHE_SUBDIR_NAME = 'lambdas'
+
+# The text standing in for the result of a deferred lambda call.  The
+# NUL characters keep it from matching rendered template text.
+_PLACEHOLDER_FORMAT = u'\x00molt-lambda:%d\x00'
+_PLACEHOLDER_PATTERN = re.compile(u'\x00molt-lambda:(\\d+)\x00')
+
+PYTHON_EXT = '.py'
+PYTHON_FUNCTION_NAME = 'render'
+
+# The number of lines at the start of a script to search for directives.
+_DIRECTIVE_LINES = 10
+
+
+def read_directives(path):
+    """
+    Return the directives in a script as a dictionary.
+
+    Each directive is a word following DIRECTIVE_PREFIX in a comment, and
+    is either a name or a name=value pair.  Names without a value map to
+    True.
+
+    """
+    directives = {}
+    with open(path, 'rb') as f:
+        for index, line in enumerate(f):
+            if index >= _DIRECTIVE_LINES:
+                break
+            prefix, sep, words = line.partition(DIRECTIVE_PREFIX)
+            if not sep:
+                continue
+            # The directive names are text, like the DIRECTIVE_* constants.
+            words = words.decode('utf-8', 'replace')
+            for word in words.split():
+                name, sep, value = word.partition('=')
+                directives[name] = value if sep else True
+    return directives
+
+
+def _get_number(directives, name, path):
+    """
+    Return the positive number value of a directive, or None if not present.
+
+    """
+    value = directives.get(name)
+    if value is None:
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        number = 0
+    if number <= 0:
+        raise Error("Lambda directive %s must be a positive number: %r: %s" %
+                    (name, value, path))
+    return number
+
+
+def make_limits(directives, path):
+    """
+    Return the resource limit directives as ulimit options.
+
+    Returns a list of (option, value) pairs for make_command(), which is
+    empty if there are no resource limits to apply.
+
+    """
+    limits = []
+    max_memory = _get_number(directives, DIRECTIVE_MAX_MEMORY, path)
+    if max_memory is not None:
+        # The address space limit is in kilobytes.
+        limits.append(('-v', int(max_memory * 1024)))
+    max_cpu = _get_number(directives, DIRECTIVE_MAX_CPU, path)
+    if max_cpu is not None:
+        # CPU limits are in whole seconds, so round up.
+        limits.append(('-t', int(max_cpu + 0.999999)))
+    if limits and os.name != 'posix':
+        _log.warning("resource limits not supported on this platform: %s" % path)
+        return []
+    return limits
+
+
+class LambdaStats(object):
+
+    """
+    Accumulates the calls to a lambda and the time they took.
+
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.calls = 0
+        self.max_seconds = 0.0
+        self.total_seconds = 0.0
+
+    def add(self, seconds, bytes_in, bytes_out, calls=1):
+        """
+        Record a call, or a batch of calls that took the given time together.
+
+        """
+        with self._lock:
+            self.calls += calls
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def update(self, stats):
+        """
+        Add the counts of another LambdaStats instance.
+
+        """
+        with self._lock:
+            self.calls += stats.calls
+            self.total_seconds += stats.total_seconds
+            self.max_seconds = max(self.max_seconds, stats.max_seconds)
+            self.bytes_in += stats.bytes_in
+            self.bytes_out += stats.bytes_out
+
+    def to_dict(self):
+        return {
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'calls': self.calls,
+            'max_seconds': self.max_seconds,
+            'total_seconds': self.total_seconds,
+        }
+
+
+def write_message(f, b):
+    """
+    Write bytes to a file object in the persistent-lambda format.
+
+    """
+    f.write(('%d\n' % len(b)).encode('ascii'))
+    f.write(b)
+    f.flush()
+
+
+def write_messages(f, bs):
+    """
+    Write a list of bytes to a file object as a framed list.
+
+    """
+    f.write(('%d\n' % len(bs)).encode('ascii'))
+    for b in bs:
+        write_message(f, b)
+
+
+def read_messages(f):
+    """
+    Read a framed list of bytes, or return None at end of file.
+
+    """
+    header = f.readline()
+    if not header:
+        return None
+    try:
+        count = int(header)
+    except ValueError:
+        raise Error("Invalid message list header: %r" % header)
+    bs = []
+    for index in range(count):
+        b = read_message(f)
+        if b is None:
+            return None
+        bs.append(b)
+    return bs
+
+
+def encode_messages(bs):
+    """
+    Return a list of bytes as a framed list.
+
+    """
+    f = BytesIO()
+    write_messages(f, bs)
+    return f.getvalue()
+
+
+def decode_messages(b, path):
+    """
+    Return the list of bytes in a framed list output by a script.
+
+    """
+    bs = read_messages(BytesIO(b))
+    if bs is None:
+        raise Error("Invalid batch output from lambda: %s" % path)
+    return bs
+
+
+def read_message(f):
+    """
+    Read bytes in the persistent-lambda format, or return None at end of file.
+
+    """
+    header = f.readline()
+    if not header:
+        return None
+    try:
+        size = int(header)
+    except ValueError:
+        raise Error("Invalid message header: %r" % header)
+    b = f.read(size)
+    if len(b) != size:
+        return None
+    return b
+
+
+class _Worker(object):
+
+    """
+    A running persistent-lambda script.
+
+    """
+
+    def __init__(self, path, timeout=None, limits=None):
+        _log.debug("starting lambda worker: %s" % path)
+        args = make_command([path], limits=limits, new_session=timeout is not None)
+        # The script's stderr goes to ours so that its messages are not lost.
+        self._proc = Popen(args, stdin=PIPE, stdout=PIPE, close_fds=True)
+        self.path = path
+        self.timeout = timeout
+
+    def _call(self, b):
+        proc = self._proc
+        try:
+            write_message(proc.stdin, b)
+        except IOError:
+            # Then the worker exited.
+            return None
+        return read_message(proc.stdout)
+
+    def call(self, b):
+        timer = None
+        if self.timeout is not None:
+            timer = ProcessTimer(self._proc, self.timeout)
+            timer.start()
+        try:
+            response = self._call(b)
+        finally:
+            if timer is not None:
+                timer.cancel()
+        if response is None:
+            self.close()
+            if timer is not None and timer.expired:
+                raise Error("Lambda worker timed out after %s seconds: %s" %
+                            (self.timeout, self.path))
+            raise Error("Lambda worker stopped with return code %s: %s" %
+                        (self._proc.returncode, self.path))
+        return response
+
+    def close(self):
+        proc = self._proc
+        if proc.returncode is not None:
+            return
+        try:
+            proc.stdin.close()
+        except IOError:
+            pass
+        proc.wait()
+
+
+class _WorkerPool(object):
+
+    """
+    Starts persistent-lambda workers as needed and reuses idle ones.
+
+    """
+
+    def __init__(self, path, timeout=None, limits=None):
+        self._idle = []
+        self._limits = limits
+        self._lock = Lock()
+        self._workers = []
+        self.path = path
+        self.timeout = timeout
+
+    def call(self, b):
+        with self._lock:
+            worker = self._idle.pop() if self._idle else None
+        if worker is None:
+            worker = _Worker(self.path, timeout=self.timeout, limits=self._limits)
+            with self._lock:
+                self._workers.append(worker)
+        # A worker that fails is closed and not reused.
+        response = worker.call(b)
+        with self._lock:
+            self._idle.append(worker)
+        return response
+
+    def close(self):
+        with self._lock:
+            workers, self._workers, self._idle = self._workers, [], []
+        for worker in workers:
+            worker.close()
+
+
+class LambdaCache(object):
+
+    """
+    Caches lambda results in memory and optionally on disk.
+
+    Results are keyed by a hash of the script contents and the input, so a
+    cache directory can be shared across templates and across runs.  The
+    least recently used results are evicted first.
+
+    """
+
+    def __init__(self, cache_dir=None, max_entries=None):
+        """
+        Arguments:
+
+          cache_dir: the directory in which to persist results, in a
+            subdirectory.  If None, results are cached only in memory.
+
+          max_entries: the maximum number of results to keep in memory
+            and on disk.  Defaults to the package default.
+
+        """
+        if max_entries is None:
+            max_entries = defaults.LAMBDA_CACHE_SIZE
+
+        disk_cache = (None if cache_dir is None else
+                      DiskCache(os.path.join(cache_dir, CACHE_SUBDIR_NAME),
+                                max_entries=max_entries))
+
+        self._disk_cache = disk_cache
+        self._lock = Lock()
+        self._results = OrderedDict()
+        self.max_entries = max_entries
+
+        self.disk_hits = 0
+        self.hits = 0
+        self.misses = 0
+        # The time spent running scripts on misses, for estimating the
+        # time saved by hits.
+        self.miss_seconds = 0.0
+
+    def make_key(self, script_hash, b):
+        """
+        Return the cache key for a call to a script.
+
+        Arguments:
+
+          script_hash: the binary SHA-1 digest of the script's contents.
+
+          b: the bytes passed to the script.
+
+        """
+        digest = hashlib.sha1(script_hash)
+        digest.update(b'\0')
+        digest.update(b)
+        return digest.hexdigest()
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._results.pop(key, None)
+            self._results[key] = value
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+
+    def get(self, key):
+        """
+        Return the result for a key, or None if not cached.
+
+        """
+        with self._lock:
+            value = self._results.pop(key, None)
+            if value is not None:
+                # Mark the result as recently used.
+                self._results[key] = value
+                self.hits += 1
+                return value
+        if self._disk_cache is None:
+            return None
+        value = self._disk_cache.get(key)
+        if value is None:
+            return None
+        with self._lock:
+            self.hits += 1
+            self.disk_hits += 1
+        self._remember(key, value)
+        return value
+
+    def set(self, key, value, seconds):
+        """
+        Store the result for a key.
+
+        Arguments:
+
+          seconds: the time it took to compute the result.
+
+        """
+        with self._lock:
+            self.misses += 1
+            self.miss_seconds += seconds
+        self._remember(key, value)
+        if self._disk_cache is not None:
+            self._disk_cache.set(key, value)
+
+    def log_stats(self):
+        lookups = self.hits + self.misses
+        if not lookups:
+            return
+        saved = self.hits * self.miss_seconds / self.misses if self.misses else 0.0
+        _log.debug("lambda cache: %d hits (%d from disk), %d misses, "
+                   "%.0f%% hit rate, ~%.2fs saved" %
+                   (self.hits, self.disk_hits, self.misses,
+                    100.0 * self.hits / lookups, saved))
+
+
+class ScriptLambda(object):
+
+    """
+    A Mustache lambda that calls a script.
+
+    """
+
+    def __init__(self, path, directives=None, cache=None):
+        """
+        Arguments:
+
+          directives: the script's directives.  Defaults to reading them
+            from the script.
+
+          cache: a LambdaCache instance.  Results are not cached if None
+            or if the script has the "impure" directive.
+
+        """
+        if directives is None:
+            directives = read_directives(path)
+        if directives.get(DIRECTIVE_IMPURE):
+            cache = None
+
+        script_hash = None
+        if cache is not None:
+            with open(path, 'rb') as f:
+                script_hash = hashlib.sha1(f.read()).digest()
+
+        timeout = _get_number(directives, DIRECTIVE_TIMEOUT, path)
+        limits = make_limits(directives, path)
+
+        self._cache = cache
+        self._limits = limits
+        self._pool = (_WorkerPool(path, timeout=timeout, limits=limits)
+                      if directives.get(DIRECTIVE_PERSISTENT) else None)
+        self._script_hash = script_hash
+        self.batch = bool(directives.get(DIRECTIVE_BATCH))
+        self.directives = directives
+        self.path = path
+        self.stats = LambdaStats()
+        self.timeout = timeout
+
+    def _run_once(self, b):
+        if self._pool is not None:
+            return self._pool.call(b)
+        stdout, stderr, return_code = call_script(self.path, b, timeout=self.timeout,
+                                                  limits=self._limits)
+        return stdout
+
+    def _run_many(self, bs):
+        """
+        Run the script on a list of inputs, once per input unless batching.
+
+        """
+        if not self.batch:
+            return [self._run_once(b) for b in bs]
+        results = decode_messages(self._run_once(encode_messages(bs)), self.path)
+        if len(results) != len(bs):
+            raise Error("Lambda returned %d outputs for %d inputs: %s" %
+                        (len(results), len(bs), self.path))
+        return results
+
+    def _call_many(self, bs):
+        cache = self._cache
+        if cache is None:
+            return self._run_many(bs)
+        keys = [cache.make_key(self._script_hash, b) for b in bs]
+        results = [cache.get(key) for key in keys]
+        misses = [index for index, result in enumerate(results) if result is None]
+        if misses:
+            start_time = time.time()
+            new_results = self._run_many([bs[index] for index in misses])
+            seconds = (time.time() - start_time) / len(misses)
+            for index, result in zip(misses, new_results):
+                results[index] = result
+                cache.set(keys[index], result, seconds)
+        return results
+
+    def call_bytes_many(self, bs):
+        """
+        Call the script on a list of input bytes, and return a list of output bytes.
+
+        A batch script runs once for all the inputs not already cached.
+
+        """
+        start_time = time.time()
+        results = self._call_many(bs)
+        self.stats.add(time.time() - start_time, sum(imap(len, bs)),
+                       sum(imap(len, results)), calls=len(bs))
+        return results
+
+    def call_bytes(self, b):
+        """
+        Call the script with the given input bytes, and return the output bytes.
+
+        """
+        return self.call_bytes_many([b])[0]
+
+    def call_many(self, us):
+        """
+        Call the lambda on a list of unicode strings, and return a list of results.
+
+        """
+        bs = [u.encode(defaults.LAMBDA_ENCODING, defaults.ENCODING_ERRORS)
+              for u in us]
+        return [b.decode(defaults.LAMBDA_ENCODING, defaults.ENCODING_ERRORS)
+                for b in self.call_bytes_many(bs)]
+
+    def __call__(self, u=None):
+        if u is None:
+            u = u''
+        return self.call_many([u])[0]
+
+    def close(self):
+        """
+        Stop any worker processes.
+
+        """
+        if self._pool is not None:
+            self._pool.close()
+
+
+class PythonLambda(object):
+
+    """
+    A Mustache lambda that calls a function in a Python module.
+
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            source = f.read()
+        # We execute the source ourselves instead of importing the file so
+        # that no bytecode file is written to the lambdas directory.
+        module = ModuleType('molt_lambda_%s' %
+                            os.path.splitext(os.path.basename(path))[0])
+        module.__file__ = path
+        try:
+            code = compile(source, path, 'exec')
+            exec code in module.__dict__
+        except Exception, err:
+            raise Error("Error loading lambda module: %s\n-->%s: %s" %
+                        (path, err.__class__.__name__, err))
+        func = getattr(module, PYTHON_FUNCTION_NAME, None)
+        if not callable(func):
+            raise Error("Lambda module does not define %s(): %s" %
+                        (PYTHON_FUNCTION_NAME, path))
+
+        self._func = func
+        self.path = path
+        self.stats = LambdaStats()
+
+    def __call__(self, u=None):
+        if u is None:
+            u = u''
+        start_time = time.time()
+        result = self._func(u)
+        if isinstance(result, str):
+            result = result.decode(defaults.LAMBDA_ENCODING, defaults.ENCODING_ERRORS)
+        # For in-process lambdas, we count characters rather than bytes.
+        self.stats.add(time.time() - start_time, len(u), len(result))
+        return result
+
+
+class _DeferredLambda(object):
+
+    """
+    Wraps a lambda so that section calls are deferred to a LambdaDispatcher.
+
+    """
+
+    def __init__(self, func, dispatcher):
+        self._dispatcher = dispatcher
+        self._func = func
+
+    def _get_func(self):
+        func = self._func
+        # A lazily loaded script is loaded on its first call.
+        return func._get_func() if isinstance(func, _LazyLambda) else func
+
+    def __call__(self, u=None):
+        if u is None:
+            # Then the lambda is used as a variable, whose value Pystache
+            # HTML-escapes after the call, so we call it right away.
+            return self._get_func()()
+        return self._dispatcher.defer(self._get_func(), u)
+
+    def call_section(self, u, delimiters):
+        """
+        Defer a section call whose result is rendered with the given delimiters.
+
+        """
+        return self._dispatcher.defer(self._get_func(), u, delimiters)
+
+
+class LambdaDispatcher(object):
+
+    """
+    Collects lambda calls while rendering and runs them concurrently later.
+
+    Calls to the lambdas in a context returned by wrap() return placeholder
+    text instead of running the lambda.  After rendering, run() runs the
+    collected calls in a thread pool, and splice() replaces the
+    placeholders in the rendered text with the results.
+
+    Pystache renders a lambda's result as a template, but a placeholder
+    has nothing to render.  If a result contains a tag under the delimiters
+    in effect at its call, splice() reports failure, and the caller should
+    render the text again without deferring.
+
+    """
+
+    def __init__(self, concurrency):
+        """
+        Arguments:
+
+          concurrency: the maximum number of lambda calls to run at once.
+            All calls to a batch lambda count as one call.
+
+        """
+        self._calls = []
+        self._concurrency = concurrency
+        self._indices = {}
+        self._lock = Lock()
+        self._results = []
+        # The opening tags in effect at the calls to each index, with
+        # None for a call whose delimiters are not known.
+        self._tag_starts = []
+
+    def wrap(self, context):
+        """
+        Return a copy of a context dictionary with its script lambdas deferred.
+
+        In-process lambdas are not deferred, since they gain nothing from
+        running concurrently.
+
+        """
+        context = dict(context)
+        for key, value in context.iteritems():
+            if _is_script_lambda(value):
+                context[key] = _DeferredLambda(value, self)
+        return context
+
+    def defer(self, func, u, delimiters=None):
+        """
+        Record a call and return its placeholder.
+
+        Arguments:
+
+          delimiters: the pair of delimiters the result will be rendered
+            with, or None if not known.  A result rendered with unknown
+            delimiters is never spliced.
+
+        """
+        call = (func, u)
+        tag_start = None if delimiters is None else delimiters[0]
+        with self._lock:
+            index = self._indices.get(call)
+            if index is None:
+                # Then this is not a repeat call.
+                index = len(self._calls)
+                self._calls.append(call)
+                self._indices[call] = index
+                self._tag_starts.append(set())
+            self._tag_starts[index].add(tag_start)
+        return _PLACEHOLDER_FORMAT % index
+
+    def _run_job(self, job):
+        func, indices = job
+        return func.call_many([self._calls[index][1] for index in indices])
+
+    def _make_jobs(self, start):
+        """
+        Return the (func, indices) jobs for running the calls from an index.
+
+        The calls to a batch lambda make up a single job.
+
+        """
+        jobs = []
+        batches = {}
+        for index in range(start, len(self._calls)):
+            func = self._calls[index][0]
+            if not func.batch:
+                jobs.append((func, [index]))
+                continue
+            indices = batches.get(func)
+            if indices is None:
+                indices = batches[func] = []
+                jobs.append((func, indices))
+            indices.append(index)
+        return jobs
+
+    def run(self):
+        """
+        Run the calls collected since the last call to run().
+
+        """
+        start = len(self._results)
+        jobs = self._make_jobs(start)
+        if not jobs:
+            return
+        thread_count = min(self._concurrency, len(jobs))
+        _log.debug("running %d lambda calls as %d jobs with %d threads" %
+                   (len(self._calls) - start, len(jobs), thread_count))
+        if thread_count <= 1:
+            job_results = map(self._run_job, jobs)
+        else:
+            pool = ThreadPool(thread_count)
+            try:
+                job_results = pool.map(self._run_job, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        results = [None] * (len(self._calls) - start)
+        for (func, indices), outputs in zip(jobs, job_results):
+            for index, output in zip(indices, outputs):
+                results[index - start] = output
+        self._results.extend(results)
+
+    def splice(self, u):
+        """
+        Return the text with its placeholders replaced, or None if not possible.
+
+        """
+        results = self._results
+        tag_starts = self._tag_starts
+        failed = []
+        def replace(match):
+            index = int(match.group(1))
+            result = results[index]
+            for tag_start in tag_starts[index]:
+                if tag_start is None or tag_start in result:
+                    failed.append(result)
+                    break
+            return result
+        u = _PLACEHOLDER_PATTERN.sub(replace, u)
+        return None if failed else u
+
+
+def _is_python_module(path):
+    """
+    Return whether a lambda file is a Python module to run in process.
+
+    """
+    if os.path.splitext(path)[1] != PYTHON_EXT:
+        return False
+    with open(path, 'rb') as f:
+        # A Python file with a "#!" line is run as a script, as before.
+        return f.read(2) != b'#!'
+
+
+def _load_lambda(path, cache):
+    if _is_python_module(path):
+        return PythonLambda(path)
+    return ScriptLambda(path, cache=cache)
+
+
+class _LazyLambda(object):
+
+    """
+    A lambda that is loaded when first called.
+
+    """
+
+    def __init__(self, path, cache):
+        self._cache = cache
+        self._func = None
+        self._lock = Lock()
+        self.path = path
+        self.stats = LambdaStats()
+
+    def _get_func(self):
+        with self._lock:
+            if self._func is None:
+                _log.debug("loading lambda on first call: %s" % self.path)
+                self._func = _load_lambda(self.path, self._cache)
+                # Share the stats so that they include all calls.
+                self._func.stats = self.stats
+            return self._func
+
+    def __call__(self, u=None):
+        return self._get_func()(u)
+
+    def is_script(self):
+        """
+        Return whether the lambda is a script, without loading it.
+
+        """
+        return not _is_python_module(self.path)
+
+    @property
+    def batch(self):
+        """
+        Whether the lambda is a batch script, read without loading it.
+
+        """
+        return (self.is_script() and
+                bool(read_directives(self.path).get(DIRECTIVE_BATCH)))
+
+    def close(self):
+        func = self._func
+        if func is not None:
+            close_lambdas({None: func})
+
+
+def _is_script_lambda(value):
+    """
+    Return whether a context value is a script lambda, without loading it.
+
+    """
+    if isinstance(value, _LazyLambda):
+        return value.is_script()
+    return isinstance(value, ScriptLambda)
+
+
+def load_lambdas(lambdas_dir, cache=None, names=None):
+    """
+    Return a dictionary mapping lambda names to lambdas for a lambdas directory.
+
+    Arguments:
+
+      cache: a LambdaCache instance, or None not to cache results.
+
+      names: the names of the lambdas to load now, or None for all.
+        The other lambdas are loaded if and when they are first called,
+        which skips reading their scripts and importing their modules
+        when they are not used (e.g. because no template refers to them).
+
+    """
+    lambdas = {}
+    for file_name in os.listdir(lambdas_dir):
+        if file_name.startswith('.'):
+            # For example, skip .DS_Store.
+            continue
+
+        script_path = os.path.join(lambdas_dir, file_name)
+        root_name, ext = os.path.splitext(file_name)
+
+        root_name = unicode(root_name)
+
+        if names is None or root_name in names:
+            func = _load_lambda(script_path, cache)
+        else:
+            func = _LazyLambda(script_path, cache)
+        lambdas[root_name] = func
+
+    return lambdas
+
+
+def close_lambdas(lambdas):
+    """
+    Stop the worker processes of the lambdas in a dictionary.
+
+    """
+    for func in lambdas.itervalues():
+        close = getattr(func, 'close', None)
+        if close is not None:
+            close()
+
+
+def log_lambda_stats(stats):
+    """
+    Log a dictionary mapping lambda names to LambdaStats, slowest first.
+
+    """
+    items = sorted(stats.iteritems(), key=lambda item: -item[1].total_seconds)
+    for name, lambda_stats in items:
+        if not lambda_stats.calls:
+            continue
+        _log.debug("lambda %s: %d calls, %.3fs total, %.3fs max, "
+                   "%d bytes in, %d bytes out" %
+                   (name, lambda_stats.calls, lambda_stats.total_seconds,
+                    lambda_stats.max_seconds, lambda_stats.bytes_in,
+                    lambda_stats.bytes_out))
+
+
+def has_batch_lambdas(context):
+    """
+    Return whether a context dictionary contains a batch lambda.
+
+    """
+    return any(_is_script_lambda(value) and value.batch for
+               value in context.itervalues())
@@ -0,0 +1,156 @@
+# encoding: utf-8
+#
+# Copyright (C) 2012 Chris Jerdonek. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * The names of the copyright holders may not be used to endorse or promote
+#   products derived from this software without specific prior written
+#   permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Supports incremental rendering by recording the inputs of each output file.
+
+"""
+
+from __future__ import absolute_import
+
+import hashlib
+import json
+import logging
+import os
+
+import molt
+from molt.constants import MANIFEST_FILE_NAME
+from molt.general.error import reraise
+
+
+_log = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 64 * 1024
+
+
+def hash_file(path):
+    """
+    Return a hex digest of the contents of the file at the given path.
+
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_dir(dir_path):
+    """
+    Return a hex digest of the relative paths and contents of a directory.
+
+    Returns the empty string if dir_path is None.
+
+    """
+    if dir_path is None:
+        return ''
+    digest = hashlib.sha1()
+    for root, dir_names, file_names in os.walk(dir_path):
+        dir_names.sort()
+        for name in sorted(file_names):
+            path = os.path.join(root, name)
+            rel_path = os.path.relpath(path, dir_path)
+            entry = "%s\0%s\0" % (rel_path, hash_file(path))
+            if isinstance(entry, unicode):
+                # Hashing needs bytes (e.g. under Python 3).
+                entry = entry.encode('utf-8')
+            digest.update(entry)
+    return digest.hexdigest()
+
+
+def hash_data(data):
+    """
+    Return a hex digest of JSON-like data.
+
+    Values that are not JSON-serializable are hashed by their repr().
+
+    """
+    s = json.dumps(data, sort_keys=True, default=repr)
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+
+class Manifest(object):
+
+    """
+    Records the inputs of each file in an output directory.
+
+    The files attribute maps each output file path, relative to the
+    output directory, to a dictionary of the hashes of its inputs.  The
+    dirs attribute is the list of output directory paths, relative to
+    the output directory.
+
+    """
+
+    def __init__(self, files=None, dirs=None):
+        if dirs is None:
+            dirs = []
+        if files is None:
+            files = {}
+        self.dirs = dirs
+        self.files = files
+
+    @classmethod
+    def load(cls, output_dir):
+        """
+        Read the manifest in an output directory.
+
+        Returns an empty manifest if the directory has no manifest or a
+        manifest written by a different version of Molt.
+
+        """
+        path = os.path.join(output_dir, MANIFEST_FILE_NAME)
+        if not os.path.exists(path):
+            return cls()
+        try:
+            with open(path, 'rb') as f:
+                data = json.loads(f.read().decode('utf-8'))
+        except ValueError:
+            reraise("manifest path: %s" % path)
+        if data.get('version') != molt.__version__:
+            _log.debug("ignoring manifest from version %r: %s" %
+                       (data.get('version'), path))
+            return cls()
+        return cls(files=data['files'], dirs=data['dirs'])
+
+    def save(self, output_dir):
+        path = os.path.join(output_dir, MANIFEST_FILE_NAME)
+        data = {
+            'version': molt.__version__,
+            'dirs': sorted(self.dirs),
+            'files': self.files,
+        }
+        temp_path = path + '.tmp'
+        # The JSON is ASCII, since ensure_ascii is true by default.
+        s = json.dumps(data, indent=1, sort_keys=True)
+        with open(temp_path, 'wb') as f:
+            f.write(s.encode('utf-8'))
+        # Remove first since os.rename() does not overwrite on Windows.
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(temp_path, path)
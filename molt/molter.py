@@ -34,27 +34,68 @@ Exposes a Molter class to render a template directory.
 
 from __future__ import absolute_import
 
+import codecs
+from collections import namedtuple
+import json
+from contextlib import contextmanager
+from itertools import imap
 import logging
+from multiprocessing.pool import ThreadPool
 import os
-from shutil import copyfile
+import re
 from subprocess import Popen, PIPE, STDOUT
+import sys
+from tempfile import mkstemp
 
+import pystache
+from pystache.loader import Loader as PystacheLoader
 from pystache import Renderer as PystacheRenderer
+from pystache.common import TemplateNotFoundError
+from pystache.parsed import ParsedTemplate
+from pystache.parser import (NON_BLANK_RE, parse, _InvertedNode, _PartialNode,
+                             _SectionNode)
 
 import molt
+from molt.analyzer import count_calls, find_dependencies
 from molt.general import io
+from molt.general.archive import get_file_mode, ArchiveWriter
 from molt.general.error import Error
-from molt.general.popen import call_script
 from  molt import defaults
+from molt.configcache import ConfigCache
 from molt.dirutil import DirectoryChooser
+from molt.lambdas import (close_lambdas, has_batch_lambdas, load_lambdas,
+                          log_lambda_stats, LambdaCache, LambdaDispatcher,
+                          LambdaStats, _DeferredLambda)
+from molt.manifest import hash_data, hash_dir, hash_file, Manifest
+from molt.sources import load_sources
+from molt.templatecache import TemplateCache
 
 
 TEMPLATE_EXT = '.mustache'
 SKIP_EXT = '.skip'
 
 
+try:
+    import resource
+except ImportError:
+    # Then peak memory use is not available (e.g. on Windows).
+    resource = None
+
 _log = logging.getLogger(__name__)
 
+# The Linux files for reading and resetting the resident memory of the
+# process.  Writing "5" to clear_refs resets the peak (VmHWM) to the
+# current resident memory (VmRSS).
+_PROC_STATUS_PATH = '/proc/self/status'
+_PROC_CLEAR_REFS_PATH = '/proc/self/clear_refs'
+
+# The start of a Mustache tag, for checking template file contents.
+TAG_START = b'{{'
+
+# The start of a tag in a file or directory name.  A native string, since
+# names are byte strings under Python 2 and never decoded for the check.
+_NAME_TAG_START = '{{'
+
 
 def preprocess_filename(filename):
     is_template = False
@@ -74,28 +115,61 @@ def preprocess_filename(filename):
     return filename, is_template
 
 
-def _lambda_from_script(path):
-    def func(u=None):
-        if u is None:
-            u = ''
-        bytes_in = u.encode(defaults.LAMBDA_ENCODING, errors=defaults.ENCODING_ERRORS)
+class Molter(object):
 
-        stdout, stderr, return_code = call_script(path, bytes_in)
+    def __init__(self, encoding='utf-8', decode_errors='strict', chooser=None,
+                 jobs=None, cache_dir=None, stream_threshold=None, copy_mode=None,
+                 lambda_concurrency=None, lambda_stats_path=None):
+        """
+        Arguments:
 
-        return stdout.decode(defaults.LAMBDA_ENCODING, errors=defaults.ENCODING_ERRORS)
+          jobs: the number of files to render concurrently.  Defaults to
+            rendering one file at a time.
 
-    return func
+          cache_dir: a directory in which to persist parsed templates,
+            configs, and lambda results across runs.  If None, they are cached only for
+            the lifetime of this instance.
 
+          stream_threshold: the rendered size in characters at or above
+            which to write rendered files as they render.  Defaults to
+            the package default.
 
-class Molter(object):
+          copy_mode: how to copy non-template files to the output
+            directory.  See the io.copy_file() docstring.
+
+          lambda_concurrency: if not None, the maximum number of lambda
+            script calls to run at once.  Calls are then collected across
+            all files and run concurrently before any file is written.
+            Defaults to running each call as it is made, except for calls
+            to batch lambdas, which are always collected.
 
-    def __init__(self, encoding='utf-8', decode_errors='strict', chooser=None):
+          lambda_stats_path: a path to which to write the lambda stats as
+            JSON each time a template is done rendering.  See the
+            get_lambda_stats() docstring.
+
+        """
         if chooser is None:
             chooser = DirectoryChooser()
+        if jobs is None:
+            jobs = defaults.RENDER_JOBS
+        if jobs < 1:
+            raise Error("Number of jobs must be at least 1: %r" % jobs)
+        if lambda_concurrency is not None and lambda_concurrency < 1:
+            raise Error("Lambda concurrency must be at least 1: %r" %
+                        lambda_concurrency)
 
         self.chooser = chooser
+        self.copy_mode = copy_mode
         self.decode_errors = decode_errors
         self.encoding = encoding
+        self.jobs = jobs
+        self.lambda_concurrency = lambda_concurrency
+        self.lambda_stats = {}
+        self.lambda_stats_path = lambda_stats_path
+        self.stream_threshold = stream_threshold
+        self.configs = ConfigCache(cache_dir=cache_dir)
+        self.lambda_cache = LambdaCache(cache_dir=cache_dir)
+        self.templates = TemplateCache(cache_dir=cache_dir)
 
     def _get_config_path(self, template_dir, config_path):
         return self.chooser.get_config_path(config_path, template_dir)
@@ -103,20 +177,28 @@ class Molter(object):
     def read_config(self, template_dir, config_path=None):
         path = self._get_config_path(template_dir, config_path)
         try:
-            return io.deserialize(path, self.encoding, self.decode_errors)
+            return self.configs.load(path, self.encoding, self.decode_errors)
         except Exception, err:
             # TODO: reraise existing exception and add additional info instead
             #   of swallowing caught exception and raising a new one.
             raise Error("Error loading config at: %s\n-->%s" % (path, err))
 
+    def _read_context(self, template_dir, config_path):
+        """
+        Return the context in a config file, with its data sources loaded.
+
+        """
+        path = self._get_config_path(template_dir, config_path)
+        data = self.read_config(template_dir, path)
+        context = data[defaults.CONFIG_CONTEXT_KEY]
+        return load_sources(context, os.path.dirname(path), self.encoding)
+
     def get_context(self, template_dir, config_path=None):
         """"
         Return the context (including lambdas) for the given template.
 
         """
-        data = self.read_config(template_dir, config_path)
-
-        context = data[defaults.CONFIG_CONTEXT_KEY]
+        context = self._read_context(template_dir, config_path)
 
         lambdas_dir = self.chooser.get_lambdas_dir(template_dir)
         lambdas = [] if lambdas_dir is None else self.get_lambdas(lambdas_dir)
@@ -127,32 +209,234 @@ class Molter(object):
         return context
 
     def get_lambdas(self, lambda_dir):
-        lambdas = {}
-        for file_name in os.listdir(lambda_dir):
-            if file_name.startswith('.'):
-                # For example, skip .DS_Store.
-                continue
-
-            script_path = os.path.join(lambda_dir, file_name)
-            func = _lambda_from_script(script_path)
-            root_name, ext = os.path.splitext(file_name)
+        return load_lambdas(lambda_dir, cache=self.lambda_cache)
 
-            root_name = unicode(root_name)
-
-            lambdas[root_name] = func
-
-        return lambdas
+    def _load_template(self, template_dir):
+        """
+        Return a _Template instance for the given template directory.
 
-    # TODO: create a class to hold and pass the arguments along.
-    def molt(self, template_dir, output_dir, config_path=None):
+        """
         chooser = self.chooser
 
-        project_dir = chooser.get_project_dir(template_dir)
+        structure_dir = chooser.get_project_dir(template_dir)
         partials_dir = chooser.get_partials_dir(template_dir)
         lambdas_dir = chooser.get_lambdas_dir(template_dir)
-        config_path = self._get_config_path(template_dir, config_path)
 
-        context = self.get_context(template_dir, config_path)
+        partials = _PartialLoader(partials_dir, encoding=self.encoding)
+        structure = scan_dir(structure_dir)
+
+        template = _Template(template_dir, structure_dir=structure_dir,
+                             partials_dir=partials_dir, lambdas_dir=lambdas_dir,
+                             lambdas={}, partials=partials, structure=structure)
+        keys = self._analyze(template)
+        if lambdas_dir is not None:
+            # Lambdas no file refers to are loaded only if called, e.g. by
+            # the output of another lambda.
+            template.lambdas = load_lambdas(lambdas_dir, cache=self.lambda_cache,
+                                            names=keys)
+        return template
+
+    def _analyze(self, template):
+        """
+        Record the dependencies of each file in a template's structure.
+
+        Fills in the template's dependencies and literals attributes, and
+        returns the set of the keys used by all files, or None if not known.
+
+        """
+        encoding, errors = self.encoding, self.decode_errors
+        all_keys = set()
+        parsed_partials = {}
+
+        def get_partial(name):
+            if name not in parsed_partials:
+                u = template.partials.get(name)
+                parsed_partials[name] = None if u is None else parse(u)
+            return parsed_partials[name]
+
+        def get_name_keys(name):
+            if _is_literal_name(name):
+                return set()
+            if isinstance(name, str):
+                name = name.decode(encoding, 'replace')
+            return find_dependencies(parse(name))[0]
+
+        def analyze_file(path, is_template):
+            """Return a (keys, partials) pair for the contents of a file."""
+            if not is_template:
+                return set(), set()
+            with open(path, 'rb') as f:
+                b = f.read()
+            if TAG_START in b:
+                parsed = self.templates.parse_path(path, encoding, errors)
+                return find_dependencies(parsed, get_partial)
+            try:
+                b.decode(encoding)
+            except UnicodeDecodeError:
+                # Then leave it to rendering to report the error.
+                pass
+            else:
+                template.literals[path] = True
+            return set(), set()
+
+        def analyze_dir(entries, name_keys):
+            for name, path, children, size in entries:
+                keys = name_keys | get_name_keys(name)
+                all_keys.update(keys)
+                if children is not None:
+                    analyze_dir(children, keys)
+                    continue
+                file_keys, partials = analyze_file(path, preprocess_filename(name)[1])
+                all_keys.update(file_keys)
+                template.dependencies[path] = (keys | file_keys, partials)
+
+        try:
+            analyze_dir(template.structure, set())
+        except Exception, err:
+            # Then rendering will report the error (e.g. an undecodable
+            # file) with more context.
+            _log.debug("skipping template analysis: %s: %s" %
+                       (err.__class__.__name__, err))
+            template.dependencies.clear()
+            return None
+        return all_keys
+
+    @contextmanager
+    def _open_template(self, template_dir):
+        """
+        Return a contextmanager that loads a template and cleans up afterwards.
+
+        Cleaning up stops any lambda worker processes.
+
+        """
+        template = self._load_template(template_dir)
+        try:
+            yield template
+        finally:
+            close_lambdas(template.lambdas)
+            self._add_lambda_stats(template.lambdas)
+            self.configs.log_stats()
+            self.lambda_cache.log_stats()
+            self.templates.log_stats()
+
+    def _add_lambda_stats(self, lambdas):
+        for name, func in lambdas.iteritems():
+            self.lambda_stats.setdefault(name, LambdaStats()).update(func.stats)
+        log_lambda_stats(self.lambda_stats)
+        if self.lambda_stats_path is not None:
+            with open(self.lambda_stats_path, 'wb') as f:
+                json.dump(self.get_lambda_stats(), f, indent=2, sort_keys=True)
+
+    def get_lambda_stats(self):
+        """
+        Return the stats of the lambdas called so far, as a dictionary.
+
+        The dictionary maps each lambda name to a dictionary with keys
+        "calls", "total_seconds", "max_seconds", "bytes_in", and
+        "bytes_out".  Stats are summed across templates with lambdas of
+        the same name.  Calls answered from the lambda cache are included.
+
+        """
+        return dict((name, stats.to_dict()) for
+                    name, stats in self.lambda_stats.iteritems())
+
+    def _get_inputs(self, template, context):
+        """
+        Return a function that returns the hashes of a file's inputs.
+
+        The function accepts an Operation instance and returns a dictionary.
+        Files that use no lambdas depend only on the context values and
+        partials they refer to.  The output of a lambda is rendered, so a
+        file that uses one depends on the whole context, all partials, and
+        all lambda scripts.
+
+        """
+        # Lambdas are hashed by their scripts rather than by value.
+        data = dict((key, value) for key, value in context.iteritems() if
+                    not callable(value))
+        lambda_names = set(key for key, value in context.iteritems() if
+                           callable(value))
+        inputs = {
+            'context': hash_data(data),
+            'pystache': pystache.__version__,
+        }
+        inputs.update(template.get_dir_hashes())
+
+        def get_inputs(op):
+            dependencies = _describe_dependencies(template, op.source, lambda_names)
+            if dependencies is None:
+                return inputs
+            if dependencies['lambdas']:
+                file_inputs = dict(inputs)
+            elif op.kind == OP_COPY:
+                # Then the name can depend on the context but not the contents,
+                # and the output path already reflects the name.
+                file_inputs = {}
+            else:
+                keys = dependencies['keys']
+                used_data = dict((key, data[key]) for key in keys if key in data)
+                used_partials = dict((name, template.partials.get(name)) for
+                                     name in dependencies['partials'])
+                file_inputs = {
+                    'context': hash_data(used_data),
+                    'partials': hash_data(used_partials),
+                    'pystache': pystache.__version__,
+                }
+            # Recording the dependencies makes the manifest an index of them.
+            file_inputs['depends'] = dependencies
+            return file_inputs
+
+        return get_inputs
+
+    def index(self, template_dir, output_dir, config_path=None):
+        """
+        Return the context keys, partials, and lambdas each output file uses.
+
+        Returns a dictionary mapping each output file path, relative to the
+        output directory, to a dictionary with keys "keys", "partials",
+        and "lambdas", each a sorted list of names.  The keys include the
+        keys used in the file's path.  If the template could not be
+        analyzed, the dictionary is empty.
+
+        """
+        with self._open_template(template_dir) as template:
+            context, renderer = self._prepare(template, config_path, output_dir)
+            plan = renderer.plan(template.structure_dir, context, output_dir,
+                                 structure=template.structure)
+        lambda_names = set(key for key, value in context.iteritems() if
+                           callable(value))
+        index = {}
+        for op in plan:
+            if op.kind == OP_MKDIR:
+                continue
+            dependencies = _describe_dependencies(template, op.source, lambda_names)
+            if dependencies is None:
+                return {}
+            index[os.path.relpath(op.target, output_dir)] = dependencies
+        return index
+
+    def _prepare(self, template, config_path, destination, context=None):
+        """
+        Return a (context, renderer) pair for rendering a loaded template.
+
+        Arguments:
+
+          template: a _Template instance.
+
+          destination: the output path, for logging.
+
+          context: the context to use instead of reading the config file.
+
+        """
+        if context is None:
+            config_path = self._get_config_path(template.template_dir, config_path)
+            context = self._read_context(template.template_dir, config_path)
+        else:
+            # Copy the context so that adding the lambdas does not change it.
+            context = dict(context)
+            config_path = None
+        # TODO: raise an exception if lambdas and context intersect?
+        context.update(template.lambdas)
 
         _log.debug("""\
 Rendering:
@@ -163,17 +447,560 @@ Rendering:
   Config file:         %s
 
   Destination: %s
-    """ % (project_dir, partials_dir, lambdas_dir, config_path, output_dir))
+    """ % (template.structure_dir, template.partials_dir, template.lambdas_dir,
+           config_path, destination))
+
+        pystache_renderer = PystacheRenderer(partials=template.partials,
+                                             file_encoding=self.encoding)
 
-        search_dirs = [partials_dir]
+        renderer = _Renderer(pystache_renderer, self.templates, jobs=self.jobs,
+                             stream_threshold=self.stream_threshold,
+                             copy_mode=self.copy_mode, literals=template.literals,
+                             lambda_concurrency=self.lambda_concurrency)
+
+        return context, renderer
+
+    def _molt(self, template, output_dir, config_path, incremental):
+        """
+        Render a loaded template.
 
-        pystache_renderer = PystacheRenderer(search_dirs=search_dirs, file_encoding=self.encoding)
+        Arguments:
 
-        renderer = _Renderer(pystache_renderer)
+          template: a _Template instance.
 
-        renderer.render(structure_dir=project_dir, context=context, output_dir=output_dir)
+        """
+        context, renderer = self._prepare(template, config_path, output_dir)
+
+        structure_dir = template.structure_dir
+        if incremental:
+            get_inputs = self._get_inputs(template, context)
+            renderer.render_incremental(structure_dir=structure_dir, context=context,
+                                        output_dir=output_dir, get_inputs=get_inputs,
+                                        structure=template.structure)
+        else:
+            renderer.render(structure_dir=structure_dir, context=context,
+                            output_dir=output_dir, structure=template.structure)
         _log.debug("Wrote new project to: %s" % repr(output_dir))
 
+    # TODO: create a class to hold and pass the arguments along.
+    def molt(self, template_dir, output_dir, config_path=None, incremental=False):
+        """
+        Render a template directory to an output directory.
+
+        Arguments:
+
+          incremental: whether to render only the files whose inputs changed
+            since the last incremental render to the same output directory.
+            The inputs are recorded in a manifest file in the output directory.
+
+        """
+        with self._open_template(template_dir) as template:
+            self._molt(template, output_dir, config_path, incremental)
+
+    def plan(self, template_dir, output_dir, config_path=None):
+        """
+        Return the plan for rendering a template without writing anything.
+
+        Returns a (plan, summary) pair, where plan is a list of Operation
+        instances and summary is the return value of summarize_plan()
+        with an additional "lambda_calls" estimate.
+
+        """
+        with self._open_template(template_dir) as template:
+            context, renderer = self._prepare(template, config_path, output_dir)
+            plan = renderer.plan(template.structure_dir, context, output_dir,
+                                 structure=template.structure)
+            summary = summarize_plan(plan)
+            summary['lambda_calls'] = renderer.count_lambda_calls(plan, context)
+        return plan, summary
+
+    def molt_archive(self, template_dir, archive_path, config_path=None):
+        """
+        Render a template directory directly into a tar or zip archive.
+
+        Entries are added in sorted order with fixed timestamps, so
+        rendering the same inputs gives a byte-identical archive.
+
+        Arguments:
+
+          archive_path: the path of the archive to create.  The format is
+            chosen by the file name extension.  See the ArchiveWriter
+            docstring.
+
+        """
+        with self._open_template(template_dir) as template:
+            context, renderer = self._prepare(template, config_path, archive_path)
+            with ArchiveWriter(archive_path) as archive:
+                renderer.render_to_writer(template.structure_dir, context, archive,
+                                          structure=template.structure)
+        _log.debug("Wrote new project to: %s" % repr(archive_path))
+
+    def render_to_memory(self, template_dir, context=None, config_path=None):
+        """
+        Render a template directory without writing any output files.
+
+        Returns a dictionary mapping the relative path of each output file,
+        using "/" as the separator, to the file contents as bytes.  Empty
+        directories are not included.
+
+        Arguments:
+
+          context: the context dictionary to render with.  Defaults to
+            reading the context from the config file.  The template's
+            lambdas are added to a copy of the dictionary.
+
+          config_path: the config file to read if context is None.
+            Defaults to the template's default config file.
+
+        """
+        writer = _MemoryWriter()
+        with self._open_template(template_dir) as template:
+            context, renderer = self._prepare(template, config_path, '<memory>',
+                                              context=context)
+            renderer.render_to_writer(template.structure_dir, context, writer,
+                                      structure=template.structure, stream=False)
+        return writer.files
+
+    def _molt_job(self, args):
+        """
+        Call _molt() from a worker thread.
+
+        """
+        template, config_path, output_dir, incremental = args
+        try:
+            self._molt(template, output_dir, config_path, incremental)
+        except Exception, err:
+            raise Error("Error rendering config: %s\n-->%s: %s" %
+                        (config_path, err.__class__.__name__, err))
+
+    def molt_many(self, template_dir, configs, jobs=None, incremental=False):
+        """
+        Render a template directory once for each of several configs.
+
+        The template directory is scanned once, and its lambdas, partials,
+        and parsed templates are shared across configs.
+
+        Arguments:
+
+          configs: an iterable of (config_path, output_dir) pairs.  Each
+            output directory should already exist.
+
+          jobs: the number of configs to render concurrently.  Defaults to
+            rendering one config at a time.  This is independent of the
+            number of files per config to render concurrently.
+
+          incremental: see the molt() docstring.
+
+        """
+        if jobs is None:
+            jobs = defaults.RENDER_JOBS
+        with self._open_template(template_dir) as template:
+            args = [(template, config_path, output_dir, incremental) for
+                    config_path, output_dir in configs]
+            jobs = min(jobs, len(args))
+            if jobs <= 1:
+                for template, config_path, output_dir, incremental in args:
+                    self._molt(template, output_dir, config_path, incremental)
+                return
+            _log.debug("rendering %d configs with %d threads" % (len(args), jobs))
+            pool = ThreadPool(jobs)
+            try:
+                pool.map(self._molt_job, args)
+            finally:
+                pool.close()
+                pool.join()
+
+
+def _is_literal_name(name):
+    """
+    Return whether a file or directory name contains no Mustache tags.
+
+    """
+    # Names are always parsed with the default delimiters, and changing
+    # the delimiters requires a tag.
+    return _NAME_TAG_START not in name
+
+
+def _describe_dependencies(template, path, lambda_names):
+    """
+    Return the dependencies of a structure file as a dictionary of lists.
+
+    Returns None if the dependencies are not known.
+
+    """
+    dependencies = template.dependencies.get(path)
+    if dependencies is None:
+        return None
+    keys, partials = dependencies
+    return {
+        'keys': sorted(keys - lambda_names),
+        'lambdas': sorted(keys & lambda_names),
+        'partials': sorted(partials),
+    }
+
+
+def scan_dir(dir_path):
+    """
+    Recursively list a directory.
+
+    Returns a list of (name, path, children, size) tuples, where children
+    is None for a file and otherwise a list of the same form, and size is
+    the file size in bytes (0 for a directory).
+
+    """
+    entries = []
+    for name, path, is_dir, size in io.list_dir(dir_path):
+        children = scan_dir(path) if is_dir else None
+        entries.append((name, path, children, size))
+    return entries
+
+
+OP_COPY = 'copy'
+OP_MKDIR = 'mkdir'
+OP_RENDER = 'render'
+
+# An operation in a render plan.
+#
+#   kind: one of OP_COPY, OP_MKDIR, or OP_RENDER.
+#   source: the path in the structure directory.
+#   target: the output path.
+#   size: the size of the source file in bytes (0 for OP_MKDIR).
+#
+Operation = namedtuple('Operation', 'kind source target size')
+
+
+def summarize_plan(plan):
+    """
+    Return a dictionary of totals for a list of Operation instances.
+
+    """
+    summary = dict(dirs=0, copied=0, rendered=0, bytes=0)
+    for op in plan:
+        key = {OP_COPY: 'copied', OP_MKDIR: 'dirs', OP_RENDER: 'rendered'}[op.kind]
+        summary[key] += 1
+        summary['bytes'] += op.size
+    summary['files'] = summary['copied'] + summary['rendered']
+    return summary
+
+
+class _Template(object):
+
+    """
+    Holds the parts of a template directory that do not depend on the config.
+
+    """
+
+    def __init__(self, template_dir, structure_dir, partials_dir, lambdas_dir,
+                 lambdas, partials, structure):
+        """
+        Arguments:
+
+          lambdas: a dictionary of lambda functions.
+
+          partials: a _PartialLoader instance.
+
+          structure: the return value of scan_dir() for the structure
+            directory.
+
+        """
+        self.lambdas = lambdas
+        self.lambdas_dir = lambdas_dir
+        self.partials = partials
+        self.partials_dir = partials_dir
+        self.structure = structure
+        self.structure_dir = structure_dir
+        self.template_dir = template_dir
+
+        # Whether each template file in the structure contains no tags.
+        self.literals = {}
+
+        # A dictionary mapping each file path in the structure to a
+        # (keys, partials) pair of the sets of context keys and partial
+        # names it uses.  See Molter._analyze().
+        self.dependencies = {}
+
+        self._dir_hashes = None
+
+    def get_dir_hashes(self):
+        """
+        Return a dictionary of the hashes of the partials and lambdas.
+
+        """
+        if self._dir_hashes is None:
+            self._dir_hashes = {
+                'lambdas': hash_dir(self.lambdas_dir),
+                'partials': hash_dir(self.partials_dir),
+            }
+        return self._dir_hashes
+
+
+class _MemoryWriter(object):
+
+    """
+    Collects rendered files in a dictionary.
+
+    Instances can be passed to _Renderer.render_to_writer().
+
+    """
+
+    def __init__(self):
+        # A mapping from relative path to bytes.
+        self.files = {}
+
+    def add_dir(self, name):
+        pass
+
+    def add_bytes(self, name, b, mode):
+        self.files[name] = b
+
+    def add_file(self, name, path, mode):
+        with open(path, 'rb') as f:
+            self.files[name] = f.read()
+
+
+def _stream_nodes(parse_tree, engine, context, write):
+    """
+    Render the nodes of a parse tree, passing the output to write().
+
+    This follows Pystache's own rendering, except that sections, inverted
+    sections, and partials pass their output to write() as they render
+    rather than joining it into one string.  So the output of a section
+    is never held in memory in full, even for a long list.
+
+    """
+    for node in parse_tree:
+        node_type = type(node)
+        if node_type is unicode:
+            write(node)
+        elif node_type is _SectionNode:
+            _stream_section(node, engine, context, write)
+        elif node_type is _InvertedNode:
+            # Lambdas are considered truthy for inverted sections per the spec.
+            if not engine.resolve_context(context, node.key):
+                _stream_nodes(node.parsed_section._parse_tree, engine, context,
+                              write)
+        elif node_type is _PartialNode:
+            template = engine.resolve_partial(node.key)
+            # Indent before rendering, as _PartialNode.render() does.
+            template = re.sub(NON_BLANK_RE, node.indent + ur'\1', template)
+            _stream_nodes(parse(template)._parse_tree, engine, context, write)
+        else:
+            write(node.render(engine, context))
+
+
+def _stream_section(node, engine, context, write):
+    """
+    Render a section node, passing the output of each item to write().
+
+    """
+    for value in engine.fetch_section_data(context, node.key):
+        if callable(value):
+            # Then the value is a lambda, which gets the unprocessed section
+            # contents.  See _SectionNode.render().
+            u = node.template[node.index_begin:node.index_end]
+            if isinstance(value, _DeferredLambda):
+                # Then splicing the result needs the delimiters in effect.
+                value = value.call_section(u, node.delimiters)
+            else:
+                value = value(u)
+            write(engine._render_value(value, context, delimiters=node.delimiters))
+            continue
+        context.push(value)
+        _stream_nodes(node.parsed._parse_tree, engine, context, write)
+        context.pop()
+
+
+class _StreamingTemplate(ParsedTemplate):
+
+    """
+    Wraps a ParsedTemplate to pass its rendering to a function piece by piece.
+
+    See _stream_nodes() for how the rendering is divided.
+
+    """
+
+    def __init__(self, parsed, write):
+        """
+        Arguments:
+
+          parsed: a ParsedTemplate instance.
+
+          write: a function that accepts a unicode string.
+
+        """
+        # We share the parse tree rather than copying it.
+        self._parse_tree = parsed._parse_tree
+        self._write = write
+
+    def render(self, engine, context):
+        _stream_nodes(self._parse_tree, engine, context, self._write)
+        return u''
+
+
+class _StreamWriter(object):
+
+    """
+    Collects rendered output, and writes it to a file once it is large.
+
+    Output is kept in memory until it reaches a threshold size.  Then a
+    file is opened, and the output so far and all later output are
+    written to it as they arrive.  So output below the threshold is
+    written with a single write() call, and larger output is never
+    held in memory in full.
+
+    """
+
+    def __init__(self, open_file, threshold):
+        """
+        Arguments:
+
+          open_file: a function that opens and returns a file object for
+            writing bytes.  It is called only if the output reaches the
+            threshold.
+
+          threshold: the size of the output in characters at or above
+            which to open the file.
+
+        """
+        self._encoder = codecs.getincrementalencoder(defaults.OUTPUT_FILE_ENCODING)(
+            defaults.ENCODING_ERRORS)
+        self._file = None
+        self._open_file = open_file
+        self._parts = []
+        self._size = 0
+        self.threshold = threshold
+
+    def write(self, u):
+        if self._file is not None:
+            self._file.write(self._encoder.encode(u))
+            return
+        self._parts.append(u)
+        self._size += len(u)
+        if self._size >= self.threshold:
+            self._file = self._open_file()
+            self.write(u''.join(self._parts))
+            self._parts = None
+
+    def close(self):
+        """
+        Finish writing, and return the output if no file was opened.
+
+        Returns None if the output was written to a file, and otherwise
+        the output as a unicode string.
+
+        """
+        if self._file is None:
+            return u''.join(self._parts)
+        try:
+            self._file.write(self._encoder.encode(u'', True))
+        finally:
+            self._file.close()
+        return None
+
+
+def _read_proc_memory():
+    """
+    Return the (current, peak) resident memory of the process in kilobytes.
+
+    Returns None if not available (e.g. when not on Linux).
+
+    """
+    values = {}
+    try:
+        with open(_PROC_STATUS_PATH, 'rb') as f:
+            for line in f:
+                name, sep, value = line.partition(b':')
+                if name in (b'VmRSS', b'VmHWM'):
+                    values[name] = int(value.split()[0])
+    except (IOError, OSError):
+        return None
+    if len(values) != 2:
+        return None
+    return values[b'VmRSS'], values[b'VmHWM']
+
+
+def _reset_peak_memory():
+    """
+    Reset the peak resident memory of the process to its current value.
+
+    Returns the current resident memory in kilobytes, or None if the peak
+    cannot be reset.  Afterwards, the peak returned by _read_proc_memory()
+    less this value is the most memory used since the reset.
+
+    """
+    try:
+        with open(_PROC_CLEAR_REFS_PATH, 'wb') as f:
+            f.write(b'5')
+    except (IOError, OSError):
+        return None
+    memory = _read_proc_memory()
+    return None if memory is None else memory[0]
+
+
+def _describe_peak_memory(start_kb):
+    """
+    Describe for logging the memory used since a call to _reset_peak_memory().
+
+    Arguments:
+
+      start_kb: the return value of _reset_peak_memory(), or None if the
+        peak was not reset.  Then the peak of the whole process is given.
+
+    """
+    memory = None if start_kb is None else _read_proc_memory()
+    if memory is not None:
+        return "peak memory: +%d KB" % (memory[1] - start_kb)
+    return "process peak memory: %s KB" % _get_peak_memory()
+
+
+def _get_peak_memory():
+    """
+    Return the peak memory use of the process in kilobytes, or None.
+
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # The units of ru_maxrss are bytes on Mac OS X and kilobytes elsewhere.
+    if sys.platform == 'darwin':
+        return usage.ru_maxrss // 1024
+    return usage.ru_maxrss
+
+
+class _PartialLoader(object):
+
+    """
+    Loads partials by name, reading each partial file at most once.
+
+    Instances can be passed to pystache.Renderer as the partials argument.
+
+    """
+
+    def __init__(self, partials_dir, encoding):
+        loader = (None if partials_dir is None else
+                  PystacheLoader(file_encoding=encoding, search_dirs=[partials_dir]))
+
+        self._loader = loader
+        self._partials = {}
+
+    def get(self, name):
+        """
+        Return the partial with the given name, or None if not found.
+
+        """
+        try:
+            return self._partials[name]
+        except KeyError:
+            pass
+        partial = None
+        if self._loader is not None:
+            try:
+                partial = self._loader.load_name(name)
+            except TemplateNotFoundError:
+                pass
+        self._partials[name] = partial
+        return partial
+
 
 # TODO: combine this class with the Molter class.
 class _Renderer(object):
@@ -183,14 +1010,60 @@ class _Renderer(object):
 
     """
 
-    def __init__(self, pystache_renderer):
+    def __init__(self, pystache_renderer, templates, jobs=1, stream_threshold=None,
+                 copy_mode=None, literals=None, lambda_concurrency=None):
         """
         Arguments:
 
           pystacher: a pystache.Renderer instance.
 
+          templates: a TemplateCache instance.
+
+          jobs: the number of files to render concurrently.
+
+          stream_threshold: the rendered size in characters at or above
+            which to write the rendered file as it renders instead of
+            rendering the whole file to a string first.
+
+          copy_mode: how to copy non-template files.  See the
+            io.copy_file() docstring.
+
+          literals: a dictionary in which to record whether each template
+            file contains no tags, so that such files can be copied
+            rather than rendered.  Pass the same dictionary when rendering
+            the same structure more than once.
+
+          lambda_concurrency: if not None, the maximum number of lambda
+            script calls to run at once.  Calls are then collected across
+            all files and run concurrently before any file is written.
+
         """
+        if literals is None:
+            literals = {}
+        if stream_threshold is None:
+            stream_threshold = defaults.STREAM_THRESHOLD
+
+        # Template bytes with no tags can be copied as is only if decoding
+        # and encoding them would give back the same bytes.
+        encoding = pystache_renderer.file_encoding
+        can_copy_literals = (
+            codecs.lookup(encoding).name ==
+            codecs.lookup(defaults.OUTPUT_FILE_ENCODING).name and
+            u'{{'.encode(encoding) == TAG_START)
+
+        self._can_copy_literals = can_copy_literals
+        self.copy_mode = copy_mode
+        self.lambda_concurrency = lambda_concurrency
+        self.literals = literals
+        self.jobs = jobs
         self.pystacher = pystache_renderer
+        self.stream_threshold = stream_threshold
+        self.templates = templates
+
+    def _render_name(self, name, context):
+        if _is_literal_name(name):
+            return name
+        return self.pystacher.render(name, context)
 
     def _parse_basename(self, path, context, preprocess):
         """
@@ -203,7 +1076,7 @@ class _Renderer(object):
         dir_path, basename = os.path.split(path)
 
         basename2, is_template = preprocess(basename)
-        basename3 = self.pystacher.render(basename2, context)
+        basename3 = self._render_name(basename2, context)
 
         if not basename3:
             raise Exception("Basename cannot be empty: %s > %s > %s\n"
@@ -227,67 +1100,541 @@ class _Renderer(object):
         """
         return self._parse_basename(path, context, lambda name: (name, False))
 
+    def _parse_path(self, path):
+        pystacher = self.pystacher
+        return self.templates.parse_path(path, pystacher.file_encoding,
+                                         pystacher.decode_errors)
+
     def _render_path_to_string(self, path, context):
         """
         Render the template at a path to a unicode string.
 
         """
-        return self.pystacher.render_path(path, context)
+        return self.pystacher.render(self._parse_path(path), context)
+
+    def _stream_path(self, path, context, open_file):
+        """
+        Render the template at a path, writing to a file once the output is large.
+
+        Returns the rendered output as a unicode string if it stayed
+        below the stream threshold, and otherwise None after writing it
+        to the file returned by open_file().
+
+        """
+        parsed = self._parse_path(path)
+        # The peak memory is that of the whole process, so we measure the
+        # peak for a single file only when rendering one file at a time.
+        start_kb = (_reset_peak_memory() if self.jobs == 1 and
+                    _log.isEnabledFor(logging.DEBUG) else None)
+        writer = _StreamWriter(open_file, self.stream_threshold)
+        try:
+            self.pystacher.render(_StreamingTemplate(parsed, writer.write), context)
+        finally:
+            u = writer.close()
+        if u is None:
+            _log.debug("Streamed: %s (%s)" % (path, _describe_peak_memory(start_kb)))
+        return u
+
+    def _is_literal(self, path):
+        """
+        Return whether the template at a path can be copied rather than rendered.
+
+        """
+        if not self._can_copy_literals:
+            return False
+        is_literal = self.literals.get(path)
+        if is_literal is not None:
+            return is_literal
+
+        with open(path, 'rb') as f:
+            b = f.read()
+        return self._check_literal(path, b)
+
+    def _check_literal(self, path, b):
+        """
+        Return and remember whether the bytes of a template can be copied.
+
+        """
+        is_literal = TAG_START not in b
+        if is_literal:
+            try:
+                b.decode(self.pystacher.file_encoding)
+            except UnicodeDecodeError:
+                # Then leave it to rendering to handle or report the error.
+                is_literal = False
+        self.literals[path] = is_literal
+        return is_literal
+
+    def _read_literal(self, path):
+        """
+        Return the bytes of the template at a path if it can be copied, else None.
+
+        Checking a template reads all of it, so returning the bytes spares
+        reading the file a second time to copy it.
+
+        """
+        if not self._can_copy_literals or self.literals.get(path) is False:
+            return None
+        with open(path, 'rb') as f:
+            b = f.read()
+        if self.literals.get(path) is None and not self._check_literal(path, b):
+            return None
+        return b
 
     def _render_path_to_file(self, path, context, target_path):
         """
         Render the template at a path to a file.
 
         """
-        u = self._render_path_to_string(path, context)
-        io.write(u, target_path, defaults.OUTPUT_FILE_ENCODING, defaults.ENCODING_ERRORS)
+        b = self._read_literal(path)
+        if b is not None:
+            io.write_bytes(b, target_path)
+            return
+        def open_file():
+            _log.debug("Streaming: %s" % repr(str(target_path)))
+            return open(target_path, 'wb')
+        u = self._stream_path(path, context, open_file)
+        if u is not None:
+            io.write(u, target_path, defaults.OUTPUT_FILE_ENCODING,
+                     defaults.ENCODING_ERRORS)
+
+    def _molt_path(self, op, context):
+        """
+        Perform a copy or render operation.
+
+        """
+        if op.kind == OP_COPY:
+            io.copy_file(op.source, op.target, self.copy_mode)
+        else:
+            self._render_path_to_file(op.source, context, op.target)
 
     def molt_file(self, path, context, output_dir):
         filename, is_template = self.parse_filename(path, context)
 
         new_path = os.path.join(output_dir, filename)
 
-        if not is_template:
-            copyfile(path, new_path)
-        else:
-            self._render_path_to_file(path, context, new_path)
+        kind = OP_RENDER if is_template else OP_COPY
+        self._molt_path(Operation(kind, path, new_path, 0), context)
 
-    def _molt_dir(self, dir_path, context, output_dir):
+    def _molt_file_job(self, args):
         """
-        Recursively render the contents of a directory to an output directory.
+        Call _molt_path() from a worker thread.
+
+        Exceptions raised in a worker thread lose their traceback when
+        re-raised in the main thread, so we add the failing path here.
+
+        """
+        op, context = args
+        try:
+            self._molt_path(op, context)
+        except Exception, err:
+            raise Error("Error rendering: %s\n-->%s: %s" %
+                        (op.source, err.__class__.__name__, err))
+
+    def _map(self, func, args):
+        """
+        Call a function on each of the given arguments, using up to jobs threads.
+
+        """
+        jobs = min(self.jobs, len(args))
+        if jobs <= 1:
+            return map(func, args)
+        # We use threads rather than processes because lambdas are closures
+        # (which do not pickle), and because the time goes mostly to file
+        # I/O and lambda subprocesses, both of which release the GIL.
+        _log.debug("processing %d files with %d threads" % (len(args), jobs))
+        pool = ThreadPool(jobs)
+        try:
+            return pool.map(func, args)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _molt_files(self, ops, context):
+        """
+        Perform the given copy and render operations, possibly concurrently.
+
+        """
+        if self._defers_lambdas(context):
+            self._molt_files_deferred(ops, context)
+            return
+        if min(self.jobs, len(ops)) <= 1:
+            for op in ops:
+                self._molt_path(op, context)
+            return
+        self._map(self._molt_file_job, [(op, context) for op in ops])
+
+    def _render_deferred_job(self, args):
+        """
+        Render a file to a string, or return None if the file can be copied.
+
+        """
+        op, context = args
+        try:
+            if self._is_literal(op.source):
+                return None
+            # Rendering node by node passes each deferred section call
+            # the delimiters in effect.  See _stream_section().
+            parts = []
+            parsed = self._parse_path(op.source)
+            self.pystacher.render(_StreamingTemplate(parsed, parts.append), context)
+            return u''.join(parts)
+        except Exception, err:
+            raise Error("Error rendering: %s\n-->%s: %s" %
+                        (op.source, err.__class__.__name__, err))
+
+    def _defers_lambdas(self, context):
+        """
+        Return whether to render files with their lambda calls deferred.
+
+        """
+        return bool(self.lambda_concurrency or has_batch_lambdas(context))
+
+    def _render_deferred(self, render_ops, context):
+        """
+        Render files to strings, running the lambda calls of all files together.
+
+        Each file is rendered with its lambda calls deferred, and the
+        calls then run concurrently, with the calls to each batch lambda
+        in a single run of its script.  Rendered files are held in memory
+        until then, so they are never streamed.
+
+        Returns a list of the rendered strings, with None for each file
+        that can be copied instead.
+
+        """
+        # Without a concurrency, we defer calls only to batch them.
+        dispatcher = LambdaDispatcher(self.lambda_concurrency or 1)
+        deferred_context = dispatcher.wrap(context)
+
+        outputs = self._map(self._render_deferred_job,
+                            [(op, deferred_context) for op in render_ops])
+        dispatcher.run()
+
+        results = []
+        for op, u in zip(render_ops, outputs):
+            if u is not None:
+                spliced = dispatcher.splice(u)
+                if spliced is None:
+                    # Then a lambda result needs rendering.  The lambda results
+                    # are cached, so rendering again usually runs no scripts.
+                    _log.debug("rendering again without deferring lambdas: %s" %
+                               op.source)
+                    spliced = self._render_path_to_string(op.source, context)
+                u = spliced
+            results.append(u)
+        return results
+
+    def _molt_files_deferred(self, ops, context):
+        """
+        Perform the given operations, running the lambda calls of all files together.
+
+        See _render_deferred().
+
+        """
+        copy_ops = [op for op in ops if op.kind == OP_COPY]
+        render_ops = [op for op in ops if op.kind == OP_RENDER]
+
+        self._map(self._molt_file_job, [(op, context) for op in copy_ops])
+        outputs = self._render_deferred(render_ops, context)
+
+        for op, u in zip(render_ops, outputs):
+            if u is None:
+                io.copy_file(op.source, op.target)
+                continue
+            io.write(u, op.target, defaults.OUTPUT_FILE_ENCODING,
+                     defaults.ENCODING_ERRORS)
+
+    def _plan_dir(self, entries, context, output_dir, plan):
+        """
+        Recursively append the operations for a directory to a plan.
+
+        This method renders the file and directory names but does not
+        write anything.  Each directory's OP_MKDIR operation comes before
+        the operations for its contents.
 
         Arguments:
 
-          output_dir: a path to an existing directory.
+          entries: the return value of scan_dir() for the directory.
 
         """
-        for name in os.listdir(dir_path):
-            path = os.path.join(dir_path, name)
-            if not os.path.isdir(path):
-                self.molt_file(path, context, output_dir)
+        for name, path, children, size in entries:
+            if children is None:
+                filename, is_template = self.parse_filename(path, context)
+                target_path = os.path.join(output_dir, filename)
+                kind = OP_RENDER if is_template else OP_COPY
+                plan.append(Operation(kind, path, target_path, size))
                 continue
             # Otherwise, it is a directory.
             new_name = self.parse_dirname(path, context)[0]
             new_output_dir = os.path.join(output_dir, new_name)
-            os.mkdir(new_output_dir)
-            self._molt_dir(path, context, new_output_dir)
+            plan.append(Operation(OP_MKDIR, path, new_output_dir, 0))
+            self._plan_dir(children, context, new_output_dir, plan)
+
+    def _check_output_dir(self, output_dir):
+        if not os.path.exists(output_dir):
+            raise (Error("Output directory missing: %s" % output_dir))
 
-    def render(self, structure_dir, context, output_dir):
+    def plan(self, structure_dir, context, output_dir, structure=None):
         """
-        Recursively render the contents of a directory to an output directory.
+        Return the list of Operation instances for rendering a directory.
+
+        Nothing is written, but file and directory names are rendered.
 
         Arguments:
 
-          output_dir: a path to an existing directory.
+          structure: see the render() docstring.
 
         """
         # Validate arguments because this is the entry point to a method
         # called by end-users.
-        # TODO: move this argument validation to the beginning of the function
-        #   actually called by end-users.
         if not os.path.exists(structure_dir):
             raise (Error("Structure directory missing: %s" % structure_dir))
-        if not os.path.exists(output_dir):
-            raise (Error("Output directory missing: %s" % output_dir))
+        if structure is None:
+            structure = scan_dir(structure_dir)
+
+        plan = []
+        self._plan_dir(structure, context, output_dir, plan)
+
+        return plan
+
+    def count_lambda_calls(self, plan, context):
+        """
+        Return an estimate of the number of lambda calls to render a plan.
+
+        The estimate counts the tags calling a lambda in each rendered
+        file and in the partials it includes.  Tags in sections are
+        counted once.
+
+        """
+        names = set(key for key, value in context.iteritems() if callable(value))
+        if not names:
+            return 0
+        partials = {}
+        def get_partial(name):
+            if name not in partials:
+                u = self.pystacher.partials.get(name)
+                partials[name] = None if u is None else parse(u)
+            return partials[name]
+        count = 0
+        for op in plan:
+            if op.kind != OP_RENDER or self._is_literal(op.source):
+                continue
+            count += count_calls(self._parse_path(op.source), names, get_partial)
+        return count
+
+    def render(self, structure_dir, context, output_dir, structure=None):
+        """
+        Recursively render the contents of a directory to an output directory.
+
+        Arguments:
+
+          output_dir: a path to an existing directory.
+
+          structure: the return value of scan_dir() for structure_dir, if
+            already available.
+
+        """
+        self._check_output_dir(output_dir)
+        plan = self.plan(structure_dir, context, output_dir, structure)
+        self.execute(plan, context)
+
+    def execute(self, plan, context):
+        """
+        Perform the operations in a plan.
+
+        All directories are created before any file is written.
+
+        """
+        ops = []
+        for op in plan:
+            if op.kind == OP_MKDIR:
+                os.mkdir(op.target)
+            else:
+                ops.append(op)
+        self._molt_files(ops, context)
+
+    def _render_entry(self, args):
+        """
+        Return the output of a file as a (path, bytes) pair for adding to a writer.
+
+        Exactly one of the pair is not None.  The path is either the
+        source path or the path of a temporary file in temp_dir.  If
+        temp_dir is None, rendered files are never streamed.
+
+        """
+        op, context, temp_dir = args
+        path = op.source
+        try:
+            if op.kind == OP_COPY or self._is_literal(path):
+                return path, None
+            if temp_dir is None:
+                u = self._render_path_to_string(path, context)
+            else:
+                temp_paths = []
+                def open_file():
+                    fd, temp_path = mkstemp(dir=temp_dir)
+                    temp_paths.append(temp_path)
+                    return os.fdopen(fd, 'wb')
+                u = self._stream_path(path, context, open_file)
+                if u is None:
+                    return temp_paths[0], None
+            return None, u.encode(defaults.OUTPUT_FILE_ENCODING, defaults.ENCODING_ERRORS)
+        except Exception, err:
+            raise Error("Error rendering: %s\n-->%s: %s" %
+                        (path, err.__class__.__name__, err))
+
+    def _render_entries_deferred(self, ops, context):
+        """
+        Return the outputs of files like _render_entry(), deferring lambda calls.
+
+        See _render_deferred().
+
+        """
+        render_ops = [op for op in ops if op.kind == OP_RENDER]
+        outputs = dict(zip(render_ops, self._render_deferred(render_ops, context)))
+        results = []
+        for op in ops:
+            u = outputs.get(op)
+            if u is None:
+                results.append((op.source, None))
+                continue
+            results.append((None, u.encode(defaults.OUTPUT_FILE_ENCODING,
+                                           defaults.ENCODING_ERRORS)))
+        return results
+
+    def _write_entries(self, entries, context, writer, temp_dir):
+        """
+        Add the given entries to a writer in order.
 
-        self._molt_dir(structure_dir, context, output_dir)
+        """
+        args = [(op, context, temp_dir) for name, op in entries if
+                op.kind != OP_MKDIR]
+        pool = None
+        if self._defers_lambdas(context):
+            ops = [op for name, op in entries if op.kind != OP_MKDIR]
+            results = iter(self._render_entries_deferred(ops, context))
+        else:
+            jobs = min(self.jobs, len(args))
+            if jobs > 1:
+                pool = ThreadPool(jobs)
+                results = pool.imap(self._render_entry, args)
+            else:
+                results = imap(self._render_entry, args)
+        try:
+            for name, op in entries:
+                if op.kind == OP_MKDIR:
+                    writer.add_dir(name)
+                    continue
+                output_path, b = next(results)
+                mode = get_file_mode(op.source)
+                if b is not None:
+                    writer.add_bytes(name, b, mode)
+                    continue
+                writer.add_file(name, output_path, mode)
+                if output_path != op.source:
+                    os.remove(output_path)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def render_to_writer(self, structure_dir, context, writer, structure=None,
+                         stream=True):
+        """
+        Recursively render the contents of a directory to a writer.
+
+        Entries are added in sorted order of their paths.  Files are
+        rendered concurrently if jobs is greater than 1, but are still
+        added in order.
+
+        Arguments:
+
+          writer: an object with add_dir(name), add_bytes(name, b, mode),
+            and add_file(name, path, mode) methods, like an ArchiveWriter
+            instance.  Names use "/" as the separator.
+
+          structure: see the render() docstring.
+
+          stream: whether to render files at or above the stream threshold
+            to temporary files rather than to strings.
+
+        """
+        plan = self.plan(structure_dir, context, u'', structure)
+
+        entries = [(op.target.replace(os.sep, '/'), op) for op in plan]
+        entries.sort()
+
+        if not stream:
+            self._write_entries(entries, context, writer, None)
+            return
+        with io.temp_directory() as temp_dir:
+            self._write_entries(entries, context, writer, temp_dir)
+
+    def render_incremental(self, structure_dir, context, output_dir, get_inputs,
+                           structure=None):
+        """
+        Render to an output directory, skipping files whose inputs are unchanged.
+
+        This method reads and updates the manifest in the output directory.
+        Output files and directories in the old manifest but no longer
+        rendered are removed.
+
+        Arguments:
+
+          get_inputs: a function that accepts an Operation instance and
+            returns a dictionary of the hashes of the file's inputs (e.g.
+            the partials and the context).
+
+          structure: see the render() docstring.
+
+        """
+        self._check_output_dir(output_dir)
+        plan = self.plan(structure_dir, context, output_dir, structure)
+
+        old_manifest = Manifest.load(output_dir)
+        manifest = Manifest()
+
+        stale_ops = []
+        for op in plan:
+            rel_path = os.path.relpath(op.target, output_dir)
+            if op.kind == OP_MKDIR:
+                manifest.dirs.append(rel_path)
+                if not os.path.isdir(op.target):
+                    os.mkdir(op.target)
+                continue
+            record = dict(get_inputs(op))
+            record.update(source=os.path.relpath(op.source, structure_dir),
+                          template=hash_file(op.source))
+            if op.kind == OP_COPY:
+                record.update(copy_mode=self.copy_mode or io.COPY_MODES[0])
+            manifest.files[rel_path] = record
+            if (old_manifest.files.get(rel_path) != record or
+                not os.path.exists(op.target)):
+                stale_ops.append(op)
+
+        for op in stale_ops:
+            if op.kind == OP_RENDER and os.path.lexists(op.target):
+                # Remove the old file in case it is a link from copying, so
+                # that rendering does not write through it.
+                os.remove(op.target)
+
+        _log.debug("rendering %d of %d files" %
+                   (len(stale_ops), len(manifest.files)))
+        self._molt_files(stale_ops, context)
+
+        for rel_path in set(old_manifest.files) - set(manifest.files):
+            path = os.path.join(output_dir, rel_path)
+            if os.path.lexists(path):
+                _log.debug("removing obsolete file: %s" % path)
+                os.remove(path)
+        # Remove children before parents.
+        for rel_path in sorted(set(old_manifest.dirs) - set(manifest.dirs), reverse=True):
+            path = os.path.join(output_dir, rel_path)
+            try:
+                os.rmdir(path)
+            except OSError:
+                # Then the directory is missing or not empty.
+                pass
+
+        manifest.save(output_dir)
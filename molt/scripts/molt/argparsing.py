@@ -41,6 +41,7 @@ import sys
 
 from molt import __version__
 from molt import defaults
+from molt.constants import ARCHIVE_EXTENSIONS, COPY_MODES, MANIFEST_FILE_NAME
 from molt.dirutil import get_default_config_files, DirectoryChooser
 from molt.scripts.molt.general.optionparser import (
     Option, ArgParser, UsageError)
@@ -51,16 +52,26 @@ _log = logging.getLogger(__name__)
 METAVAR_INPUT_DIR = 'DIRECTORY'
 
 # TODO: rename OPTION_* to FLAGS_*.
+OPTION_BATCH_CONFIGS = Option(('--batch-configs', ))
+OPTION_CACHE_DIR = Option(('--cache-dir', ))
 OPTION_CHECK_DIRS = Option(('--check-dirs', ))
 OPTION_CHECK_EXPECTED = Option(('--check-output', ))
 OPTION_CHECK_TEMPLATE = Option(('--check-template', ))
+OPTION_COPY_MODE = Option(('--copy-mode', ))
+OPTION_DRY_RUN = Option(('--dry-run', ))
 OPTION_HELP = Option(('-h', '--help'))
+OPTION_INCREMENTAL = Option(('--incremental', ))
+OPTION_JOBS = Option(('-j', '--jobs'))
+OPTION_LAMBDA_CONCURRENCY = Option(('--lambda-concurrency', ))
+OPTION_LAMBDA_STATS = Option(('--lambda-stats', ))
 OPTION_LICENSE = Option(('--license', ))
+OPTION_OUTPUT_ARCHIVE = Option(('--output-archive', ))
 OPTION_OUTPUT_DIR = Option(('-o', '--output-dir'))
 OPTION_MODE_DEMO = Option(('--create-demo', ))
 OPTION_MODE_TESTS = Option(('--run-tests', ))
 OPTION_MODE_VISUALIZE = Option(('--visualize', ))
 OPTION_SOURCE_DIR = Option(('--dev-source-dir', ))
+OPTION_STREAM_THRESHOLD = Option(('--stream-threshold', ))
 OPTION_WITH_VISUALIZE = Option(('--with-visualize', ))
 OPTION_VERBOSE = Option(('-v', '--verbose'))
 OPTION_SUCCINCT_LOGGING = Option(('-s', '--succinct', ))
@@ -144,6 +155,65 @@ repr(defaults.OUTPUT_DIR),
 the path to the configuration file containing the rendering context to use.
 Defaults to looking in the template directory in order for one of: %s""" %
 ', '.join(get_default_config_files()),
+    OPTION_BATCH_CONFIGS: """\
+render the template once for each configuration file in a directory or
+matching a glob pattern (e.g. "configs/*.json"), in a single process.  Each
+configuration file is rendered to a subdirectory of the output directory
+named after the file without its extension.  With this option, %s
+sets the number of configuration files to render concurrently.""" %
+OPTION_JOBS.display('/'),
+    OPTION_CACHE_DIR: """\
+a directory in which to cache parsed templates, configs, and lambda
+results across runs.  Repeat renders of the same templates then skip
+parsing unchanged files and rerunning lambda scripts with the same input.
+The least recently used entries are removed once the directory holds more
+than %s parsed templates, %s configs, or %s lambda results.  By default,
+nothing is persisted.""" %
+(defaults.TEMPLATE_CACHE_SIZE, defaults.CONFIG_CACHE_SIZE,
+ defaults.LAMBDA_CACHE_SIZE),
+    OPTION_COPY_MODE: """\
+how to copy non-template files from the structure directory to the output
+directory: one of %s.  "copy" copies within the kernel on Linux (with
+copy_file_range() or sendfile()).  "reflink" makes copy-on-write clones on
+filesystems that support them (e.g. Btrfs and XFS).  "hardlink" and
+"symlink" link to the template files instead of copying them, so edits to
+the output files change the template.  Modes fall back to copying where
+not supported.  Defaults to %s.  Not allowed with %s, which adds files to
+the archive.""" % (', '.join(COPY_MODES), repr(COPY_MODES[0]),
+                   OPTION_OUTPUT_ARCHIVE.display('/')),
+    OPTION_DRY_RUN: """\
+instead of rendering, print the operations that rendering would perform
+(creating directories, copying files, and rendering templates), followed by
+totals for the number of files, the bytes read, and an estimate of the
+number of lambda calls.  Nothing is written.""",
+    OPTION_INCREMENTAL: """\
+render into the output directory even if it already exists, and render only
+the files whose inputs changed since the last incremental render to that
+directory.  Output files that are no longer rendered are removed.  The
+inputs are recorded in a manifest file named %s in the output
+directory.""" % repr(MANIFEST_FILE_NAME),
+    OPTION_JOBS: """\
+the number of files to render concurrently.  Output is the same as when
+rendering one file at a time.  Defaults to %s.""" % defaults.RENDER_JOBS,
+    OPTION_LAMBDA_CONCURRENCY: """\
+run up to N lambda script calls at once.  Lambda calls are then collected
+across all template files and run concurrently before any rendered file is
+written, which helps when scripts spend their time waiting (e.g. on the
+network).  By default, each call runs as its template is rendered.""",
+    OPTION_LAMBDA_STATS: """\
+write the stats of each lambda to FILE as JSON: the number of calls, the
+total and maximum wall time in seconds, and the bytes in and out.  The
+stats are also logged with %s.""" % OPTION_VERBOSE.display('/'),
+    OPTION_OUTPUT_ARCHIVE: """\
+render the template directly into an archive file instead of an output
+directory.  The archive format is chosen by the file name extension: one of
+%s.  Entries are sorted and have fixed timestamps, so identical inputs give
+byte-identical archives.""" % ', '.join(ARCHIVE_EXTENSIONS),
+    OPTION_STREAM_THRESHOLD: """\
+the rendered size in characters at or above which to write each rendered
+file as it renders, instead of first rendering the whole file in memory.
+Output is held in memory only until it reaches this size, including the
+output of sections over long lists.  Pass 0 to stream all files.  Defaults to %s.""" % defaults.STREAM_THRESHOLD,
     OPTION_WITH_VISUALIZE: """\
 run the %s option on the output directory prior to printing the usual output
 to stdout.  Useful for quickly visualizing script output.  Also works with
@@ -208,39 +278,28 @@ def get_license_string():
     return s
 
 
-def preparse_args(sys_argv):
-    """
-    Parse command arguments without raising an exception (or exiting).
-
-    This function allows one to have access to the command-line options
-    before configuring logging (in particular before exception logging).
-
-    Returns a Namespace object.
-
-    """
-    try:
-        # Suppress the help option to prevent exiting.
-        ns = parse_args(sys_argv, None, suppress_help_exit=True)
-    except UsageError:
-        # Any usage error will occur again during the real parse.
-        return None
-    return ns
-
-
 def parse_args(sys_argv, chooser=None, suppress_help_exit=False, usage=None):
     """
     Parse arguments and return a Namespace object.
 
     Raises UsageError on command-line usage error.
 
+    Arguments:
+
+      suppress_help_exit: whether to return normally when the help option
+        is passed rather than print help and exit.
+
     """
-    parser = _create_parser(chooser, suppress_help_exit=suppress_help_exit,
-                            usage=usage)
+    parser = _create_parser(chooser, usage=usage)
     namespace = Namespace()  # use our decorator.
-    return parser.parse_args(sys_argv[1:], namespace=namespace)
+    ns = parser.parse_args(sys_argv[1:], namespace=namespace)
+    if ns.help and not suppress_help_exit:
+        parser.print_help()
+        parser.exit()
+    return ns
 
 
-def _create_parser(chooser, suppress_help_exit=False, usage=None):
+def _create_parser(chooser, usage=None):
     """
     Return an ArgParser for the program.
 
@@ -269,8 +328,30 @@ def _create_parser(chooser, suppress_help_exit=False, usage=None):
     add_arg('input_directory', metavar=METAVAR_INPUT_DIR, nargs='?')
     add_arg(OPTION_OUTPUT_DIR, metavar='OUTPUT_DIR', dest='output_directory',
             action='store')
+    # Keep the "--output" abbreviation working now that it also prefixes
+    # --output-archive.  The README uses it.
+    add_arg('--output', dest='output_directory', action='store',
+            help=argparse.SUPPRESS)
     add_arg(('-c', '--config-file'), metavar='FILE', dest='config_path',
             action='store')
+    add_arg(OPTION_JOBS, metavar='N', dest='jobs', action='store', type=int,
+            default=defaults.RENDER_JOBS)
+    add_arg(OPTION_LAMBDA_CONCURRENCY, metavar='N', dest='lambda_concurrency',
+            action='store', type=int)
+    add_arg(OPTION_LAMBDA_STATS, metavar='FILE', dest='lambda_stats_path',
+            action='store')
+    add_arg(OPTION_BATCH_CONFIGS, metavar='DIR_OR_GLOB', dest='batch_configs',
+            action='store')
+    add_arg(OPTION_CACHE_DIR, metavar='DIRECTORY', dest='cache_dir',
+            action='store')
+    add_arg(OPTION_INCREMENTAL, dest='incremental', action='store_true')
+    add_arg(OPTION_DRY_RUN, dest='dry_run', action='store_true')
+    add_arg(OPTION_OUTPUT_ARCHIVE, metavar='ARCHIVE', dest='output_archive',
+            action='store')
+    add_arg(OPTION_COPY_MODE, metavar='MODE', dest='copy_mode', action='store',
+            choices=COPY_MODES)
+    add_arg(OPTION_STREAM_THRESHOLD, metavar='SIZE', dest='stream_threshold',
+            action='store', type=int)
     add_arg(OPTION_WITH_VISUALIZE, dest='with_visualize', action='store_true')
     add_arg(OPTION_CHECK_TEMPLATE, dest='mode_check_template',
             action='store_true'),
@@ -299,9 +380,9 @@ def _create_parser(chooser, suppress_help_exit=False, usage=None):
             help='log verbosely.')
     add_arg(OPTION_SUCCINCT_LOGGING, dest='succinct_logging',
             action='store_true', help='suppress diagnostic logging.')
-    # We add help manually for more control.
-    help_action = "store_true" if suppress_help_exit else "help"
-    add_arg(OPTION_HELP, action=help_action,
+    # We add help manually for more control.  We print help after parsing
+    # rather than with argparse's "help" action so that parsing never exits.
+    add_arg(OPTION_HELP, dest='help', action='store_true',
             help='show this help message and exit.')
 
     return parser
@@ -34,6 +34,7 @@ Provides the main sys.argv processing code, but without the try-catch.
 
 import codecs
 from datetime import datetime
+import glob
 import logging
 import os
 import shutil
@@ -45,17 +46,16 @@ import molt
 from molt.general.error import Error
 from molt import constants
 from molt import defaults
-import molt.diff as diff
 import molt.dirutil as dirutil
 # TODO: eliminate these from ... imports.
 from molt.dirutil import stage_template_dir, DirectoryChooser
-from molt.molter import Molter
-from molt.projectmap import Locator
 from molt.scripts.molt import argparsing
 import molt.scripts.molt.general.optionparser as optionparser
-from molt.test.harness import test_logger as tlog
-from molt.test.harness.main import run_molt_tests
-from molt import visualizer
+
+# To keep startup fast, modules needed only by some modes (e.g. the
+# renderer, which imports pystache, the archive writer, which imports
+# tarfile and zipfile, and the test harness) are imported in the
+# functions that use them.
 
 METAVAR_INPUT_DIR = argparsing.METAVAR_INPUT_DIR
 
@@ -64,7 +64,13 @@ _log = logging.getLogger(__name__)
 ENCODING_DEFAULT = 'utf-8'
 
 
+def _make_molter(**kwargs):
+    from molt.molter import Molter
+    return Molter(**kwargs)
+
+
 def visualize(dir_path):
+    from molt import visualizer
     visualizer.visualize(dir_path)
 
 
@@ -91,6 +97,9 @@ def run_mode_tests(ns, test_names, test_runner_stream, from_source):
     Run project tests, and return the exit status to exit with.
 
     """
+    from molt.test.harness import test_logger as tlog
+    from molt.test.harness.main import run_molt_tests
+
     # Suppress the display of standard out while tests are running.
     tlog.info("running tests: suppressing stdout; from_source: %s" % from_source)
     stdout = sys.stdout
@@ -121,6 +130,8 @@ def _make_output_directory(ns, default_output_dir):
 
 
 def run_mode_create_demo(ns):
+    from molt.projectmap import Locator
+
     # TODO: inject the locator instance instead of constructing it here.
     locator = Locator()
     demo_template_dir = locator.demo_template_dir
@@ -139,14 +150,48 @@ def run_mode_create_demo(ns):
     return output_dir
 
 
+def _make_render_output_directory(ns):
+    if not ns.incremental:
+        return _make_output_directory(ns, defaults.OUTPUT_DIR)
+    # Otherwise, render into the given directory even if it exists.
+    output_dir = ns.output_directory
+    if output_dir is None:
+        output_dir = defaults.OUTPUT_DIR
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    return output_dir
+
+
+def _get_batch_configs(pattern):
+    """
+    Return the sorted config file paths for the --batch-configs option.
+
+    """
+    if os.path.isdir(pattern):
+        extensions = defaults.CONFIG_FILE_EXTENSIONS
+        paths = [os.path.join(pattern, name) for name in os.listdir(pattern) if
+                 os.path.splitext(name)[1] in extensions]
+    else:
+        paths = glob.glob(pattern)
+    if not paths:
+        raise Error("No config files found at: %s" % pattern)
+    return sorted(paths)
+
+
 def run_mode_render(ns, chooser):
     """Returns the output directory."""
     template_dir = _get_input_dir(ns, 'when rendering a template')
     config_path = ns.config_path
-    output_dir = _make_output_directory(ns, defaults.OUTPUT_DIR)
+    output_dir = _make_render_output_directory(ns)
 
     renderer = TemplateRenderer(chooser=chooser, template_dir=template_dir,
-                                output_dir=output_dir, config_path=config_path)
+                                output_dir=output_dir, config_path=config_path,
+                                jobs=ns.jobs, cache_dir=ns.cache_dir,
+                                incremental=ns.incremental,
+                                stream_threshold=ns.stream_threshold,
+                                copy_mode=ns.copy_mode,
+                                lambda_concurrency=ns.lambda_concurrency,
+                                lambda_stats_path=ns.lambda_stats_path)
     renderer.render()
 
     if ns.with_visualize:
@@ -155,6 +200,108 @@ def run_mode_render(ns, chooser):
     return output_dir
 
 
+def _format_plan(plan, summary):
+    """
+    Return the text describing a render plan for the --dry-run option.
+
+    """
+    from molt.molter import OP_MKDIR
+
+    lines = []
+    for op in plan:
+        if op.kind == OP_MKDIR:
+            lines.append("%-7s %s" % (op.kind, op.target))
+            continue
+        lines.append("%-7s %s -> %s (%d bytes)" % (op.kind, op.source, op.target,
+                                                   op.size))
+    lines.append("Total: %(dirs)d directories, %(files)d files (%(rendered)d "
+                 "rendered, %(copied)d copied), %(bytes)d bytes, "
+                 "~%(lambda_calls)d lambda calls" % summary)
+    return "\n".join(lines)
+
+
+def run_mode_dry_run(ns, chooser):
+    """
+    Return a description of what rendering a template would do.
+
+    """
+    template_dir = _get_input_dir(ns, argparsing.OPTION_DRY_RUN)
+    output_dir = ns.output_directory
+    if output_dir is None:
+        output_dir = defaults.OUTPUT_DIR
+
+    molter = _make_molter(chooser=chooser)
+    plan, summary = molter.plan(template_dir, output_dir, config_path=ns.config_path)
+
+    return _format_plan(plan, summary)
+
+
+def run_mode_archive(ns, chooser):
+    """
+    Render a template into an archive, and return the archive path.
+
+    """
+    from molt.general.archive import get_archive_extension
+    template_dir = _get_input_dir(ns, argparsing.OPTION_OUTPUT_ARCHIVE)
+    archive_path = ns.output_archive
+    if get_archive_extension(archive_path) is None:
+        msg = ("Unsupported archive extension: %s\n"
+               " The archive must end in one of: %s." %
+               (archive_path, ', '.join(constants.ARCHIVE_EXTENSIONS)))
+        raise optionparser.UsageError(msg)
+    if ns.incremental:
+        msg = ("%s cannot be used with %s." %
+               (argparsing.OPTION_INCREMENTAL.display('/'),
+                argparsing.OPTION_OUTPUT_ARCHIVE.display('/')))
+        raise optionparser.UsageError(msg)
+    if ns.copy_mode is not None:
+        # Files are added to the archive rather than copied.
+        msg = ("%s cannot be used with %s." %
+               (argparsing.OPTION_COPY_MODE.display('/'),
+                argparsing.OPTION_OUTPUT_ARCHIVE.display('/')))
+        raise optionparser.UsageError(msg)
+
+    molter = _make_molter(chooser=chooser, jobs=ns.jobs, cache_dir=ns.cache_dir,
+                          stream_threshold=ns.stream_threshold,
+                          lambda_concurrency=ns.lambda_concurrency,
+                          lambda_stats_path=ns.lambda_stats_path)
+    molter.molt_archive(template_dir, archive_path, config_path=ns.config_path)
+
+    return archive_path
+
+
+def run_mode_batch(ns, chooser):
+    """
+    Render a template for each config in a batch, and return the output directory.
+
+    """
+    template_dir = _get_input_dir(ns, argparsing.OPTION_BATCH_CONFIGS)
+    config_paths = _get_batch_configs(ns.batch_configs)
+    output_dir = _make_render_output_directory(ns)
+
+    configs = []
+    for config_path in config_paths:
+        name = os.path.splitext(os.path.basename(config_path))[0]
+        config_output_dir = os.path.join(output_dir, name)
+        if config_output_dir in (pair[1] for pair in configs):
+            raise Error("Config files have the same name: %s" % name)
+        if not os.path.exists(config_output_dir):
+            os.mkdir(config_output_dir)
+        configs.append((config_path, config_output_dir))
+
+    molter = _make_molter(chooser=chooser, cache_dir=ns.cache_dir,
+                          stream_threshold=ns.stream_threshold, copy_mode=ns.copy_mode,
+                          lambda_concurrency=ns.lambda_concurrency,
+                          lambda_stats_path=ns.lambda_stats_path)
+    molter.molt_many(template_dir, configs, jobs=ns.jobs,
+                     incremental=ns.incremental)
+
+    if ns.with_visualize:
+        visualize(output_dir)
+
+    return output_dir
+
+
 def run_mode_visualize(ns):
     target_dir = _get_input_dir(ns, argparsing.OPTION_MODE_VISUALIZE)
     visualize(target_dir)
@@ -166,6 +313,19 @@ def run_mode_visualize(ns):
 # In other words, to check an output directory, it shouldn't be
 # necessary to have to render each time.  As a side benefit, this
 # resolves the stdout/stderr question for this case.
+def compare_dirs(actual_dir, expected_dir, jobs=None):
+    """Return whether the actual directory matches the expected."""
+    import molt.diff as diff
+    comparer = diff.Comparer(jobs=jobs)
+    return comparer.compare_dirs((actual_dir, expected_dir))
+
+
+def run_mode_check_dirs(ns):
+    """Return whether the two directories passed to --check-dirs match."""
+    expected_dir, actual_dir = ns.check_dir
+    return compare_dirs(actual_dir, expected_dir, jobs=ns.jobs)
+
+
 def check_output(output_dir, expected_dir):
     """Return whether the output directory matches the expected."""
     print("output: %s\nexpected: %s" % (output_dir, expected_dir))
@@ -176,7 +336,7 @@ def check_output(output_dir, expected_dir):
 # TODO: rename this to process() or process_args().
 # TODO: incorporate this method into the ArgProcessor class.
 def run_args(sys_argv, writer, chooser=None, test_runner_stream=None,
-             from_source=False, stdout=None):
+             from_source=False, stdout=None, ns=None):
     exit_status = constants.EXIT_STATUS_SUCCESS  # return value
     if chooser is None:
         chooser = DirectoryChooser()
@@ -185,7 +345,8 @@ def run_args(sys_argv, writer, chooser=None, test_runner_stream=None,
     if stdout is None:
         stdout = sys.stdout
 
-    ns = argparsing.parse_args(sys_argv, chooser)
+    if ns is None:
+        ns = argparsing.parse_args(sys_argv, chooser)
 
     if ns.run_test_mode:
         # Run all tests if no test names provided.
@@ -208,13 +369,22 @@ def run_args(sys_argv, writer, chooser=None, test_runner_stream=None,
             exit_status = constants.EXIT_STATUS_FAIL
     elif ns.create_demo_mode:
         output = run_mode_create_demo(ns)
-    # TODO: add a check-dirs mode.
+    elif ns.check_dir is not None:
+        output = None
+        if not run_mode_check_dirs(ns):
+            exit_status = constants.EXIT_STATUS_FAIL
     elif ns.visualize_mode:
         output = run_mode_visualize(ns)
     elif ns.version_mode:
         output = argparsing.get_version_string()
     elif ns.license_mode:
         output = argparsing.get_license_string()
+    elif ns.dry_run:
+        output = run_mode_dry_run(ns, chooser)
+    elif ns.batch_configs is not None:
+        output = run_mode_batch(ns, chooser)
+    elif ns.output_archive is not None:
+        output = run_mode_archive(ns, chooser)
     else:
         output = run_mode_render(ns, chooser)
 
@@ -244,7 +414,9 @@ class ArgProcessor(object):
             checker = TemplateChecker(chooser=self.chooser,
                                       template_dir=template_dir,
                                       output_dir=output_dir,
-                                      writer=self.writer)
+                                      writer=self.writer,
+                                      jobs=ns.jobs,
+                                      cache_dir=ns.cache_dir)
             return checker.check
         return None
 
@@ -252,24 +424,43 @@ class ArgProcessor(object):
 # This class should not depend on the Namespace returned by parse_args().
 class TemplateRenderer(object):
 
-    def __init__(self, chooser, template_dir, output_dir, config_path=None):
+    def __init__(self, chooser, template_dir, output_dir, config_path=None,
+                 jobs=None, cache_dir=None, incremental=False,
+                 stream_threshold=None, copy_mode=None, lambda_concurrency=None,
+                 lambda_stats_path=None):
+        self.cache_dir = cache_dir
         self.chooser = chooser
+        self.copy_mode = copy_mode
         self.config_path = config_path
+        self.incremental = incremental
+        self.jobs = jobs
+        self.lambda_concurrency = lambda_concurrency
+        self.lambda_stats_path = lambda_stats_path
+        self.stream_threshold = stream_threshold
         self.output_dir = output_dir
         self.template_dir = template_dir
 
     def render(self):
-        molter = Molter(chooser=self.chooser)
+        molter = _make_molter(chooser=self.chooser, jobs=self.jobs,
+                              cache_dir=self.cache_dir,
+                              stream_threshold=self.stream_threshold,
+                              copy_mode=self.copy_mode,
+                              lambda_concurrency=self.lambda_concurrency,
+                              lambda_stats_path=self.lambda_stats_path)
         molter.molt(template_dir=self.template_dir,
                     output_dir=self.output_dir,
-                    config_path=self.config_path)
+                    config_path=self.config_path,
+                    incremental=self.incremental)
 
 
 # This class should not depend on the Namespace returned by parse_args().
 class TemplateChecker(object):
 
-    def __init__(self, chooser, template_dir, output_dir, writer):
+    def __init__(self, chooser, template_dir, output_dir, writer, jobs=None,
+                 cache_dir=None):
+        self.cache_dir = cache_dir
         self.chooser = chooser
+        self.jobs = jobs
         self.output_dir = output_dir
         self.template_dir = template_dir
         self.writer = writer
@@ -282,15 +473,15 @@ class TemplateChecker(object):
     # A helper would be useful for the --compare-dirs option that has
     # not yet been implemented.
     def _compare(self, actual_dir, expected_dir):
-        comparer = diff.Comparer()
-        return comparer.compare_dirs((actual_dir, expected_dir))
+        return compare_dirs(actual_dir, expected_dir, jobs=self.jobs)
 
     def _check(self, output_dir):
         """Render and return whether the directories match."""
         chooser = self.chooser
         template_dir = self.template_dir
         renderer = TemplateRenderer(chooser=chooser, template_dir=template_dir,
-                                    output_dir=output_dir)
+                                    output_dir=output_dir, jobs=self.jobs,
+                                    cache_dir=self.cache_dir)
         renderer.render()
         expected_dir = chooser.get_expected_dir(template_dir)
         does_match = self._compare(output_dir, expected_dir)
@@ -51,7 +51,7 @@ from molt.scripts.molt import argparsing
 from molt.scripts.molt.argparsing import OPTION_HELP
 import molt.scripts.molt.general.logconfig as logconfig
 from molt.scripts.molt.general.optionparser import UsageError
-from molt.test.harness import test_logger
+import molt.test
 
 
 LOGGING_LEVEL_DEFAULT = logging.INFO
@@ -83,10 +83,15 @@ def _configure_output_logger(stream):
     return log
 
 
-def _configure_logging(sys_argv, sys_stderr=None):
+def _configure_logging(ns, sys_stderr=None):
     """
     Configure logging and return whether to run in verbose mode.
 
+    Arguments:
+
+      ns: the Namespace of parsed arguments, or None if the arguments
+        did not parse.
+
     """
     if sys_stderr is None:
         sys_stderr = sys.stderr
@@ -99,9 +104,6 @@ def _configure_logging(sys_argv, sys_stderr=None):
     # TODO: follow all of the recommendations here:
     # http://www.artima.com/weblogs/viewpost.jsp?thread=4829
 
-    # Configure logging before parsing arguments for real.
-    ns = argparsing.preparse_args(sys_argv)
-
     if ns is not None:
         # Then args parsed without error.
         verbose = ns.verbose
@@ -123,7 +125,9 @@ def _configure_logging(sys_argv, sys_stderr=None):
     # Set the loggers to display during test runs.
     if is_running_tests:
         # TODO: tighten the list of names to allow.
-        names = [logconfig.__name__, _app_log.name, test_logger.name]
+        # We use the name of the test logger rather than importing the
+        # test harness, which is slow to import.
+        names = [logconfig.__name__, _app_log.name, molt.test.__name__]
     elif succinct_logging:
         # Let the error-catching logger log.
         # TODO: add a test for this.
@@ -168,25 +172,36 @@ def run_molt(sys_argv, from_source=False, configure_logging=_configure_logging,
         opposed to via an installed setup entry point).
 
       process_args: the function called within this method's try-except
-        block and that accepts sys.argv as a single parameter.
+        block and that accepts sys.argv as a single parameter, and the
+        parsed arguments as the keyword argument ns.
         This parameter is exposed only for unit testing purposes.  It
         allows the function's exception handling logic to be tested
         more easily.
 
     """
-    verbose, log_stream, writer = configure_logging(sys_argv)
+    # We parse the arguments only once, before configuring logging, so
+    # that the logging options take effect.  A usage error is raised only
+    # after logging is configured, so that it gets logged like any other.
+    try:
+        ns, usage_error = argparsing.parse_args(sys_argv), None
+    except UsageError, usage_error:
+        ns = None
+
+    verbose, log_stream, writer = configure_logging(ns)
 
     _app_log.debug("sys.argv: %s" % repr(sys_argv))
     _app_log.debug("kwargs: %s" % repr(kwargs))
 
     try:
+        if usage_error is not None:
+            raise usage_error
         if process_args is None:
             # See this module's docstring for an explanation of why
             # we do this import inside a function body.
             # TODO: we should not need to do this import here?
             from molt.scripts.molt.argprocessor import run_args
             process_args = run_args
-        status = process_args(sys_argv, writer=writer,
+        status = process_args(sys_argv, ns=ns, writer=writer,
                               test_runner_stream=log_stream,
                               from_source=from_source)
     # TODO: include KeyboardInterrupt in the template version of this file.
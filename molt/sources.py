@@ -0,0 +1,202 @@
+# encoding: utf-8
+#
+# Copyright (C) 2012 Chris Jerdonek. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * The names of the copyright holders may not be used to endorse or promote
+#   products derived from this software without specific prior written
+#   permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Exposes functions to load context values lazily from data files.
+
+A context value in a config file can refer to a data file instead of
+holding the data itself, using a dictionary with a single key:
+
+    "context": {
+        "endpoints": {"molt_source": "data/endpoints.jsonl"}
+    }
+
+The path is relative to the directory containing the config file.  The
+file format is chosen by the file name extension:
+
+  .jsonl: JSON Lines, one JSON value per line.  Blank lines are skipped.
+
+  .csv: comma-separated values with a header row.  Each row is a
+    dictionary mapping the header names to the row's values.
+
+The value behaves as a list in Mustache sections, but reads the file one
+record at a time each time the section is rendered, so the records are
+never all in memory at once.  Only the parsing is lazy: the section's
+rendered output is held in memory like any other until it reaches the
+stream threshold, after which it is written to the file as it renders
+(see the Molter stream_threshold argument).  Output that is not
+streamed, e.g. output rendered with deferred lambda calls, is held in
+memory in full.
+
+"""
+
+from __future__ import absolute_import
+
+import csv
+import json
+import logging
+import os
+
+from molt.general.error import Error
+from molt.manifest import hash_file
+
+
+_log = logging.getLogger(__name__)
+
+SOURCE_KEY = 'molt_source'
+
+
+def read_json_lines(f, path, encoding):
+    """
+    Yield the values in a JSON Lines file, skipping blank lines.
+
+    Arguments:
+
+      f: the file, opened in binary mode.
+
+      path: the path to the file, for error messages.
+
+    """
+    for line_number, line in enumerate(f, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line.decode(encoding))
+        except ValueError, err:
+            raise Error("Invalid JSON at line %d of: %s\n-->%s" %
+                        (line_number, path, err))
+
+
+def read_csv(f, path, encoding):
+    """
+    Yield the rows of a CSV file as dictionaries keyed by the header row.
+
+    Arguments:
+
+      f: the file, opened in binary mode.
+
+      path: the path to the file, for error messages.
+
+    """
+    # Python 2's csv module reads bytes, so we decode each value.
+    reader = csv.reader(f)
+    try:
+        names = next(reader)
+    except StopIteration:
+        return
+    names = [name.decode(encoding) for name in names]
+    for row in reader:
+        yield dict(zip(names, (value.decode(encoding) for value in row)))
+
+
+# The function to read the records of a data file, by file extension.
+SOURCE_TYPES = {
+    '.csv': read_csv,
+    '.jsonl': read_json_lines,
+}
+
+
+class FileSource(object):
+
+    """
+    An iterable over the records of a data file.
+
+    """
+
+    def __init__(self, path, encoding, read_records):
+        """
+        Arguments:
+
+          read_records: a function that accepts a file opened in binary
+            mode, the path and the encoding, and yields the records in
+            the file, e.g. a value of SOURCE_TYPES.
+
+        """
+        self._hash = None
+        self.encoding = encoding
+        self.path = path
+        self.read_records = read_records
+
+    def __iter__(self):
+        with open(self.path, 'rb') as f:
+            for record in self.read_records(f, self.path, self.encoding):
+                yield record
+
+    def __nonzero__(self):
+        # Pystache checks whether a section value is empty before iterating.
+        for record in self:
+            return True
+        return False
+
+    def __repr__(self):
+        # Manifest hashes context values by their repr(), so we include
+        # the file contents in the repr() for incremental rendering.
+        # The file extension determines the reader, so the path suffices
+        # to identify the format.
+        if self._hash is None:
+            self._hash = hash_file(self.path)
+        return "%s(%r, sha1=%s)" % (self.__class__.__name__, self.path, self._hash)
+
+
+def _make_source(info, base_dir, encoding):
+    path = os.path.join(base_dir, info[SOURCE_KEY])
+    ext = os.path.splitext(path)[1]
+    read_records = SOURCE_TYPES.get(ext)
+    if read_records is None:
+        raise Error("Unsupported data source extension %r (expected one of: %s): %s" %
+                    (ext, ', '.join(sorted(SOURCE_TYPES)), path))
+    if not os.path.isfile(path):
+        raise Error("Data source not found: %s" % path)
+    _log.debug("using data source: %s" % path)
+    return FileSource(path, encoding, read_records)
+
+
+def load_sources(data, base_dir, encoding):
+    """
+    Return the data with each data source reference replaced by a source.
+
+    The data is modified in place, except at the top level if it is itself
+    a reference.
+
+    Arguments:
+
+      base_dir: the directory relative to which to resolve source paths.
+
+      encoding: the encoding of the data files.
+
+    """
+    if isinstance(data, dict):
+        if len(data) == 1 and SOURCE_KEY in data:
+            return _make_source(data, base_dir, encoding)
+        for key, value in data.iteritems():
+            data[key] = load_sources(value, base_dir, encoding)
+    elif isinstance(data, list):
+        for index, value in enumerate(data):
+            data[index] = load_sources(value, base_dir, encoding)
+    return data
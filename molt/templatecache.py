@@ -0,0 +1,182 @@
+# encoding: utf-8
+#
+# Copyright (C) 2012 Chris Jerdonek. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * The names of the copyright holders may not be used to endorse or promote
+#   products derived from this software without specific prior written
+#   permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Exposes a TemplateCache class to avoid re-parsing Mustache templates.
+
+"""
+
+from __future__ import absolute_import
+
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+from threading import Lock
+
+import pystache
+from pystache.parser import parse
+
+from molt import defaults
+from molt.general.cache import DiskCache
+from molt.general.error import reraise
+
+
+_log = logging.getLogger(__name__)
+
+# The subdirectory of the cache directory in which to store parsed templates.
+CACHE_SUBDIR_NAME = 'templates'
+
+
+def _make_key(b, encoding):
+    """
+    Return the cache key for the template with the given bytes.
+
+    The key includes the Pystache version because the parse tree is
+    made of Pystache-internal objects.
+
+    """
+    digest = hashlib.sha1()
+    key = u"pystache-%s\0%s\0" % (pystache.__version__, encoding)
+    # Hashing needs bytes under Python 3.
+    digest.update(key.encode('utf-8'))
+    digest.update(b)
+    return digest.hexdigest()
+
+
+class TemplateCache(object):
+
+    """
+    Caches parsed templates in memory and optionally on disk.
+
+    Templates are keyed by a hash of their contents, so a cache directory
+    can be shared across templates and across runs.  The least recently
+    used templates are evicted first.
+
+    """
+
+    def __init__(self, cache_dir=None, max_entries=None):
+        """
+        Arguments:
+
+          cache_dir: the directory in which to persist parsed templates,
+            in a subdirectory.  If None, parsed templates are cached only
+            in memory.
+
+          max_entries: the maximum number of parsed templates to keep in
+            memory and on disk.  Defaults to the package default.
+
+        """
+        if max_entries is None:
+            max_entries = defaults.TEMPLATE_CACHE_SIZE
+
+        disk_cache = (None if cache_dir is None else
+                      DiskCache(os.path.join(cache_dir, CACHE_SUBDIR_NAME),
+                                max_entries=max_entries))
+
+        self._disk_cache = disk_cache
+        self._lock = Lock()
+        self._parse_lock = Lock()
+        self._parsed = OrderedDict()
+        self.max_entries = max_entries
+
+        self.disk_hits = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _get(self, key):
+        """
+        Return the parsed template for a key from memory, or None.
+
+        """
+        with self._lock:
+            parsed = self._parsed.pop(key, None)
+            if parsed is not None:
+                # Mark the template as recently used.
+                self._parsed[key] = parsed
+                self.hits += 1
+        return parsed
+
+    def _remember(self, key, parsed):
+        with self._lock:
+            self._parsed.pop(key, None)
+            self._parsed[key] = parsed
+            while len(self._parsed) > self.max_entries:
+                self._parsed.popitem(last=False)
+
+    def parse_path(self, path, encoding, errors):
+        """
+        Return the template at the given path as a ParsedTemplate instance.
+
+        """
+        with open(path, 'rb') as f:
+            b = f.read()
+        key = _make_key(b, encoding)
+
+        parsed = self._get(key)
+        if parsed is not None:
+            return parsed
+
+        # Parsing holds the GIL anyway, so we parse one template at a time.
+        # This way, threads that miss on the same template parse it once.
+        with self._parse_lock:
+            return self._load(key, b, path, encoding, errors)
+
+    def _load(self, key, b, path, encoding, errors):
+        parsed = self._get(key)
+        if parsed is not None:
+            return parsed
+
+        disk_cache = self._disk_cache
+        if disk_cache is not None:
+            parsed = disk_cache.get(key)
+            if parsed is not None:
+                self._count('hits')
+                self._count('disk_hits')
+                self._remember(key, parsed)
+                return parsed
+
+        self._count('misses')
+        try:
+            u = b.decode(encoding, errors)
+        except UnicodeDecodeError:
+            reraise("path: %s" % path)
+        parsed = parse(u)
+        if disk_cache is not None:
+            disk_cache.set(key, parsed)
+        self._remember(key, parsed)
+        return parsed
+
+    def log_stats(self):
+        _log.debug("template cache: %d hits (%d from disk), %d misses" %
+                   (self.hits, self.disk_hits, self.misses))
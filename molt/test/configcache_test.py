@@ -0,0 +1,99 @@
+# encoding: utf-8
+#
+# Copyright (C) 2012 Chris Jerdonek. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * The names of the copyright holders may not be used to endorse or promote
+#   products derived from this software without specific prior written
+#   permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Unit tests for configcache.py.
+
+"""
+
+from __future__ import absolute_import
+
+import os
+import unittest
+
+from molt.configcache import ConfigCache
+from molt.test.harness import config_load_tests, SandBoxDirMixin
+
+
+# Trigger the load_tests protocol.
+load_tests = config_load_tests
+
+
+class ConfigCacheTestCase(unittest.TestCase, SandBoxDirMixin):
+
+    def _write_config(self, temp_dir, text, name='config.json'):
+        path = os.path.join(temp_dir, name)
+        with open(path, 'wb') as f:
+            f.write(text.encode('utf-8'))
+        return path
+
+    def _load(self, cache, path):
+        return cache.load(path, 'utf-8', 'strict')
+
+    def test_load(self):
+        with self.sandboxDir() as temp_dir:
+            path = self._write_config(temp_dir, u'{"context": {"name": "\xe9"}}')
+            cache = ConfigCache()
+            data = self._load(cache, path)
+            # Check that callers get a copy they can modify.
+            data['context']['name'] = 'changed'
+            self.assertEqual(self._load(cache, path), {'context': {'name': u'\xe9'}})
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_load__changed(self):
+        with self.sandboxDir() as temp_dir:
+            cache = ConfigCache()
+            path = self._write_config(temp_dir, u'{"a": 1}')
+            self._load(cache, path)
+            path = self._write_config(temp_dir, u'{"a": 22}')
+            self.assertEqual(self._load(cache, path), {'a': 22})
+            self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+    def test_load__cache_dir(self):
+        with self.sandboxDir() as temp_dir:
+            cache_dir = os.path.join(temp_dir, 'cache')
+            path = self._write_config(temp_dir, u'context:\n  items: [1, 2]\n',
+                                      name='config.yaml')
+            self._load(ConfigCache(cache_dir=cache_dir), path)
+            cache = ConfigCache(cache_dir=cache_dir)
+            self.assertEqual(self._load(cache, path), {'context': {'items': [1, 2]}})
+            self.assertEqual((cache.disk_hits, cache.misses), (1, 0))
+
+    def test_load__not_marshallable(self):
+        """
+        Check a YAML config with a date, which marshal does not support.
+
+        """
+        with self.sandboxDir() as temp_dir:
+            path = self._write_config(temp_dir, u'date: 2012-01-01\n',
+                                      name='config.yaml')
+            cache = ConfigCache()
+            self.assertEqual(str(self._load(cache, path)['date']), '2012-01-01')
+            self.assertEqual(str(self._load(cache, path)['date']), '2012-01-01')
+            self.assertEqual((cache.hits, cache.misses), (0, 2))
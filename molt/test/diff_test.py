@@ -95,6 +95,55 @@ class AreFuzzyEqualTestCase(unittest.TestCase):
         self._assert_not_match(u"", u"a...b")
 
 
+class LineComparerTestCase(unittest.TestCase):
+
+    def _comparer(self):
+        return diff._LineComparer(fuzz="...")
+
+    def _compare(self, actual, expected):
+        seqs = tuple(u.splitlines(True) for u in (actual, expected))
+        info = self._comparer().compare_seqs(seqs)
+        if info is None:
+            return None
+        return info.line_index, info.char_indices
+
+    def test_compile_seq(self):
+        comparer = self._comparer()
+        runs = comparer.compile_seq(["a", "b", "c...", "d", "c..."])
+        self.assertEqual([run[:2] for run in runs],
+                         [(0, 2), (2, 3), (3, 4), (4, 5)])
+        self.assertEqual([run[2] is None for run in runs],
+                         [True, False, True, False])
+        # Repeated fuzzy lines share a compiled pattern.
+        self.assertIs(runs[1][2], runs[3][2])
+
+    def test_compile_seq__no_fuzz(self):
+        comparer = self._comparer()
+        self.assertEqual(comparer.compile_seq(["a", "b"]), [(0, 2, None)])
+        self.assertEqual(comparer.compile_seq([]), [])
+
+    def test_compare_seqs__equal(self):
+        self.assertIsNone(self._compare("a\nb\nc\n", "a\nb\nc\n"))
+        self.assertIsNone(self._compare("a\nbxyz\nc\n", "a\nb...\nc\n"))
+        self.assertIsNone(self._compare("", ""))
+
+    def test_compare_seqs__exact_run(self):
+        self.assertEqual(self._compare("a\nb\nx\nd\n", "a\nb\nc\nd\n"),
+                         (2, (0, 0)))
+
+    def test_compare_seqs__fuzzy_line(self):
+        self.assertEqual(self._compare("a\nxbc\n", "a\nab...\n"),
+                         (1, (0, 0)))
+
+    def test_compare_seqs__after_fuzzy_line(self):
+        self.assertEqual(self._compare("a...\nb\nc\n", "a...\nb\nd\n"),
+                         (2, (0, 0)))
+
+    def test_compare_seqs__different_lengths(self):
+        self.assertEqual(self._compare("a\nb\n", "a\n"), (1, (None, None)))
+        self.assertEqual(self._compare("", "a\n"), (0, (None, None)))
+
+
 class DifferTestCase(unittest.TestCase):
 
     def _differ(self, fuzz="..."):
@@ -0,0 +1,152 @@
+# encoding: utf-8
+#
+# Copyright (C) 2012 Chris Jerdonek. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * The names of the copyright holders may not be used to endorse or promote
+#   products derived from this software without specific prior written
+#   permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Exposes benchmarks of rendering performance as tests.
+
+"""
+
+from __future__ import absolute_import
+
+import json
+import os
+import unittest
+
+from molt.test.harness import config_load_tests, read_dir, SandBoxDirMixin
+from molt.test.harness.benchmark import (benchmark_fuzzy_lines,
+    benchmark_literals, benchmark_startup, measure_render_memory)
+
+# Trigger the load_tests protocol.
+load_tests = config_load_tests
+
+
+class BenchmarkTestCase(unittest.TestCase, SandBoxDirMixin):
+
+    """
+    Runs the benchmarks.
+
+    The timings are logged rather than asserted, since they vary by machine.
+
+    """
+
+    def test_literals(self):
+        with self.sandboxDir() as temp_dir:
+            benchmark_literals(temp_dir)
+            expected = read_dir(os.path.join(temp_dir, 'output'))
+            actual = read_dir(os.path.join(temp_dir, 'output_fast'))
+        self.assertEqual(len(actual), 10000)
+        self.assertEqual(actual, expected)
+
+    def test_fuzzy_lines(self):
+        n = 100000
+        results = benchmark_fuzzy_lines(line_length=n)
+        self.assertEqual(results, [(n, n), (n, n // 2 + 4),
+                                   (n, 5 * (n // 20))])
+
+    def _measure_memory(self, template_dir, temp_dir, file_name):
+        """
+        Render a template with and without streaming, and return the memory.
+
+        Returns a tuple (stream_kb, no_stream_kb, output_kb), skipping the
+        test if the peak memory of a render cannot be measured.
+
+        """
+        stream_dir = os.path.join(temp_dir, 'stream')
+        stream_kb = measure_render_memory(template_dir, stream_dir,
+                                          stream_threshold=64 * 1024)
+        if stream_kb is None:
+            self.skipTest("per-render peak memory not available")
+        no_stream_kb = measure_render_memory(template_dir,
+                                             os.path.join(temp_dir, 'no_stream'),
+                                             stream_threshold=10 ** 10)
+        output_kb = os.path.getsize(os.path.join(stream_dir, file_name)) // 1024
+        return stream_kb, no_stream_kb, output_kb
+
+    def test_stream_memory(self):
+        """
+        Check that streaming bounds the memory used by large sections.
+
+        """
+        # Nested sections give 200,000 lines (about 9 MB) of output from a
+        # small context.
+        context = {'outer': range(400), 'inner': range(500)}
+        with self.sandboxDir() as temp_dir:
+            template_dir = os.path.join(temp_dir, 'template')
+            structure_dir = os.path.join(template_dir, 'structure')
+            os.makedirs(structure_dir)
+            with open(os.path.join(structure_dir, 'rows.txt.mustache'), 'wb') as f:
+                f.write('{{#outer}}{{#inner}}row {{.}} of the table, '
+                        'with some more text\n{{/inner}}{{/outer}}')
+            with open(os.path.join(template_dir, 'sample.json'), 'wb') as f:
+                json.dump({'context': context}, f)
+            stream_kb, no_stream_kb, output_kb = self._measure_memory(
+                template_dir, temp_dir, 'rows.txt')
+        self.assertTrue(output_kb > 8000, msg=output_kb)
+        # Rendering the file to a string first takes several times its size.
+        self.assertTrue(no_stream_kb > output_kb, msg=(no_stream_kb, output_kb))
+        self.assertTrue(stream_kb < no_stream_kb // 4, msg=(stream_kb, no_stream_kb))
+
+    def test_source_memory(self):
+        """
+        Check that rendering a large data file source uses bounded memory.
+
+        """
+        with self.sandboxDir() as temp_dir:
+            template_dir = os.path.join(temp_dir, 'template')
+            structure_dir = os.path.join(template_dir, 'structure')
+            os.makedirs(structure_dir)
+            os.mkdir(os.path.join(template_dir, 'data'))
+            with open(os.path.join(template_dir, 'data', 'items.jsonl'), 'wb') as f:
+                for n in xrange(200000):
+                    f.write('%s\n' % json.dumps({'name': 'item %d' % n, 'n': n}))
+            with open(os.path.join(structure_dir, 'items.txt.mustache'), 'wb') as f:
+                f.write('{{#items}}{{n}}: {{name}} in the list\n{{/items}}')
+            with open(os.path.join(template_dir, 'sample.json'), 'wb') as f:
+                json.dump({'context': {'items': {'molt_source': 'data/items.jsonl'}}}, f)
+            stream_kb, no_stream_kb, output_kb = self._measure_memory(
+                template_dir, temp_dir, 'items.txt')
+        self.assertTrue(output_kb > 5000, msg=output_kb)
+        self.assertTrue(no_stream_kb > output_kb, msg=(no_stream_kb, output_kb))
+        self.assertTrue(stream_kb < no_stream_kb // 4, msg=(stream_kb, no_stream_kb))
+
+    def test_startup(self):
+        """
+        Check that modes that do not render skip the slow imports.
+
+        Also check that the arguments are parsed only once.
+
+        """
+        slow_modules = ('molt.diff', 'molt.molter', 'molt.test.harness',
+                        'molt.visualizer', 'pystache', 'tarfile', 'yaml',
+                        'zipfile')
+        for args in (['--version'], ['--help']):
+            seconds, modules, parser_count = benchmark_startup(args)
+            imported = [name for name in modules if name in slow_modules]
+            self.assertEqual(imported, [], msg=args)
+            self.assertEqual(parser_count, 1, msg=args)
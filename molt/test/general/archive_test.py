@@ -0,0 +1,115 @@
+# encoding: utf-8
+#
+# Copyright (C) 2012 Chris Jerdonek. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * The names of the copyright holders may not be used to endorse or promote
+#   products derived from this software without specific prior written
+#   permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Unit tests for archive.py.
+
+"""
+
+from __future__ import absolute_import
+
+import os
+import tarfile
+import time
+import unittest
+import zipfile
+
+from molt.constants import ARCHIVE_EXTENSIONS
+from molt.general.archive import ArchiveWriter, ZIP_EXTENSION, _TAR_MODES
+from molt.general.error import Error
+from molt.test.harness import config_load_tests, SandBoxDirMixin
+
+
+# Trigger the load_tests protocol.
+load_tests = config_load_tests
+
+
+class ArchiveWriterTestCase(unittest.TestCase, SandBoxDirMixin):
+
+    def _write(self, temp_dir, name):
+        """
+        Write an archive and return its path.
+
+        """
+        source_path = os.path.join(temp_dir, 'source.sh')
+        if not os.path.exists(source_path):
+            with open(source_path, 'wb') as f:
+                f.write(b'#!/bin/sh\n')
+            os.chmod(source_path, 0700)
+        path = os.path.join(temp_dir, name)
+        with ArchiveWriter(path) as archive:
+            archive.add_dir('a')
+            archive.add_bytes('a/b.txt', b'abc')
+            archive.add_file('a/c.sh', source_path)
+        return path
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def _assert_reproducible(self, temp_dir, ext):
+        path1 = self._write(temp_dir, 'archive1' + ext)
+        # Check that the current time does not affect the output.
+        time.sleep(1)
+        path2 = self._write(temp_dir, 'archive2' + ext)
+        self.assertEqual(self._read(path1), self._read(path2))
+        return path1
+
+    def test_archive_extensions(self):
+        self.assertEqual(ARCHIVE_EXTENSIONS, sorted(_TAR_MODES) + [ZIP_EXTENSION])
+
+    def test_tar_gz(self):
+        with self.sandboxDir() as temp_dir:
+            path = self._assert_reproducible(temp_dir, '.tar.gz')
+            tar_file = tarfile.open(path)
+            try:
+                self.assertEqual(tar_file.getnames(), ['a', 'a/b.txt', 'a/c.sh'])
+                self.assertTrue(tar_file.getmember('a').isdir())
+                self.assertEqual(tar_file.extractfile('a/b.txt').read(), b'abc')
+                self.assertEqual(tar_file.getmember('a/b.txt').mode, 0644)
+                self.assertEqual(tar_file.getmember('a/c.sh').mode, 0755)
+            finally:
+                tar_file.close()
+
+    def test_zip(self):
+        with self.sandboxDir() as temp_dir:
+            path = self._assert_reproducible(temp_dir, '.zip')
+            zip_file = zipfile.ZipFile(path)
+            try:
+                self.assertEqual(zip_file.namelist(), ['a/', 'a/b.txt', 'a/c.sh'])
+                self.assertEqual(zip_file.read('a/b.txt'), b'abc')
+                self.assertEqual(zip_file.read('a/c.sh'), b'#!/bin/sh\n')
+                self.assertEqual(zip_file.getinfo('a/c.sh').external_attr >> 16 & 0777,
+                                 0755)
+            finally:
+                zip_file.close()
+
+    def test_unsupported_extension(self):
+        with self.sandboxDir() as temp_dir:
+            self.assertRaises(Error, ArchiveWriter, os.path.join(temp_dir, 'foo.rar'))
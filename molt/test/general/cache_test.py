@@ -0,0 +1,142 @@
+# encoding: utf-8
+#
+# Copyright (C) 2012 Chris Jerdonek. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * The names of the copyright holders may not be used to endorse or promote
+#   products derived from this software without specific prior written
+#   permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Unit tests for cache.py.
+
+"""
+
+from __future__ import absolute_import
+
+import os
+import unittest
+
+from molt.general.cache import DiskCache
+from molt.test.harness import config_load_tests, SandBoxDirMixin
+
+
+# Trigger the load_tests protocol.
+load_tests = config_load_tests
+
+
+class DiskCacheTestCase(unittest.TestCase, SandBoxDirMixin):
+
+    def _make_cache(self, temp_dir, max_entries=None):
+        return DiskCache(os.path.join(temp_dir, 'cache'), max_entries=max_entries)
+
+    def test_get__missing(self):
+        with self.sandboxDir() as temp_dir:
+            cache = self._make_cache(temp_dir)
+            self.assertIs(cache.get('abc'), None)
+
+    def test_set(self):
+        with self.sandboxDir() as temp_dir:
+            cache = self._make_cache(temp_dir)
+            cache.set('abc', {'a': [1, 2]})
+            # Check that the value persists across instances.
+            cache = self._make_cache(temp_dir)
+            self.assertEqual(cache.get('abc'), {'a': [1, 2]})
+
+    def test_get__bad_entry(self):
+        with self.sandboxDir() as temp_dir:
+            cache = self._make_cache(temp_dir)
+            cache.set('abc', 'foo')
+            with open(cache._make_path('abc'), 'wb') as f:
+                f.write('not a pickle')
+            self.assertIs(cache.get('abc'), None)
+
+    def test_set__evict(self):
+        """
+        Check that the least recently used entries are evicted.
+
+        """
+        with self.sandboxDir() as temp_dir:
+            cache = self._make_cache(temp_dir, max_entries=2)
+            cache.set('a', 1)
+            cache.set('b', 2)
+            # Make the entries' last use times distinct.
+            os.utime(cache._make_path('a'), (1000, 1000))
+            os.utime(cache._make_path('b'), (2000, 2000))
+            # Using "a" makes "b" the least recently used.
+            self.assertEqual(cache.get('a'), 1)
+            cache.set('c', 3)
+            self.assertEqual(cache.get('a'), 1)
+            self.assertIs(cache.get('b'), None)
+            self.assertEqual(cache.get('c'), 3)
+
+    def test_set__evict_batch(self):
+        """
+        Check that eviction removes entries down to 90% of max_entries.
+
+        """
+        with self.sandboxDir() as temp_dir:
+            cache = self._make_cache(temp_dir, max_entries=20)
+            for index in range(21):
+                cache.set(str(index), index)
+            names = os.listdir(cache.dir_path)
+            self.assertEqual(len(names), 18)
+            self.assertIs(cache.get('2'), None)
+            self.assertEqual(cache.get('3'), 3)
+
+    def test_set__lists_dir_once(self):
+        """
+        Check that writes do not list the cache directory each time.
+
+        """
+        listdir = os.listdir
+        calls = []
+        def count_listdir(path):
+            calls.append(path)
+            return listdir(path)
+        with self.sandboxDir() as temp_dir:
+            cache = self._make_cache(temp_dir, max_entries=5)
+            os.listdir = count_listdir
+            try:
+                for index in range(20):
+                    cache.set(str(index), index)
+            finally:
+                os.listdir = listdir
+            self.assertEqual(len(calls), 1)
+            self.assertEqual(len(listdir(cache.dir_path)), 5)
+
+    def test_index__loaded_by_last_use(self):
+        """
+        Check that a new instance orders existing entries by last use.
+
+        """
+        with self.sandboxDir() as temp_dir:
+            cache = self._make_cache(temp_dir, max_entries=2)
+            cache.set('a', 1)
+            cache.set('b', 2)
+            os.utime(cache._make_path('a'), (2000, 2000))
+            os.utime(cache._make_path('b'), (1000, 1000))
+            cache = self._make_cache(temp_dir, max_entries=2)
+            cache.set('c', 3)
+            self.assertIs(cache.get('b'), None)
+            self.assertEqual(cache.get('a'), 1)
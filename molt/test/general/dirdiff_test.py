@@ -42,7 +42,7 @@ from molt.defaults import DIRCMP_IGNORE
 from molt.diff import match_fuzzy
 from molt.general.dirdiff import compare_files, DirComparer
 import molt.general.dirdiff as dirdiff
-from molt.test.harness import config_load_tests
+from molt.test.harness import config_load_tests, SandBoxDirMixin
 
 
 # Trigger the load_tests protocol.
@@ -157,7 +157,108 @@ class DirComparerTestCase(unittest.TestCase):
 
         self._assert_diff(expected=expected, compare=compare)
 
+    def test_diff__same_if_identical(self):
+        """
+        Check that identical files skip files_same() if the customizer allows.
+
+        """
+        compared = []
+
+        class Custom(dirdiff.Customizer):
+            same_if_identical = True
+            def files_same(self, path1, path2):
+                compared.append(os.path.basename(path1))
+                return False
+
+        differ = DirComparer(ignore=DIRCMP_IGNORE, custom=Custom())
+        dir1, dir2 = (os.path.join(self._data_dir, name) for name in ('dir1', 'dir2'))
+        actual = differ.diff(dir1, dir2)
+
+        self.assertEqual(sorted(compared), ['diff.txt', 'diff2.txt'])
+        expected = (['a.txt', 'b'], ['d'], ['a/diff.txt', 'a/diff2.txt'])
+        self._assert_results(actual, expected)
+
+    def test_diff__jobs(self):
+        """
+        Check that comparing concurrently gives the same results and order.
+
+        """
+        def diff(jobs):
+            notified = []
+
+            class Custom(dirdiff.Customizer):
+                def on_diff_file(self, rel_path, result):
+                    notified.append(rel_path)
+
+            differ = DirComparer(ignore=DIRCMP_IGNORE, custom=Custom(), jobs=jobs)
+            dir1, dir2 = (os.path.join(self._data_dir, name) for name in ('dir1', 'dir2'))
+            return differ.diff(dir1, dir2), notified
+
+        expected = (['a.txt', 'b'], ['d'], ['a/diff.txt', 'a/diff2.txt'])
+        actual, notified = diff(jobs=4)
+        self._assert_results(actual, expected)
+        self.assertEqual(notified, ['a/diff.txt', 'a/diff2.txt'])
+        self.assertEqual(diff(jobs=1), (actual, notified))
+
     def test_diff__directory_not_existing(self):
         differ = DirComparer()
         dir1, dir2 = (os.path.join(self._data_dir, name) for name in ('dir1', 'not_exist'))
         self.assertRaises(OSError, differ.diff, dir1, dir2)
+
+
+class DirComparerWalkTestCase(unittest.TestCase, SandBoxDirMixin):
+
+    def _make_dirs(self, temp_dir, files1, files2):
+        """
+        Create two directories with the given files, and return their paths.
+
+        Parameters:
+
+          files1: a dict mapping relative file paths to file contents.
+
+        """
+        dirs = []
+        for name, files in (('dir1', files1), ('dir2', files2)):
+            dir_path = os.path.join(temp_dir, name)
+            os.mkdir(dir_path)
+            for rel_path, contents in files.items():
+                path = os.path.join(dir_path, rel_path)
+                if not os.path.exists(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                with open(path, 'wb') as f:
+                    f.write(contents)
+            dirs.append(dir_path)
+        return dirs
+
+    def test_iter_diff(self):
+        files1 = {'a': 'a', 'b/c': 'c', 'b/d': 'd', 'e': 'e', 'f/g': 'g'}
+        files2 = {'a': 'x', 'b/c': 'c', 'b/d': 'x', 'e/h': 'h', 'i': 'i'}
+        with self.sandboxDir() as temp_dir:
+            dirs = self._make_dirs(temp_dir, files1, files2)
+            for jobs in (1, 3):
+                differ = DirComparer(jobs=jobs)
+                actual = list(differ.iter_diff(*dirs))
+                # The name "e" is a file in one directory and a directory
+                # in the other, so it is not reported.
+                self.assertEqual(actual, [(dirdiff.DIFF_FILE, 'a'),
+                                          (dirdiff.LEFT_ONLY, 'f'),
+                                          (dirdiff.RIGHT_ONLY, 'i'),
+                                          (dirdiff.DIFF_FILE, 'b/d')], msg=jobs)
+
+    def test_diff__ignore_patterns(self):
+        files1 = {'a.txt': 'a', 'a.pyc': 'a', 'b/c.pyc': 'c'}
+        files2 = {'a.txt': 'a', 'b/d.pyc': 'd'}
+        with self.sandboxDir() as temp_dir:
+            dirs = self._make_dirs(temp_dir, files1, files2)
+            self.assertEqual(DirComparer(ignore=['*.pyc']).diff(*dirs),
+                             ([], [], []))
+            self.assertEqual(DirComparer(ignore=[]).diff(*dirs),
+                             (['a.pyc', 'b/c.pyc'], ['b/d.pyc'], []))
+
+    def test_diff__broken_link(self):
+        with self.sandboxDir() as temp_dir:
+            dirs = self._make_dirs(temp_dir, {'a': 'a'}, {'a': 'a'})
+            for dir_path in dirs:
+                os.symlink(os.path.join(temp_dir, 'missing'),
+                           os.path.join(dir_path, 'link'))
+            self.assertEqual(DirComparer().diff(*dirs), ([], [], []))
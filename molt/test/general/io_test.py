@@ -0,0 +1,182 @@
+# encoding: utf-8
+#
+# Copyright (C) 2012 Chris Jerdonek. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * The names of the copyright holders may not be used to endorse or promote
+#   products derived from this software without specific prior written
+#   permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Unit tests for io.py.
+
+"""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import unittest
+
+from molt.general import io
+from molt.test.harness import config_load_tests, SandBoxDirMixin
+
+
+# Trigger the load_tests protocol.
+load_tests = config_load_tests
+
+
+class ListDirTestCase(unittest.TestCase, SandBoxDirMixin):
+
+    def _list_dir(self, temp_dir, ignore_errors):
+        with open(os.path.join(temp_dir, 'a.txt'), 'wb') as f:
+            f.write(b'abc')
+        os.mkdir(os.path.join(temp_dir, 'sub'))
+        os.symlink(os.path.join(temp_dir, 'missing'),
+                   os.path.join(temp_dir, 'broken'))
+        return sorted(io.list_dir(temp_dir, ignore_errors=ignore_errors))
+
+    @unittest.skipIf(not hasattr(os, 'symlink'), "symlinks not supported")
+    def test_list_dir__ignore_errors(self):
+        scandir = io._scandir
+        try:
+            # Check both with and without scandir().
+            for io._scandir in (scandir, None):
+                with self.sandboxDir() as temp_dir:
+                    entries = self._list_dir(temp_dir, ignore_errors=True)
+                    path = lambda name: os.path.join(temp_dir, name)
+                    self.assertEqual(entries, [
+                        ('a.txt', path('a.txt'), False, 3),
+                        ('broken', path('broken'), False, None),
+                        ('sub', path('sub'), True, 0)])
+                with self.sandboxDir() as temp_dir:
+                    self.assertRaises(OSError, self._list_dir, temp_dir,
+                                      ignore_errors=False)
+        finally:
+            io._scandir = scandir
+
+
+class CopyFileTestCase(unittest.TestCase, SandBoxDirMixin):
+
+    def _copy(self, temp_dir, mode, target_contents=None):
+        """
+        Copy a file with the given mode, and return the source and target paths.
+
+        """
+        source = os.path.join(temp_dir, 'source.txt')
+        target = os.path.join(temp_dir, 'target.txt')
+        with open(source, 'wb') as f:
+            f.write(b'abc')
+        if target_contents is not None:
+            with open(target, 'wb') as f:
+                f.write(target_contents)
+        io.copy_file(source, target, mode)
+        with open(target, 'rb') as f:
+            self.assertEqual(f.read(), b'abc')
+        return source, target
+
+    def test_copy_file__default(self):
+        with self.sandboxDir() as temp_dir:
+            source, target = self._copy(temp_dir, None)
+            self.assertFalse(os.path.samefile(source, target))
+
+    def test_copy_file__copy(self):
+        with self.sandboxDir() as temp_dir:
+            source, target = self._copy(temp_dir, 'copy')
+            self.assertFalse(os.path.samefile(source, target))
+
+    @unittest.skipIf(not sys.platform.startswith('linux'), "Linux only")
+    def test_kernel_copies(self):
+        """
+        Check that each kernel copy function is available and copies.
+
+        """
+        b = os.urandom(300 * 1024)
+        with self.sandboxDir() as temp_dir:
+            source = os.path.join(temp_dir, 'source')
+            with open(source, 'wb') as f:
+                f.write(b)
+            target = os.path.join(temp_dir, 'target')
+            index = 0
+            while True:
+                with open(source, 'rb') as fsrc:
+                    with open(target, 'wb') as fdst:
+                        copies = io._make_kernel_copies(fsrc.fileno(), fdst.fileno())
+                        if index >= len(copies):
+                            break
+                        offset = 0
+                        while offset < len(b):
+                            offset += copies[index](offset, len(b) - offset)
+                with open(target, 'rb') as f:
+                    self.assertEqual(f.read(), b, msg=index)
+                index += 1
+            # Python 2 on Linux has kernel copies through ctypes.
+            self.assertTrue(index > 0)
+
+    def test_copy_file__reflink(self):
+        # Falls back to copying on filesystems without reflink support.
+        with self.sandboxDir() as temp_dir:
+            source, target = self._copy(temp_dir, 'reflink')
+            self.assertFalse(os.path.samefile(source, target))
+
+    def test_copy_file__hardlink(self):
+        with self.sandboxDir() as temp_dir:
+            source, target = self._copy(temp_dir, 'hardlink')
+            self.assertTrue(os.path.samefile(source, target))
+            self.assertFalse(os.path.islink(target))
+
+    def test_copy_file__symlink(self):
+        with self.sandboxDir() as temp_dir:
+            source, target = self._copy(temp_dir, 'symlink')
+            self.assertTrue(os.path.islink(target))
+            self.assertEqual(os.readlink(target), os.path.abspath(source))
+
+    def test_copy_file__existing_target(self):
+        with self.sandboxDir() as temp_dir:
+            self._copy(temp_dir, 'copy', target_contents=b'old contents')
+
+    def test_copy_file__existing_link(self):
+        """
+        Check that copying over a link does not write to the linked file.
+
+        """
+        with self.sandboxDir() as temp_dir:
+            source = os.path.join(temp_dir, 'source.txt')
+            target = os.path.join(temp_dir, 'target.txt')
+            other = os.path.join(temp_dir, 'other.txt')
+            with open(source, 'wb') as f:
+                f.write(b'abc')
+            with open(other, 'wb') as f:
+                f.write(b'xyz')
+            os.link(other, target)
+            io.copy_file(source, target, 'copy')
+            with open(other, 'rb') as f:
+                self.assertEqual(f.read(), b'xyz')
+
+    def test_copy_file__unknown_mode(self):
+        with self.sandboxDir() as temp_dir:
+            source = os.path.join(temp_dir, 'source.txt')
+            with open(source, 'wb') as f:
+                f.write(b'abc')
+            self.assertRaises(ValueError, io.copy_file, source,
+                              os.path.join(temp_dir, 'target.txt'), 'foo')
@@ -36,9 +36,12 @@ from __future__ import absolute_import
 
 import os
 from shutil import copyfile
+import time
 import unittest
 
-from molt.general.popen import call_script
+from molt.general.error import Error
+from molt.general import popen
+from molt.general.popen import call_script, SETSID_COMMAND
 from molt.dirutil import set_executable_bit
 from molt.test.harness import config_load_tests, SandBoxDirMixin
 from molt.test.harness.common import AssertStringMixin
@@ -114,3 +117,39 @@ class CallScriptTestCase(unittest.TestCase, AssertStringMixin, SandBoxDirMixin):
         actual = self._call_script(script_name, 'line1\nline2\n\n')
         expected = u'# line1\n# line2\n# \n'
         self.assertString(actual, expected)
+
+    def test_timeout(self):
+        """
+        Check that a timeout also kills the commands a shell script runs.
+
+        """
+        start_time = time.time()
+        self.assertRaises(Error, call_script, ['/bin/sh', '-c', 'sleep 10; echo done'],
+                          timeout=0.2)
+        self.assertTrue(time.time() - start_time < 5)
+
+    def test_timeout__not_reached(self):
+        stdout, stderr, return_code = call_script(['/bin/sh', '-c', 'cat'], 'foo',
+                                                  timeout=10)
+        self.assertEqual((stdout, return_code), ('foo', 0))
+
+    def test_timeout__no_setsid_command(self):
+        """
+        Check a timeout where the setsid command is not available.
+
+        """
+        paths = popen._command_paths
+        paths[SETSID_COMMAND] = None
+        try:
+            start_time = time.time()
+            self.assertRaises(Error, call_script, ['/bin/sh', '-c', 'sleep 10; echo done'],
+                              timeout=0.2)
+        finally:
+            # Then the command is looked up again.
+            del paths[SETSID_COMMAND]
+        self.assertTrue(time.time() - start_time < 5)
+
+    def test_limits(self):
+        stdout, stderr, return_code = call_script(['/bin/sh', '-c', 'ulimit -v; ulimit -t; cat'],
+                                                  'foo', limits=[('-v', 1048576), ('-t', 5)])
+        self.assertEqual((stdout.split(), return_code), (['1048576', '5', 'foo'], 0))
@@ -0,0 +1,267 @@
+# encoding: utf-8
+#
+# Copyright (C) 2012 Chris Jerdonek. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * The names of the copyright holders may not be used to endorse or promote
+#   products derived from this software without specific prior written
+#   permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Provides benchmarks of rendering performance.
+
+"""
+
+from __future__ import absolute_import
+
+import json
+import os
+from subprocess import Popen, PIPE
+import sys
+import time
+
+from pystache import Renderer as PystacheRenderer
+
+import molt
+from molt.molter import scan_dir, _Renderer
+from molt.templatecache import TemplateCache
+from molt.test.harness.common import test_logger as _log
+
+
+class _TagRenderer(_Renderer):
+
+    """
+    A _Renderer that passes every name and template through Pystache.
+
+    """
+
+    def _render_name(self, name, context):
+        return self.pystacher.render(name, context)
+
+    def _is_literal(self, path):
+        return False
+
+
+def make_structure(structure_dir, file_count, files_per_dir=100):
+    """
+    Write a structure directory of mostly tag-free names and templates.
+
+    One file in each directory has a tag in its name and contents.
+
+    """
+    os.mkdir(structure_dir)
+    for index in range(file_count):
+        dir_path = os.path.join(structure_dir, 'dir%d' % (index // files_per_dir))
+        if not os.path.exists(dir_path):
+            os.mkdir(dir_path)
+        if index % files_per_dir:
+            name, text = 'file%d.txt.mustache' % index, 'File %d\n' % index
+        else:
+            name, text = '{{name}}%d.txt.mustache' % index, 'File {{name}}\n'
+        with open(os.path.join(dir_path, name), 'wb') as f:
+            f.write(text)
+
+
+def _time_render(renderer_class, structure_dir, context, output_dir):
+    """
+    Render a structure, and return the elapsed and user processor seconds.
+
+    Creating the output files takes most of the elapsed time and varies
+    a lot by file system, so the user time (which leaves out the time in
+    the kernel) shows the rendering work more reliably.
+
+    """
+    # Use the same encoding as Molter.
+    pystacher = PystacheRenderer(file_encoding='utf-8')
+    renderer = renderer_class(pystacher, TemplateCache())
+    os.mkdir(output_dir)
+    start_time, start_user = time.time(), os.times()[0]
+    renderer.render(structure_dir, context, output_dir,
+                    structure=scan_dir(structure_dir))
+    return time.time() - start_time, os.times()[0] - start_user
+
+
+def benchmark_literals(temp_dir, file_count=10000):
+    """
+    Time rendering a structure with and without the tag-free fast path.
+
+    Returns a pair (seconds, fast_seconds) of elapsed times and logs the
+    results, including the user processor times.
+
+    """
+    structure_dir = os.path.join(temp_dir, 'structure')
+    make_structure(structure_dir, file_count)
+    context = {'name': 'foo'}
+
+    seconds, user_seconds = _time_render(_TagRenderer, structure_dir, context,
+                                        os.path.join(temp_dir, 'output'))
+    fast_seconds, fast_user_seconds = _time_render(
+        _Renderer, structure_dir, context, os.path.join(temp_dir, 'output_fast'))
+
+    _log.info("rendered %d files: %.2fs, with tag-free fast path: %.2fs (%.1fx); "
+              "user time: %.2fs, with fast path: %.2fs (%.1fx)" %
+              (file_count, seconds, fast_seconds, seconds / max(fast_seconds, 1e-6),
+               user_seconds, fast_user_seconds,
+               user_seconds / max(fast_user_seconds, 1e-6)))
+
+    return seconds, fast_seconds
+
+
+def fuzzy_line_cases(line_length):
+    """
+    Return a list of (actual, expected) line pairs that fuzzily differ.
+
+    Each line is about line_length characters long, and each pair
+    differs near the end of the lines.
+
+    """
+    half = line_length // 2
+    return [
+        # A difference in the part before the first fuzz.
+        (u"a" * line_length + u"x\n", u"a" * line_length + u"y...\n"),
+        # A long part that only partially occurs in the actual line.
+        (u"a" * line_length + u"x\n", u"a..." + u"a" * half + u"b\n"),
+        # Many short parts, the last of which does not occur.
+        (u"ab" * half + u"\n", u"ab..." * (half // 10) + u"c\n"),
+    ]
+
+
+def benchmark_fuzzy_lines(line_length=100000):
+    """
+    Time locating the difference in long fuzzily-differing lines.
+
+    Returns a list of the (actual_index, expected_index) pairs found,
+    one for each case returned by fuzzy_line_cases(), and logs the
+    timings.
+
+    """
+    # Import locally since the benchmarks above do not need it.
+    from molt.diff import _LineComparer
+    comparer = _LineComparer(fuzz=u"...")
+    results = []
+    for lines in fuzzy_line_cases(line_length):
+        start_time = time.time()
+        results.append(comparer._compare_lines_fuzzy(lines))
+        seconds = time.time() - start_time
+        _log.info("located fuzzy difference in %d-character line: %.3fs" %
+                  (len(lines[0]), seconds))
+    return results
+
+
+# The code run by benchmark_startup().  It reports the time to import and
+# run the molt command's main function, the modules imported, and how many
+# argument parsers were created.
+_STARTUP_SCRIPT = """\
+import json
+import sys
+import time
+start_time = time.time()
+from molt.scripts.molt import argparsing
+from molt.scripts.molt.main import run_molt
+create_parser = argparsing._create_parser
+parser_count = [0]
+def count_parser(*args, **kwargs):
+    parser_count[0] += 1
+    return create_parser(*args, **kwargs)
+argparsing._create_parser = count_parser
+try:
+    run_molt(['molt'] + sys.argv[1:])
+except SystemExit:
+    # For example, the help option exits.
+    pass
+seconds = time.time() - start_time
+modules = sorted(name for name, module in sys.modules.items() if module is not None)
+sys.stdout.write('\\n' + json.dumps({'seconds': seconds, 'modules': modules,
+                                     'parsers': parser_count[0]}))
+"""
+
+
+def _run_script(script, args):
+    """
+    Run Python code in a new process, and return the JSON on its last line.
+
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.path.dirname(os.path.dirname(os.path.abspath(molt.__file__)))
+    # Prevent writing bytecode files to the source tree.
+    env['PYTHONDONTWRITEBYTECODE'] = '1'
+    proc = Popen([sys.executable, '-c', script] + list(args),
+                 stdout=PIPE, stderr=PIPE, env=env)
+    stdout, stderr = proc.communicate()
+    if proc.returncode:
+        raise Exception("script failed with status %s:\n%s" %
+                        (proc.returncode, stderr))
+    return json.loads(stdout.splitlines()[-1])
+
+
+def benchmark_startup(args):
+    """
+    Run the molt command in a new process, and return its startup stats.
+
+    Returns a (seconds, modules, parser_count) tuple: the time to import
+    and run the main function, the names of the modules imported, and
+    the number of argument parsers created.
+
+    """
+    start_time = time.time()
+    result = _run_script(_STARTUP_SCRIPT, args)
+    total_seconds = time.time() - start_time
+    _log.info("molt %s: main %.3fs, process %.3fs, %d modules" %
+              (' '.join(args), result['seconds'], total_seconds,
+               len(result['modules'])))
+    return result['seconds'], result['modules'], result['parsers']
+
+
+# The code run by measure_render_memory().  It reports the most memory
+# used while rendering, in kilobytes, above the memory in use before.
+_MEMORY_SCRIPT = """\
+import json
+import os
+import sys
+from molt.molter import Molter, _read_proc_memory, _reset_peak_memory
+template_dir, output_dir, stream_threshold = sys.argv[1:]
+os.mkdir(output_dir)
+molter = Molter(stream_threshold=int(stream_threshold))
+start_kb = _reset_peak_memory()
+molter.molt(template_dir, output_dir)
+kb = None if start_kb is None else _read_proc_memory()[1] - start_kb
+sys.stdout.write('\\n' + json.dumps({'kb': kb}))
+"""
+
+
+def measure_render_memory(template_dir, output_dir, stream_threshold):
+    """
+    Render a template in a new process, and return the memory it took.
+
+    Returns the most resident memory used while rendering, in kilobytes,
+    above the memory in use beforehand, or None if the peak memory
+    cannot be reset (which requires Linux).  The process renders only
+    this template, so for a template of one file, this is the memory
+    used to render that file.
+
+    """
+    result = _run_script(_MEMORY_SCRIPT,
+                         [template_dir, output_dir, str(stream_threshold)])
+    _log.info("rendered %s with stream threshold %s: peak memory +%s KB" %
+              (template_dir, stream_threshold, result['kb']))
+    return result['kb']
@@ -60,6 +60,22 @@ def indent(text, prefix):
     return "".join(lines)
 
 
+def read_dir(dir_path):
+    """
+    Return a dictionary mapping relative file paths to file contents.
+
+    The contents are bytes.
+
+    """
+    contents = {}
+    for root, dir_names, file_names in os.walk(dir_path):
+        for name in file_names:
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                contents[os.path.relpath(path, dir_path)] = f.read()
+    return contents
+
+
 def _make_message(actual, expected, format_msg, description=None):
     """
     Return the text to pass as the msg argument to a self.assert*() method.
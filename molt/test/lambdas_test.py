@@ -0,0 +1,388 @@
+# encoding: utf-8
+#
+# Copyright (C) 2012 Chris Jerdonek. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * The names of the copyright holders may not be used to endorse or promote
+#   products derived from this software without specific prior written
+#   permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Unit tests for lambdas.py.
+
+"""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+import unittest
+
+from molt.general.error import Error
+from molt.lambdas import (has_batch_lambdas, load_lambdas, read_directives,
+                          LambdaCache, LambdaDispatcher, PythonLambda,
+                          ScriptLambda)
+from molt.test.harness import config_load_tests, SandBoxDirMixin
+
+
+# Trigger the load_tests protocol.
+load_tests = config_load_tests
+
+# A persistent lambda that answers with its process ID and its input.
+# It exits after answering a request for "exit".
+PERSISTENT_SCRIPT = """\
+#!%s
+# molt-lambda: persistent
+import os
+import sys
+while True:
+    header = sys.stdin.readline()
+    if not header:
+        break
+    b = sys.stdin.read(int(header))
+    if b == 'exit':
+        break
+    b = '%%d:%%s' %% (os.getpid(), b)
+    sys.stdout.write('%%d\\n%%s' %% (len(b), b))
+    sys.stdout.flush()
+""" % sys.executable
+
+
+# A batch script that upper-cases its inputs, and logs the number of
+# inputs of each run to the file LOG_PATH.
+BATCH_SCRIPT = """\
+#!%s
+# molt-lambda: batch
+import sys
+count = int(sys.stdin.readline())
+bs = [sys.stdin.read(int(sys.stdin.readline())) for n in range(count)]
+with open(LOG_PATH, 'ab') as f:
+    f.write('%%d\\n' %% count)
+sys.stdout.write('%%d\\n' %% count)
+for b in bs:
+    sys.stdout.write('%%d\\n%%s' %% (len(b), b.upper()))
+""" % sys.executable
+
+
+def write_batch_script(path, log_path):
+    write_script(path, BATCH_SCRIPT.replace('LOG_PATH', repr(log_path)))
+
+
+def write_script(path, text):
+    with open(path, 'wb') as f:
+        f.write(text)
+    os.chmod(path, 0755)
+
+
+class ReadDirectivesTestCase(unittest.TestCase, SandBoxDirMixin):
+
+    def test(self):
+        with self.sandboxDir() as temp_dir:
+            path = os.path.join(temp_dir, 'script.sh')
+            write_script(path, "#!/bin/sh\n# molt-lambda: persistent timeout=5\ncat\n")
+            self.assertEqual(read_directives(path), {'persistent': True,
+                                                     'timeout': '5'})
+
+    def test_none(self):
+        with self.sandboxDir() as temp_dir:
+            path = os.path.join(temp_dir, 'script.sh')
+            write_script(path, "#!/bin/sh\ncat\n")
+            self.assertEqual(read_directives(path), {})
+
+
+class ScriptLambdaTestCase(unittest.TestCase, SandBoxDirMixin):
+
+    def test_call(self):
+        with self.sandboxDir() as temp_dir:
+            path = os.path.join(temp_dir, 'upper.sh')
+            write_script(path, "#!/bin/sh\ntr a-z A-Z\n")
+            func = ScriptLambda(path)
+            self.assertEqual(func(u'abc'), u'ABC')
+            self.assertEqual(func(), u'')
+
+    def test_call__persistent(self):
+        with self.sandboxDir() as temp_dir:
+            path = os.path.join(temp_dir, 'pid.py')
+            write_script(path, PERSISTENT_SCRIPT)
+            func = ScriptLambda(path)
+            try:
+                results = [func(u'a'), func(u'\xe9\n')]
+            finally:
+                func.close()
+        pid1, text1 = results[0].split(u':', 1)
+        pid2, text2 = results[1].split(u':', 1)
+        # Check that one process answered both calls.
+        self.assertEqual(pid1, pid2)
+        self.assertEqual([text1, text2], [u'a', u'\xe9\n'])
+
+    def test_call__persistent__exited(self):
+        with self.sandboxDir() as temp_dir:
+            path = os.path.join(temp_dir, 'pid.py')
+            write_script(path, PERSISTENT_SCRIPT)
+            func = ScriptLambda(path)
+            try:
+                self.assertRaises(Error, func, u'exit')
+                # Check that a new worker replaces the one that exited.
+                self.assertIn(u':a', func(u'a'))
+            finally:
+                func.close()
+
+    def test_call__timeout(self):
+        with self.sandboxDir() as temp_dir:
+            path = os.path.join(temp_dir, 'slow.sh')
+            write_script(path, "#!/bin/sh\n# molt-lambda: timeout=0.2\nsleep 10\n")
+            func = ScriptLambda(path)
+            start_time = time.time()
+            self.assertRaises(Error, func, u'a')
+        self.assertTrue(time.time() - start_time < 5)
+
+    def test_call__timeout__persistent(self):
+        with self.sandboxDir() as temp_dir:
+            path = os.path.join(temp_dir, 'slow.sh')
+            write_script(path, "#!/bin/sh\n# molt-lambda: persistent timeout=0.2\n"
+                         "sleep 10\n")
+            func = ScriptLambda(path)
+            try:
+                self.assertRaises(Error, func, u'a')
+            finally:
+                func.close()
+
+    def test_call__max_memory(self):
+        with self.sandboxDir() as temp_dir:
+            path = os.path.join(temp_dir, 'limits.sh')
+            write_script(path, "#!/bin/sh\n# molt-lambda: max-memory=1024 max-cpu=5\n"
+                         "ulimit -v; ulimit -t\n")
+            func = ScriptLambda(path)
+            self.assertEqual(func().split(), [u'1048576', u'5'])
+
+    def test_init__invalid_directive(self):
+        with self.sandboxDir() as temp_dir:
+            path = os.path.join(temp_dir, 'script.sh')
+            write_script(path, "#!/bin/sh\n# molt-lambda: timeout=soon\ncat\n")
+            self.assertRaises(Error, ScriptLambda, path)
+
+    def test_stats(self):
+        with self.sandboxDir() as temp_dir:
+            path = os.path.join(temp_dir, 'upper.sh')
+            write_script(path, "#!/bin/sh\ntr a-z A-Z\n")
+            func = ScriptLambda(path)
+            func(u'abc')
+            func(u'\xe9')
+        stats = func.stats.to_dict()
+        self.assertTrue(stats['max_seconds'] <= stats['total_seconds'])
+        del stats['max_seconds'], stats['total_seconds']
+        self.assertEqual(stats, {'calls': 2, 'bytes_in': 5, 'bytes_out': 5})
+
+    def test_call_many__batch(self):
+        cache = LambdaCache()
+        with self.sandboxDir() as temp_dir:
+            path = os.path.join(temp_dir, 'upper.py')
+            log_path = os.path.join(temp_dir, 'log.txt')
+            write_batch_script(path, log_path)
+            func = ScriptLambda(path, cache=cache)
+            self.assertEqual(func.call_many([u'a', u'\xe9', u'']), [u'A', u'\xe9', u''])
+            # Check that only the inputs not cached are sent.
+            self.assertEqual(func.call_many([u'a', u'b']), [u'A', u'B'])
+            self.assertEqual(func(u'c'), u'C')
+            with open(log_path, 'rb') as f:
+                self.assertEqual(f.read().split(), ['3', '1', '1'])
+        self.assertEqual(func.stats.calls, 6)
+
+    def test_call_many__batch__wrong_count(self):
+        with self.sandboxDir() as temp_dir:
+            path = os.path.join(temp_dir, 'script.sh')
+            write_script(path, "#!/bin/sh\n# molt-lambda: batch\nprintf '1\\n1\\nx'\n")
+            func = ScriptLambda(path)
+            self.assertEqual(func.call_many([u'a']), [u'x'])
+            self.assertRaises(Error, func.call_many, [u'a', u'b'])
+
+    def _write_counter(self, temp_dir, directives=''):
+        """
+        Write a script that appends to a log file each time it runs.
+
+        """
+        path = os.path.join(temp_dir, 'counter.sh')
+        log_path = os.path.join(temp_dir, 'log.txt')
+        write_script(path, "#!/bin/sh\n%s\necho x >> %s\ncat\n" %
+                     (directives, log_path))
+        return path, log_path
+
+    def _count_runs(self, log_path):
+        with open(log_path, 'rb') as f:
+            return len(f.read().splitlines())
+
+    def test_call__cache(self):
+        cache = LambdaCache()
+        with self.sandboxDir() as temp_dir:
+            path, log_path = self._write_counter(temp_dir)
+            func = ScriptLambda(path, cache=cache)
+            self.assertEqual([func(u'a'), func(u'b'), func(u'a')], [u'a', u'b', u'a'])
+            self.assertEqual(self._count_runs(log_path), 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_call__cache__impure(self):
+        cache = LambdaCache()
+        with self.sandboxDir() as temp_dir:
+            path, log_path = self._write_counter(temp_dir, '# molt-lambda: impure')
+            func = ScriptLambda(path, cache=cache)
+            func(u'a')
+            func(u'a')
+            self.assertEqual(self._count_runs(log_path), 2)
+
+    def test_call__cache__disk(self):
+        with self.sandboxDir() as temp_dir:
+            cache_dir = os.path.join(temp_dir, 'cache')
+            path, log_path = self._write_counter(temp_dir)
+            ScriptLambda(path, cache=LambdaCache(cache_dir))(u'a')
+            cache = LambdaCache(cache_dir)
+            self.assertEqual(ScriptLambda(path, cache=cache)(u'a'), u'a')
+            self.assertEqual(self._count_runs(log_path), 1)
+        self.assertEqual(cache.disk_hits, 1)
+
+    def test_call__cache__script_changed(self):
+        cache = LambdaCache()
+        with self.sandboxDir() as temp_dir:
+            path = os.path.join(temp_dir, 'script.sh')
+            write_script(path, "#!/bin/sh\necho -n 1\n")
+            self.assertEqual(ScriptLambda(path, cache=cache)(u'a'), u'1')
+            write_script(path, "#!/bin/sh\necho -n 2\n")
+            self.assertEqual(ScriptLambda(path, cache=cache)(u'a'), u'2')
+
+    def test_cache__evict(self):
+        cache = LambdaCache(max_entries=2)
+        for key in 'abc':
+            cache.set(key, key.upper(), 0)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('c'), 'C')
+
+    def test_load_lambdas(self):
+        with self.sandboxDir() as temp_dir:
+            write_script(os.path.join(temp_dir, 'upper.sh'), "#!/bin/sh\ntr a-z A-Z\n")
+            write_script(os.path.join(temp_dir, 'script.py'), "#!/bin/sh\ncat\n")
+            write_script(os.path.join(temp_dir, 'module.py'),
+                         "def render(text):\n    return text * 2\n")
+            write_script(os.path.join(temp_dir, '.DS_Store'), "")
+            lambdas = load_lambdas(temp_dir)
+            self.assertEqual(sorted(lambdas), [u'module', u'script', u'upper'])
+            self.assertEqual(type(lambdas[u'module']), PythonLambda)
+            self.assertEqual(type(lambdas[u'script']), ScriptLambda)
+            self.assertEqual(lambdas[u'module'](u'ab'), u'abab')
+            # Check that no bytecode file was written.
+            self.assertEqual(len(os.listdir(temp_dir)), 4)
+
+
+class PythonLambdaTestCase(unittest.TestCase, SandBoxDirMixin):
+
+    def _make_lambda(self, temp_dir, source):
+        path = os.path.join(temp_dir, 'module.py')
+        with open(path, 'wb') as f:
+            f.write(source)
+        return PythonLambda(path)
+
+    def test_call(self):
+        with self.sandboxDir() as temp_dir:
+            func = self._make_lambda(temp_dir, "import os\n"
+                                     "def render(text):\n"
+                                     "    return text.upper().encode('utf-8')\n")
+        self.assertEqual(func(u'\xe9'), u'\xc9')
+        self.assertEqual(func(), u'')
+
+    def test_missing_function(self):
+        with self.sandboxDir() as temp_dir:
+            self.assertRaises(Error, self._make_lambda, temp_dir, "x = 1\n")
+
+    def test_syntax_error(self):
+        with self.sandboxDir() as temp_dir:
+            self.assertRaises(Error, self._make_lambda, temp_dir, "def render(:\n")
+
+
+class LambdaDispatcherTestCase(unittest.TestCase, SandBoxDirMixin):
+
+    def _wrap(self, temp_dir, dispatcher, script):
+        path = os.path.join(temp_dir, 'script.sh')
+        write_script(path, script)
+        return dispatcher.wrap({'upper': ScriptLambda(path), 'name': 'foo'})
+
+    def test_splice(self):
+        dispatcher = LambdaDispatcher(4)
+        with self.sandboxDir() as temp_dir:
+            context = self._wrap(temp_dir, dispatcher, "#!/bin/sh\ntr a-z A-Z\n")
+            self.assertEqual(context['name'], 'foo')
+            upper = lambda u: context['upper'].call_section(u, (u'{{', u'}}'))
+            u = u'%s %s %s' % (upper(u'a'), upper(u'b'), upper(u'a'))
+            self.assertEqual(dispatcher.splice(u'x'), u'x')
+            dispatcher.run()
+        self.assertEqual(dispatcher.splice(u), u'A B A')
+        # Check that the repeat call was run only once.
+        self.assertEqual(len(dispatcher._results), 2)
+
+    def test_splice__tag(self):
+        dispatcher = LambdaDispatcher(4)
+        with self.sandboxDir() as temp_dir:
+            context = self._wrap(temp_dir, dispatcher, "#!/bin/sh\nprintf '{{x}}'\n")
+            u = context['upper'].call_section(u'a', (u'{{', u'}}'))
+            dispatcher.run()
+        self.assertEqual(dispatcher.splice(u), None)
+
+    def test_splice__delimiters(self):
+        """
+        Check that splicing checks for the delimiters in effect at each call.
+
+        """
+        dispatcher = LambdaDispatcher(4)
+        with self.sandboxDir() as temp_dir:
+            context = self._wrap(temp_dir, dispatcher, "#!/bin/sh\nprintf '<%%x%%>'\n")
+            u1 = context['upper'].call_section(u'a', (u'{{', u'}}'))
+            u2 = context['upper'].call_section(u'b', (u'<%', u'%>'))
+            u3 = context['upper'](u'c')
+            dispatcher.run()
+        self.assertEqual(dispatcher.splice(u1), u'<%x%>')
+        self.assertEqual(dispatcher.splice(u2), None)
+        # Delimiters that are not known are never spliced.
+        self.assertEqual(dispatcher.splice(u3), None)
+
+    def test_wrap__lazy(self):
+        """
+        Check that lazily loaded scripts are deferred and run concurrently.
+
+        """
+        dispatcher = LambdaDispatcher(4)
+        with self.sandboxDir() as temp_dir:
+            write_script(os.path.join(temp_dir, 'slow.sh'),
+                         "#!/bin/sh\nsleep 0.5\ncat\n")
+            write_batch_script(os.path.join(temp_dir, 'batch.py'),
+                               os.path.join(temp_dir, 'log.txt'))
+            lambdas = load_lambdas(temp_dir, names=[])
+            self.assertTrue(has_batch_lambdas(lambdas))
+            # Checking for batch scripts does not load them.
+            self.assertEqual(lambdas['batch']._func, None)
+            context = dispatcher.wrap(lambdas)
+            start_time = time.time()
+            us = [context['slow'].call_section(u'%d' % n, (u'{{', u'}}')) for
+                  n in range(4)]
+            dispatcher.run()
+            elapsed = time.time() - start_time
+        self.assertEqual([dispatcher.splice(u) for u in us], [u'0', u'1', u'2', u'3'])
+        # Running the calls one at a time would take at least 2 seconds.
+        self.assertTrue(elapsed < 1.5, elapsed)
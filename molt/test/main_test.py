@@ -46,8 +46,8 @@ class MockLogging(object):
 
     """Mock logging for testing purposes."""
 
-    def configure_logging(self, sys_argv):
-        self.argv = sys_argv
+    def configure_logging(self, ns):
+        self.ns = ns
         return None, None, None
 
 
@@ -82,5 +82,5 @@ class MainTestCase(unittest.TestCase):
         result = run_molt(sys_argv, configure_logging=self.logging.configure_logging,
                           process_args=process_args)
         self.assertEquals(result, 1)
-        self.assertTrue(self.logging.argv is sys_argv)
+        self.assertTrue(self.logging.ns is not None)
 
@@ -32,9 +32,57 @@ Unit tests for molter.py.
 
 """
 
+import json
+import os
+import tarfile
+import time
 import unittest
 
-from molt.molter import preprocess_filename
+from molt.general.error import Error
+from molt.manifest import MANIFEST_FILE_NAME
+from molt.molter import preprocess_filename, Molter
+from molt.test.harness import config_load_tests, read_dir, SandBoxDirMixin
+from molt.test.lambdas_test import (write_batch_script, write_script,
+                                    PERSISTENT_SCRIPT)
+
+
+# Trigger the load_tests protocol.
+load_tests = config_load_tests
+
+
+def _write_files(dir_path, files):
+    for rel_path, text in files.items():
+        path = os.path.join(dir_path, rel_path)
+        parent_dir = os.path.dirname(path)
+        if not os.path.exists(parent_dir):
+            os.makedirs(parent_dir)
+        with open(path, 'wb') as f:
+            f.write(text.encode('utf-8'))
+
+
+def _write_config(path, context):
+    with open(path, 'wb') as f:
+        json.dump({'context': context}, f)
+
+
+def _write_template(template_dir, structure, context=None, partials=None):
+    """
+    Create a template directory.
+
+    Arguments:
+
+      structure: a dictionary mapping structure paths relative to the
+        structure directory to file contents.
+
+      partials: a dictionary mapping partial file names to file contents.
+
+    """
+    if context is None:
+        context = {}
+    _write_files(os.path.join(template_dir, 'structure'), structure)
+    if partials is not None:
+        _write_files(os.path.join(template_dir, 'partials'), partials)
+    _write_config(os.path.join(template_dir, 'sample.json'), context)
 
 
 class PreprocessFileNameTestCase(unittest.TestCase):
@@ -48,3 +96,536 @@ class PreprocessFileNameTestCase(unittest.TestCase):
         self._assert('README.md', ('README.md', False))
         self._assert('README.md.mustache', ('README.md', True))
         self._assert('README.skip.mustache', ('README.mustache', False))
+
+
+class MolterTestCase(unittest.TestCase, SandBoxDirMixin):
+
+    """Test the Molter class."""
+
+    structure = {
+        'README.md.mustache': u'Hello, {{name}}!\n',
+        'copy.txt': u'{{name}}\n',
+        '{{name}}/a.txt.mustache': u'a: {{name}}\n',
+        '{{name}}/sub/b.txt.mustache': u'b: {{#items}}{{.}} {{/items}}\n',
+        'empty/{{name}}.txt': u'',
+    }
+
+    context = {'name': 'foo', 'items': [1, 2, 3]}
+
+    def _molt(self, temp_dir, name, **kwargs):
+        template_dir = os.path.join(temp_dir, 'template')
+        output_dir = os.path.join(temp_dir, name)
+        os.mkdir(output_dir)
+        molter = Molter(**kwargs)
+        molter.molt(template_dir=template_dir, output_dir=output_dir)
+        return read_dir(output_dir)
+
+    def test_molt__jobs(self):
+        """
+        Check that rendering with several jobs matches rendering serially.
+
+        """
+        with self.sandboxDir() as temp_dir:
+            _write_template(os.path.join(temp_dir, 'template'),
+                            self.structure, self.context)
+            expected = self._molt(temp_dir, 'serial')
+            actual = self._molt(temp_dir, 'parallel', jobs=4)
+        self.assertEqual(actual, expected)
+        self.assertEqual(expected['foo/sub/b.txt'], 'b: 1 2 3 \n')
+
+    def test_molt__jobs__error(self):
+        """
+        Check that a rendering error in a worker reports the failing path.
+
+        """
+        structure = dict(self.structure)
+        structure['bad.txt.mustache'] = u'{{#name}}{{/other}}'
+        with self.sandboxDir() as temp_dir:
+            _write_template(os.path.join(temp_dir, 'template'), structure,
+                            self.context)
+            try:
+                self._molt(temp_dir, 'parallel', jobs=4)
+            except Error, err:
+                self.assertIn('bad.txt.mustache', str(err))
+            else:
+                raise AssertionError("Error not raised")
+
+    def test_molt__stream_threshold(self):
+        """
+        Check that streaming rendered files matches not streaming.
+
+        """
+        structure = dict(self.structure)
+        structure['b.txt.mustache'] = u'{{#items}}\xe9 {{.}}\n{{/items}}{{>x}}'
+        with self.sandboxDir() as temp_dir:
+            _write_template(os.path.join(temp_dir, 'template'), structure,
+                            self.context)
+            expected = self._molt(temp_dir, 'string')
+            actual = self._molt(temp_dir, 'stream', stream_threshold=0)
+        self.assertEqual(actual, expected)
+        self.assertEqual(actual['b.txt'], u'\xe9 1\n\xe9 2\n\xe9 3\n'.encode('utf-8'))
+
+    def test_molt__stream_threshold__sections(self):
+        """
+        Check streaming nested, inverted, and partial sections.
+
+        """
+        structure = dict(self.structure)
+        structure['c.txt.mustache'] = (
+            u'{{#rows}}{{#items}}{{.}}{{/items}}\n  {{>row}}\n{{/rows}}'
+            u'{{^missing}}none{{/missing}}{{^items}}x{{/items}}\n')
+        context = dict(self.context, rows=[{'n': 1}, {'n': 2}])
+        partials = {'row.mustache': u'{{#n}}n={{n}}\n{{/n}}end'}
+        with self.sandboxDir() as temp_dir:
+            _write_template(os.path.join(temp_dir, 'template'), structure,
+                            context, partials=partials)
+            expected = self._molt(temp_dir, 'string')
+            # This threshold starts streaming partway through the file.
+            actual = self._molt(temp_dir, 'stream', stream_threshold=10)
+        self.assertEqual(actual, expected)
+        self.assertEqual(actual['c.txt'],
+                         '123\n  n=1\n  end123\n  n=2\n  endnone\n')
+
+    def test_molt__copy_mode(self):
+        """
+        Check that linking non-template files matches copying them.
+
+        """
+        with self.sandboxDir() as temp_dir:
+            _write_template(os.path.join(temp_dir, 'template'),
+                            self.structure, self.context)
+            expected = self._molt(temp_dir, 'copy')
+            for mode in ('reflink', 'hardlink', 'symlink'):
+                actual = self._molt(temp_dir, mode, copy_mode=mode)
+                self.assertEqual(actual, expected)
+            self.assertTrue(os.path.islink(os.path.join(temp_dir, 'symlink', 'copy.txt')))
+            self.assertFalse(os.path.islink(os.path.join(temp_dir, 'symlink', 'README.md')))
+
+    def test_molt__literals(self):
+        """
+        Check rendering templates and names that contain no tags.
+
+        """
+        structure = {
+            'cafe.txt.mustache': u'caf\xe9\n',
+            'plain/a.txt.mustache': u'a\n',
+            'bad.txt.mustache': u'',
+        }
+        with self.sandboxDir() as temp_dir:
+            template_dir = os.path.join(temp_dir, 'template')
+            _write_template(template_dir, structure, self.context)
+            actual = self._molt(temp_dir, 'output')
+            self.assertEqual(actual, {
+                'cafe.txt': u'caf\xe9\n'.encode('utf-8'),
+                os.path.join('plain', 'a.txt'): 'a\n',
+                'bad.txt': '',
+            })
+            # Check that undecodable tag-free templates still raise an error.
+            with open(os.path.join(template_dir, 'structure', 'bad.txt.mustache'), 'wb') as f:
+                f.write('\xff')
+            try:
+                self._molt(temp_dir, 'bad')
+            except Exception, err:
+                self.assertIn('UnicodeDecodeError', str(err))
+            else:
+                raise AssertionError("Error not raised")
+
+    def test_molt_archive(self):
+        """
+        Check that rendering to an archive matches rendering to a directory.
+
+        """
+        structure = dict(self.structure)
+        structure['big.txt.mustache'] = u'{{#items}}{{.}}\n{{/items}}'
+        with self.sandboxDir() as temp_dir:
+            template_dir = os.path.join(temp_dir, 'template')
+            _write_template(template_dir, structure, self.context)
+            expected = self._molt(temp_dir, 'output')
+
+            contents = []
+            for name, kwargs in [('serial.tar.gz', {}),
+                                 ('parallel.tar.gz', {'jobs': 4}),
+                                 ('stream.tar.gz', {'stream_threshold': 0})]:
+                path = os.path.join(temp_dir, name)
+                Molter(**kwargs).molt_archive(template_dir, path)
+                with open(path, 'rb') as f:
+                    contents.append(f.read())
+            # Check that the archive does not depend on how it was rendered.
+            self.assertEqual(contents, [contents[0]] * 3)
+
+            tar_file = tarfile.open(os.path.join(temp_dir, 'serial.tar.gz'))
+            try:
+                names = tar_file.getnames()
+                actual = dict((info.name.replace('/', os.sep),
+                               tar_file.extractfile(info).read()) for
+                              info in tar_file.getmembers() if info.isfile())
+            finally:
+                tar_file.close()
+        self.assertEqual(names, sorted(names))
+        self.assertEqual(actual, expected)
+
+    def test_render_to_memory(self):
+        """
+        Check that rendering to memory matches rendering to a directory.
+
+        """
+        with self.sandboxDir() as temp_dir:
+            template_dir = os.path.join(temp_dir, 'template')
+            _write_template(template_dir, self.structure, self.context)
+            expected = self._molt(temp_dir, 'output')
+            expected = dict((path.replace(os.sep, '/'), b) for
+                            path, b in expected.items())
+            names = sorted(os.listdir(temp_dir))
+            actual = Molter(jobs=2).render_to_memory(template_dir)
+            # Check that nothing was written.
+            self.assertEqual(sorted(os.listdir(temp_dir)), names)
+        self.assertEqual(actual, expected)
+
+    def test_render_to_memory__context(self):
+        structure = {'{{name}}.txt.mustache': u'{{#items}}{{.}}{{/items}}'}
+        context = {'name': 'bar', 'items': [1, 2]}
+        with self.sandboxDir() as temp_dir:
+            template_dir = os.path.join(temp_dir, 'template')
+            _write_template(template_dir, structure, self.context)
+            actual = Molter().render_to_memory(template_dir, context=context)
+        self.assertEqual(actual, {'bar.txt': '12'})
+
+    def test_plan(self):
+        structure = {
+            'a.txt.mustache': u'{{#upper}}{{name}}{{/upper}} {{upper}}',
+            'b.txt': u'bb',
+            'sub/{{name}}.txt.mustache': u'{{>part}}',
+        }
+        partials = {'part.mustache': u'{{#items}}{{upper}}{{/items}}'}
+        with self.sandboxDir() as temp_dir:
+            template_dir = os.path.join(temp_dir, 'template')
+            _write_template(template_dir, structure, self.context, partials)
+            lambdas_dir = os.path.join(template_dir, 'lambdas')
+            _write_files(lambdas_dir, {'upper.sh': u'#!/bin/sh\ntr a-z A-Z\n'})
+            os.chmod(os.path.join(lambdas_dir, 'upper.sh'), 0755)
+
+            output_dir = os.path.join(temp_dir, 'output')
+            plan, summary = Molter().plan(template_dir, output_dir)
+            self.assertFalse(os.path.exists(output_dir))
+        ops = sorted((op.kind, os.path.relpath(op.target, output_dir), op.size) for
+                     op in plan)
+        self.assertEqual(ops, [
+            ('copy', 'b.txt', 2),
+            ('mkdir', 'sub', 0),
+            ('render', 'a.txt', 38),
+            ('render', os.path.join('sub', 'foo.txt'), 9),
+        ])
+        self.assertEqual(summary, {'dirs': 1, 'files': 3, 'copied': 1,
+                                   'rendered': 2, 'bytes': 49,
+                                   'lambda_calls': 3})
+
+    def test_index(self):
+        structure = {
+            'a.txt.mustache': u'{{#upper}}{{name}}{{/upper}} {{other.x}}',
+            'b.txt': u'bb',
+            'sub/{{name}}.txt.mustache': u'{{>part}}{{.}}',
+        }
+        partials = {'part.mustache': u'{{#items}}{{>part2}}{{/items}}',
+                    'part2.mustache': u'{{y}}'}
+        with self.sandboxDir() as temp_dir:
+            template_dir = os.path.join(temp_dir, 'template')
+            _write_template(template_dir, structure, self.context, partials)
+            lambdas_dir = os.path.join(template_dir, 'lambdas')
+            _write_files(lambdas_dir, {'upper.sh': u'#!/bin/sh\ntr a-z A-Z\n',
+                                       'unused.py': u'raise Exception()\n'})
+            os.chmod(os.path.join(lambdas_dir, 'upper.sh'), 0755)
+            # The unused lambda would raise an error if loaded.
+            index = Molter().index(template_dir, os.path.join(temp_dir, 'output'))
+        self.assertEqual(index, {
+            'a.txt': {'keys': ['name', 'other'], 'lambdas': ['upper'], 'partials': []},
+            'b.txt': {'keys': [], 'lambdas': [], 'partials': []},
+            os.path.join('sub', 'foo.txt'): {'keys': ['items', 'name', 'y'],
+                                             'lambdas': [],
+                                             'partials': ['part', 'part2']},
+        })
+
+    def test_molt__persistent_lambda(self):
+        structure = dict(('%d.txt.mustache' % n, u'{{#pid}}%d{{/pid}}' % n) for
+                         n in range(10))
+        with self.sandboxDir() as temp_dir:
+            template_dir = os.path.join(temp_dir, 'template')
+            _write_template(template_dir, structure)
+            os.mkdir(os.path.join(template_dir, 'lambdas'))
+            write_script(os.path.join(template_dir, 'lambdas', 'pid.py'),
+                         PERSISTENT_SCRIPT)
+            actual = self._molt(temp_dir, 'output', jobs=4)
+        pids = set()
+        for n in range(10):
+            pid, text = actual['%d.txt' % n].split(':')
+            self.assertEqual(text, str(n))
+            pids.add(pid)
+        # Check that workers were reused.
+        self.assertTrue(len(pids) <= 4)
+
+    def test_molt__lambda_concurrency(self):
+        """
+        Check that lambda calls across files run concurrently.
+
+        """
+        structure = dict(('%d.txt.mustache' % n, u'{{#slow}}%d{{/slow}}' % n) for
+                         n in range(8))
+        structure['copy.txt'] = u'{{#slow}}not rendered{{/slow}}'
+        with self.sandboxDir() as temp_dir:
+            template_dir = os.path.join(temp_dir, 'template')
+            _write_template(template_dir, structure)
+            os.mkdir(os.path.join(template_dir, 'lambdas'))
+            write_script(os.path.join(template_dir, 'lambdas', 'slow.sh'),
+                         "#!/bin/sh\nsleep 0.5\nprintf '['\ncat\nprintf ']'\n")
+            start_time = time.time()
+            actual = self._molt(temp_dir, 'output', lambda_concurrency=8)
+            elapsed = time.time() - start_time
+        expected = dict(('%d.txt' % n, '[%d]' % n) for n in range(8))
+        expected['copy.txt'] = '{{#slow}}not rendered{{/slow}}'
+        self.assertEqual(actual, expected)
+        # Running the calls one at a time would take at least 4 seconds.
+        self.assertTrue(elapsed < 2.5, elapsed)
+
+    def test_molt__lambda_concurrency__tag_result(self):
+        """
+        Check a lambda whose result needs rendering.
+
+        """
+        structure = {
+            'a.txt.mustache': u'{{#tag}}x{{/tag}} {{#tag}}x{{/tag}}',
+            'b.txt.mustache': u'{{name}}',
+        }
+        with self.sandboxDir() as temp_dir:
+            template_dir = os.path.join(temp_dir, 'template')
+            _write_template(template_dir, structure, {'name': 'foo'})
+            os.mkdir(os.path.join(template_dir, 'lambdas'))
+            write_script(os.path.join(template_dir, 'lambdas', 'tag.sh'),
+                         "#!/bin/sh\nprintf '{{name}}-'\ncat\n")
+            expected = self._molt(temp_dir, 'expected')
+            actual = self._molt(temp_dir, 'actual', lambda_concurrency=4)
+        self.assertEqual(actual, expected)
+        self.assertEqual(actual['a.txt'], 'foo-x foo-x')
+
+    def test_molt__lambda_concurrency__set_delimiter(self):
+        """
+        Check a lambda whose result needs rendering under changed delimiters.
+
+        """
+        structure = {'a.txt.mustache': u'{{=<% %>=}}<%#tag%>x<%/tag%>'}
+        with self.sandboxDir() as temp_dir:
+            template_dir = os.path.join(temp_dir, 'template')
+            _write_template(template_dir, structure, {'name': 'foo'})
+            os.mkdir(os.path.join(template_dir, 'lambdas'))
+            write_script(os.path.join(template_dir, 'lambdas', 'tag.sh'),
+                         "#!/bin/sh\nprintf '<%% name %%>-'\ncat\n")
+            expected = self._molt(temp_dir, 'expected')
+            actual = self._molt(temp_dir, 'actual', lambda_concurrency=2)
+        self.assertEqual(expected['a.txt'], 'foo-x')
+        self.assertEqual(actual, expected)
+
+    def test_molt__batch_lambda(self):
+        """
+        Check that a batch lambda runs once for all files.
+
+        """
+        structure = dict(('%d.txt.mustache' % n,
+                          u'{{#upper}}%d{{/upper}}-{{#upper}}x{{/upper}}' % n)
+                         for n in range(5))
+        structure['name.txt.mustache'] = u'{{name}}'
+        with self.sandboxDir() as temp_dir:
+            template_dir = os.path.join(temp_dir, 'template')
+            _write_template(template_dir, structure, {'name': 'foo'})
+            os.mkdir(os.path.join(template_dir, 'lambdas'))
+            log_path = os.path.join(temp_dir, 'log.txt')
+            write_batch_script(os.path.join(template_dir, 'lambdas', 'upper.py'),
+                               log_path)
+            actual = self._molt(temp_dir, 'output', jobs=2)
+            with open(log_path, 'rb') as f:
+                runs = f.read().split()
+        expected = dict(('%d.txt' % n, '%d-X' % n) for n in range(5))
+        expected['name.txt'] = 'foo'
+        self.assertEqual(actual, expected)
+        # The script ran once, for the 5 digits and "x".
+        self.assertEqual(runs, ['6'])
+
+    def test_render_to_memory__batch_lambda(self):
+        """
+        Check that a batch lambda runs once for all files rendered to memory.
+
+        """
+        structure = dict(('%d.txt.mustache' % n, u'{{#upper}}%d{{/upper}}' % n)
+                         for n in range(5))
+        structure['copy.txt'] = u'{{#upper}}not rendered{{/upper}}'
+        with self.sandboxDir() as temp_dir:
+            template_dir = os.path.join(temp_dir, 'template')
+            _write_template(template_dir, structure)
+            os.mkdir(os.path.join(template_dir, 'lambdas'))
+            log_path = os.path.join(temp_dir, 'log.txt')
+            write_batch_script(os.path.join(template_dir, 'lambdas', 'upper.py'),
+                               log_path)
+            actual = Molter(jobs=2, lambda_concurrency=2).render_to_memory(template_dir)
+            with open(log_path, 'rb') as f:
+                runs = f.read().split()
+        expected = dict(('%d.txt' % n, str(n)) for n in range(5))
+        expected['copy.txt'] = '{{#upper}}not rendered{{/upper}}'
+        self.assertEqual(actual, expected)
+        self.assertEqual(runs, ['5'])
+
+    def test_molt__lambda_stats(self):
+        structure = {'a.txt.mustache': u'{{#upper}}a{{/upper}}{{#upper}}bc{{/upper}}'}
+        with self.sandboxDir() as temp_dir:
+            template_dir = os.path.join(temp_dir, 'template')
+            _write_template(template_dir, structure)
+            os.mkdir(os.path.join(template_dir, 'lambdas'))
+            write_script(os.path.join(template_dir, 'lambdas', 'upper.sh'),
+                         "#!/bin/sh\ntr a-z A-Z\n")
+            stats_path = os.path.join(temp_dir, 'stats.json')
+            actual = self._molt(temp_dir, 'output', lambda_stats_path=stats_path)
+            with open(stats_path, 'rb') as f:
+                stats = json.load(f)
+        self.assertEqual(actual, {'a.txt': 'ABC'})
+        self.assertEqual(sorted(stats), ['upper'])
+        self.assertEqual((stats['upper']['calls'], stats['upper']['bytes_in'],
+                          stats['upper']['bytes_out']), (2, 3, 3))
+
+    def test_molt__data_sources(self):
+        structure = {
+            'api.txt.mustache': u'{{#endpoints}}{{method}} {{path}}\n{{/endpoints}}'
+                                u'{{^empty}}none{{/empty}}',
+        }
+        context = {
+            'endpoints': {'molt_source': 'data/endpoints.jsonl'},
+            'empty': {'molt_source': 'data/empty.csv'},
+        }
+        with self.sandboxDir() as temp_dir:
+            template_dir = os.path.join(temp_dir, 'template')
+            _write_template(template_dir, structure, context)
+            _write_files(os.path.join(template_dir, 'data'), {
+                'endpoints.jsonl': u'{"method": "GET", "path": "/a"}\n'
+                                   u'{"method": "PUT", "path": "/b"}\n',
+                'empty.csv': u'method,path\n',
+            })
+            actual = self._molt(temp_dir, 'output')
+        self.assertEqual(actual, {'api.txt': 'GET /a\nPUT /b\nnone'})
+
+    def test_init__jobs__invalid(self):
+        self.assertRaises(Error, Molter, jobs=0)
+
+    def test_init__lambda_concurrency__invalid(self):
+        self.assertRaises(Error, Molter, lambda_concurrency=0)
+
+    def test_molt_many(self):
+        """
+        Check that molt_many() matches calling molt() for each config.
+
+        """
+        structure = dict(self.structure)
+        structure['{{name}}.txt.mustache'] = u'{{>header}}'
+        partials = {'header.mustache': u'# {{name}}\n'}
+        contexts = {
+            'a': {'name': 'foo', 'items': [1]},
+            'b': {'name': 'bar', 'items': []},
+            'c': {'name': 'baz', 'items': [3, 4]},
+        }
+        with self.sandboxDir() as temp_dir:
+            template_dir = os.path.join(temp_dir, 'template')
+            _write_template(template_dir, structure, partials=partials)
+            configs, expected = [], {}
+            for name, context in contexts.items():
+                config_path = os.path.join(temp_dir, name + '.json')
+                _write_config(config_path, context)
+                output_dir = os.path.join(temp_dir, name)
+                os.mkdir(output_dir)
+                configs.append((config_path, output_dir))
+
+                expected_dir = os.path.join(temp_dir, name + '_expected')
+                os.mkdir(expected_dir)
+                Molter().molt(template_dir, expected_dir, config_path=config_path)
+                expected[name] = read_dir(expected_dir)
+
+            molter = Molter()
+            molter.molt_many(template_dir, configs, jobs=2)
+            actual = dict((name, read_dir(os.path.join(temp_dir, name))) for
+                          name in contexts)
+        self.assertEqual(actual, expected)
+        self.assertEqual(actual['c']['baz.txt'], '# baz\n')
+        # Check that each template was parsed only once.
+        self.assertEqual(molter.templates.misses, 4)
+
+
+class MoltIncrementalTestCase(unittest.TestCase, SandBoxDirMixin):
+
+    """Test Molter.molt() with incremental=True."""
+
+    def _molt(self, template_dir, output_dir):
+        Molter().molt(template_dir=template_dir, output_dir=output_dir,
+                      incremental=True)
+        contents = read_dir(output_dir)
+        del contents[MANIFEST_FILE_NAME]
+        return contents
+
+    def _touch_output(self, output_dir, rel_path):
+        """Change an output file to detect whether it gets rewritten."""
+        with open(os.path.join(output_dir, rel_path), 'wb') as f:
+            f.write('stale')
+
+    def test_molt__changed_key(self):
+        """
+        Check that changing a context value renders only the files using it.
+
+        """
+        structure = {
+            'a.txt.mustache': u'{{a}}',
+            'b.txt.mustache': u'{{>b}}',
+            'c.txt.mustache': u'{{#items}}{{.}}{{/items}}',
+            'd.txt': u'd',
+        }
+        partials = {'b.mustache': u'{{b}}'}
+        with self.sandboxDir() as temp_dir:
+            template_dir = os.path.join(temp_dir, 'template')
+            output_dir = os.path.join(temp_dir, 'output')
+            os.mkdir(output_dir)
+            context = {'a': 'a1', 'b': 'b1', 'items': [1, 2]}
+            _write_template(template_dir, structure, context, partials)
+            self._molt(template_dir, output_dir)
+            for name in ('a.txt', 'b.txt', 'c.txt', 'd.txt'):
+                self._touch_output(output_dir, name)
+            context['b'] = 'b2'
+            _write_template(template_dir, {}, context)
+            actual = self._molt(template_dir, output_dir)
+        self.assertEqual(actual, {'a.txt': 'stale', 'b.txt': 'b2',
+                                  'c.txt': 'stale', 'd.txt': 'stale'})
+
+    def test_molt(self):
+        structure = {
+            'a.txt.mustache': u'{{name}}',
+            'b.txt': u'b',
+            'sub/c.txt': u'c',
+        }
+        with self.sandboxDir() as temp_dir:
+            template_dir = os.path.join(temp_dir, 'template')
+            output_dir = os.path.join(temp_dir, 'output')
+            os.mkdir(output_dir)
+            _write_template(template_dir, structure, {'name': 'foo'})
+            actual = self._molt(template_dir, output_dir)
+            self.assertEqual(actual, {'a.txt': 'foo', 'b.txt': 'b',
+                                      os.path.join('sub', 'c.txt'): 'c'})
+
+            # Check that unchanged files are not rendered again.
+            self._touch_output(output_dir, 'a.txt')
+            self._touch_output(output_dir, 'b.txt')
+            actual = self._molt(template_dir, output_dir)
+            self.assertEqual(actual['a.txt'], 'stale')
+
+            # Check that files are rendered when their inputs change.
+            structure = {'b.txt': u'b2', 'sub/c.txt': u'c'}
+            os.remove(os.path.join(template_dir, 'structure', 'a.txt.mustache'))
+            _write_template(template_dir, structure, {'name': 'bar'})
+            actual = self._molt(template_dir, output_dir)
+            self.assertEqual(actual, {'b.txt': 'b2',
+                                      os.path.join('sub', 'c.txt'): 'c'})
+
+            # Check that obsolete directories are removed.
+            os.remove(os.path.join(template_dir, 'structure', 'sub', 'c.txt'))
+            os.rmdir(os.path.join(template_dir, 'structure', 'sub'))
+            self._molt(template_dir, output_dir)
+            self.assertFalse(os.path.exists(os.path.join(output_dir, 'sub')))
@@ -0,0 +1,92 @@
+# encoding: utf-8
+#
+# Copyright (C) 2012 Chris Jerdonek. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * The names of the copyright holders may not be used to endorse or promote
+#   products derived from this software without specific prior written
+#   permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Unit tests for sources.py.
+
+"""
+
+from __future__ import absolute_import
+
+import os
+import unittest
+
+from molt.general.error import Error
+from molt.sources import load_sources, read_csv, read_json_lines, FileSource
+from molt.test.harness import config_load_tests, SandBoxDirMixin
+
+
+# Trigger the load_tests protocol.
+load_tests = config_load_tests
+
+
+def _write_file(path, text):
+    with open(path, 'wb') as f:
+        f.write(text.encode('utf-8'))
+
+
+class LoadSourcesTestCase(unittest.TestCase, SandBoxDirMixin):
+
+    def test_load_sources(self):
+        with self.sandboxDir() as temp_dir:
+            _write_file(os.path.join(temp_dir, 'items.jsonl'),
+                        u'{"name": "\xe9"}\n\n{"name": "b"}\n')
+            data = {'a': [{'items': {'molt_source': 'items.jsonl'}}],
+                    'b': {'molt_source': 'x', 'other': 1}}
+            data = load_sources(data, temp_dir, 'utf-8')
+            source = data['a'][0]['items']
+            self.assertEqual(type(source), FileSource)
+            self.assertEqual(source.read_records, read_json_lines)
+            self.assertEqual(list(source), [{'name': u'\xe9'}, {'name': 'b'}])
+            # Check that the source can be iterated more than once.
+            self.assertEqual(len(list(source)), 2)
+            self.assertTrue(source)
+        # A dictionary with other keys is not a reference.
+        self.assertEqual(data['b'], {'molt_source': 'x', 'other': 1})
+
+    def test_csv(self):
+        with self.sandboxDir() as temp_dir:
+            path = os.path.join(temp_dir, 'items.csv')
+            _write_file(path, u'name,size\n\xe9,1\n"b, c",2\n')
+            self.assertEqual(list(FileSource(path, 'utf-8', read_csv)),
+                             [{u'name': u'\xe9', u'size': u'1'},
+                              {u'name': u'b, c', u'size': u'2'}])
+
+    def test_empty(self):
+        with self.sandboxDir() as temp_dir:
+            path = os.path.join(temp_dir, 'items.jsonl')
+            _write_file(path, u'\n')
+            self.assertFalse(FileSource(path, 'utf-8', read_json_lines))
+
+    def test_invalid(self):
+        with self.sandboxDir() as temp_dir:
+            _write_file(os.path.join(temp_dir, 'items.txt'), u'')
+            for name in ('items.txt', 'missing.jsonl'):
+                self.assertRaises(Error, load_sources, {'molt_source': name},
+                                  temp_dir, 'utf-8')
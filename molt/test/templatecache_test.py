@@ -0,0 +1,122 @@
+# encoding: utf-8
+#
+# Copyright (C) 2012 Chris Jerdonek. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * The names of the copyright holders may not be used to endorse or promote
+#   products derived from this software without specific prior written
+#   permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Unit tests for templatecache.py.
+
+"""
+
+from __future__ import absolute_import
+
+import os
+import unittest
+
+from pystache import Renderer
+
+from molt.templatecache import _make_key, TemplateCache
+from molt.test.harness import config_load_tests, SandBoxDirMixin
+
+
+# Trigger the load_tests protocol.
+load_tests = config_load_tests
+
+
+class TemplateCacheTestCase(unittest.TestCase, SandBoxDirMixin):
+
+    def _write_template(self, temp_dir, text):
+        path = os.path.join(temp_dir, 'template.mustache')
+        with open(path, 'wb') as f:
+            f.write(text.encode('utf-8'))
+        return path
+
+    def _render(self, cache, path):
+        parsed = cache.parse_path(path, 'utf-8', 'strict')
+        return Renderer().render(parsed, {'name': u'world'})
+
+    def test_parse_path(self):
+        with self.sandboxDir() as temp_dir:
+            path = self._write_template(temp_dir, u'Hello, {{name}}!')
+            cache = TemplateCache()
+            self.assertEqual(self._render(cache, path), u'Hello, world!')
+            self.assertEqual(self._render(cache, path), u'Hello, world!')
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_make_key(self):
+        key = _make_key(b'Hello, {{name}}!', 'utf-8')
+        self.assertEqual(len(key), 40)
+        self.assertNotEqual(_make_key(b'Hello, {{name}}!', 'ascii'), key)
+
+    def test_parse_path__changed(self):
+        """
+        Check that entries are keyed by file contents.
+
+        """
+        with self.sandboxDir() as temp_dir:
+            cache = TemplateCache()
+            path = self._write_template(temp_dir, u'Hello, {{name}}!')
+            self._render(cache, path)
+            path = self._write_template(temp_dir, u'Bye, {{name}}!')
+            self.assertEqual(self._render(cache, path), u'Bye, world!')
+            self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+    def test_parse_path__cache_dir(self):
+        """
+        Check that parsed templates persist across instances.
+
+        """
+        with self.sandboxDir() as temp_dir:
+            cache_dir = os.path.join(temp_dir, 'cache')
+            path = self._write_template(temp_dir, u'{{#name}}Hi, {{.}}{{/name}}')
+            self._render(TemplateCache(cache_dir=cache_dir), path)
+            cache = TemplateCache(cache_dir=cache_dir)
+            self.assertEqual(self._render(cache, path), u'Hi, world')
+            self.assertEqual((cache.disk_hits, cache.misses), (1, 0))
+            self.assertTrue(os.path.isdir(os.path.join(cache_dir, 'templates')))
+
+    def test_parse_path__max_entries(self):
+        """
+        Check that the least recently used templates are evicted first.
+
+        """
+        with self.sandboxDir() as temp_dir:
+            cache = TemplateCache(max_entries=2)
+            paths = []
+            for index in range(3):
+                path = os.path.join(temp_dir, 'template%d.mustache' % index)
+                with open(path, 'wb') as f:
+                    f.write((u'Template %d {{name}}' % index).encode('utf-8'))
+                paths.append(path)
+            for path in (paths[0], paths[1], paths[0], paths[2]):
+                self._render(cache, path)
+            self.assertEqual(len(cache._parsed), 2)
+            self.assertEqual((cache.hits, cache.misses), (1, 3))
+            # The second template was the least recently used.
+            self._render(cache, paths[0])
+            self._render(cache, paths[1])
+            self.assertEqual((cache.hits, cache.misses), (2, 4))